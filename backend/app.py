@@ -1,18 +1,29 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import json
 from flask_cors import CORS
-from jsonParsing import parse_messages, get_unique_usernames
-from generateEmbedding import getEmbedding
-from topicModeling import find_favorite_topic
-from pca import pca_to_3
-import numpy as np
-from sklearn.preprocessing import StandardScaler
-from peewee import Model, TextField, SqliteDatabase
-from flask_cors import CORS
-import orm
+import os
+import zipfile
 import ast
 from generateCommentary import create_wrapped_commentary
-from datetime import datetime  # Import datetime to generate conversation ID
+from openai import OpenAIError
+from batchIngestion import ingest, ingest_exports, load_exports, merge_exports, read_exports
+from progressiveIngestion import start_progressive_ingest, get_job, event_stream
+from orm import db, create_tables, ConversationHistory, GlobalConversationHistory, Message
+from peewee import fn, SQL
+from responseStreaming import stream_json_response, json_object_chunks
+from spatialIndex import ensure_global_index
+from responseCache import conversation_cache
+from userSnapshots import SNAPSHOT_METRICS, metric_series
+from dailyRollups import range_stats
+from topicDrift import topic_timeline
+from memoryBudget import MemoryBudget, MemoryBudgetExceeded
+from interactionGraph import INTERACTION_TYPES, latest_graph
+from requestProfiling import install_profiling
+from messageSearch import SEARCH_MAX_PAGE_SIZE, search_messages, top_authors
+from messageVectors import latest_store
+from generateEmbedding import encode_query
+import numpy as np
+from datetime import date, datetime, time, timedelta, timezone
 
 
 def safe_eval_dict(data):
@@ -31,50 +42,10 @@ def safe_eval_dict(data):
 
 app = Flask(__name__)
 CORS(app)
-
-# connect to db
-db = SqliteDatabase("conversationhistory.db")
-
-
-# base model for Peewee models
-class BaseModel(Model):
-    class Meta:
-        database = db
-
-
-# local conversation history: cleared on every file upload
-class ConversationHistory(BaseModel):
-    username = TextField(primary_key=True)
-    favorite_topic = TextField()  
-    keywords = TextField()  # stored as a JSON string
-    stats = TextField()  # stored as a JSON string of all stats
-    embedding = TextField()  # stored as a JSON string of the embedding
-    three_d_embedding = TextField(null=True, default="")  # new column for 3D embedding
-
-    class Meta:
-        table_name = "conversationhistory"
-
-
-# global conversation history to accumulates or updates records over time
-class GlobalConversationHistory(BaseModel):
-    username = TextField(primary_key=True)
-    favorite_topic = TextField()
-    keywords = TextField()
-    stats = TextField()
-    embedding = TextField()
-    three_d_embedding = TextField(null=True, default="")
-    last_conversation = TextField(
-        null=True, default=""
-    ) 
-
-    class Meta:
-        table_name = "globalconversationhistory"
-
+install_profiling(app)  # no-op unless PROFILING_TOKEN is set
 
 # just making sure table exist
-db.connect()
-db.create_tables([ConversationHistory, GlobalConversationHistory], safe=True)
-db.close()
+create_tables()
 
 username = ""
 
@@ -87,146 +58,332 @@ def process_username():
     return jsonify({"message": "Username processed", "username": username}), 200
 
 
+def is_progressive():
+    return request.args.get("progressive", "0").lower() in ("1", "true", "yes")
+
+
+def progressive_response(job):
+    return jsonify({
+        "message": "File received; results will be published progressively.",
+        "job_id": job.id,
+        "status_url": f"/api/upload/{job.id}",
+        "events_url": f"/api/upload/{job.id}/events",
+    }), 202
+
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
     file = request.files.get("file")
     if not file:
         return jsonify({"error": "No file provided"}), 400
 
+    memory_budget = MemoryBudget()
     try:
-        data = json.load(file)
+        file.seek(0, os.SEEK_END)
+        memory_budget.decode_workers([file.tell()], 1)
+        file.seek(0)
+        with memory_budget.stage("decode"):
+            data = json.load(file)
         print("Received JSON")
+    except MemoryBudgetExceeded as e:
+        memory_budget.close()
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
+        memory_budget.close()
         print("Error processing file:", e)
         return jsonify({"error": "Invalid JSON file"}), 400
 
-    db.connect()
-
-    # Clear the conversationhistory table on each new upload
-    ConversationHistory.delete().execute()
-
-    # Generate a unique conversation ID for this file upload
-    conversation_id = datetime.now().isoformat()
-
-    usernames = get_unique_usernames(data)
-
-    for username in usernames:
-        # Compute values for each user
-        topic = find_favorite_topic(username, data)
-        stats = parse_messages(data, username)
-        embedding = getEmbedding(topic, stats)
-
-        favorite_topic_label = topic.get("label")
-        keywords = topic.get("keywords")
+    if is_progressive():
+        return progressive_response(start_progressive_ingest(data, memory_budget=memory_budget))
+    ingest(data, memory_budget=memory_budget)
+    return jsonify({"message": "File received and processed."}), 200
 
-        keywords_str = json.dumps(keywords)
-        stats_str = json.dumps(stats)
-        embedding_str = json.dumps(embedding.tolist())
 
-        # Upsert into ConversationHistory (local table): since we cleared it, we can create new entries.
-        entry = ConversationHistory.create(
-            username=username,
-            favorite_topic=favorite_topic_label,
-            keywords=keywords_str,
-            stats=stats_str,
-            embedding=embedding_str,
-        )
+@app.route("/upload_batch", methods=["POST"])
+def upload_batch():
+    files = request.files.getlist("files")
+    if not files:
+        return jsonify({"error": "No files provided"}), 400
 
-        # For GlobalConversationHistory, update if record exists; otherwise, create new record.
+    try:
+        if is_progressive():
+            memory_budget = MemoryBudget()
+            try:
+                exports = read_exports([(file.filename, file) for file in files])
+                data, _ = merge_exports(load_exports(exports, memory_budget=memory_budget))
+            except Exception:
+                memory_budget.close()
+                raise
+            return progressive_response(start_progressive_ingest(data, memory_budget=memory_budget))
+        summary = ingest_exports([(file.filename, file) for file in files])
+    except MemoryBudgetExceeded as e:
+        return jsonify({"error": str(e)}), 413
+    except (ValueError, zipfile.BadZipFile) as e:
+        print("Error processing files:", e)
+        return jsonify({"error": "Invalid export file"}), 400
+
+    return jsonify({"message": "Files received and processed.", **summary}), 200
+
+
+@app.route("/api/upload/<job_id>", methods=["GET"])
+def get_upload_status(job_id):
+    """
+    Status of a progressive upload. Pass ?since=<event id> to also get the
+    events after it (e.g. which users were refined since the last poll).
+    """
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown upload job"}), 404
+    response = job.state()
+    if request.args.get("since") is not None:
         try:
-            global_entry = GlobalConversationHistory.get(
-                GlobalConversationHistory.username == username
-            )
-            global_entry.favorite_topic = favorite_topic_label
-            global_entry.keywords = keywords_str
-            global_entry.stats = stats_str
-            global_entry.embedding = embedding_str
-            global_entry.last_conversation = (
-                conversation_id  # Update the conversation ID
-            )
-            global_entry.save()
-        except GlobalConversationHistory.DoesNotExist:
-            GlobalConversationHistory.create(
-                username=username,
-                favorite_topic=favorite_topic_label,
-                keywords=keywords_str,
-                stats=stats_str,
-                embedding=embedding_str,
-                last_conversation=conversation_id,  # Set conversation ID for new records
-            )
-
-    # Retrieve all records from ConversationHistory to compute 3D embeddings.
-    records = list(ConversationHistory.select())
-    all_embeddings = []
-    for record in records:
-        embedding_value = json.loads(record.embedding)
-        all_embeddings.append(embedding_value)
-
-    # Convert list of embeddings to a NumPy array.
-    embedding_matrix = np.array(all_embeddings)
-    # Squeeze the matrix in case of extra dimensions.
-    embedding_matrix = (
-        np.squeeze(embedding_matrix, axis=1)
-        if embedding_matrix.ndim > 1 and embedding_matrix.shape[1] == 1
-        else embedding_matrix
-    )
-    scaler = StandardScaler()
-    embedding_matrix = scaler.fit_transform(embedding_matrix)
-
-    resultantMatrix = pca_to_3(embedding_matrix)
-
-    # Update three_d_embedding for both tables based on the conversationhistory records.
-    for i, record in enumerate(records):
-        three_d = resultantMatrix[i]  # a NumPy array with shape (3,)
-        three_d_str = json.dumps(three_d.tolist())
-        record.three_d_embedding = three_d_str
-        record.save()
+            since = max(0, int(request.args["since"]))
+        except ValueError:
+            return jsonify({"error": "since must be an integer"}), 400
+        events = job.events_after(since, timeout=0)
+        response["events"] = [{"id": event_id, "event": event, "data": data} for event_id, event, data in events]
+        response["last_event_id"] = events[-1][0] if events else since
+    return jsonify(response), 200
 
-        # Update corresponding record in GlobalConversationHistory
-        try:
-            global_entry = GlobalConversationHistory.get(
-                GlobalConversationHistory.username == record.username
-            )
-            global_entry.three_d_embedding = three_d_str
-            global_entry.save()
-        except GlobalConversationHistory.DoesNotExist:
-            # Shouldn't happen since we inserted/updated earlier
-            pass
 
-    db.close()
-    return jsonify({"message": "File received and processed."}), 200
+@app.route("/api/upload/<job_id>/events", methods=["GET"])
+def stream_upload_events(job_id):
+    """Server-sent events for a progressive upload; honours Last-Event-ID on reconnect."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown upload job"}), 404
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or request.args.get("since") or 0)
+    except ValueError:
+        last_id = 0
+    return Response(
+        event_stream(job, last_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/getconversationhistory", methods=["GET"])
 def get_conversation_history():
+    """
+    Returns the current user's global record. Decoded records are served from an
+    in-process LRU cache, validated against the row's version; pass ?embedding=0
+    to leave out the raw embedding.
+    """
     global username
     if not username:
         return jsonify({"error": "Username not set"}), 400
 
-    db.connect()
-    try:
-        record = GlobalConversationHistory.get(
-            GlobalConversationHistory.username == username
+    with db.connection_context():
+        current = (
+            GlobalConversationHistory.select(GlobalConversationHistory.version)
+            .where(GlobalConversationHistory.username == username)
+            .tuples()
+            .first()
         )
-    except GlobalConversationHistory.DoesNotExist:
-        db.close()
-        return jsonify({"error": "No conversation history found for username"}), 404
-
-    response = {
-        "username": record.username,
-        "favorite_topic": record.favorite_topic,
-        "keywords": json.loads(record.keywords),
-        "stats": json.loads(record.stats),
-        "embedding": json.loads(record.embedding),
-        "three_d_embedding": json.loads(record.three_d_embedding)
-        if record.three_d_embedding
-        else None,
-        "last_conversation": record.last_conversation,  # Include the conversation ID
-    }
-    db.close()
+        if current is None:
+            return jsonify({"error": "No conversation history found for username"}), 404
+        response = conversation_cache.get_user(username, current[0])
+        if response is None:
+            record = GlobalConversationHistory.get_or_none(GlobalConversationHistory.username == username)
+            if record is None:
+                return jsonify({"error": "No conversation history found for username"}), 404
+            response = {
+                "username": record.username,
+                "favorite_topic": record.favorite_topic,
+                "keywords": json.loads(record.keywords),
+                "stats": json.loads(record.stats),
+                "embedding": json.loads(record.embedding),
+                "three_d_embedding": json.loads(record.three_d_embedding)
+                if record.three_d_embedding
+                else None,
+                "last_conversation": record.last_conversation,  # Include the conversation ID
+                "fidelity": record.fidelity,
+            }
+            conversation_cache.put_user(record.username, record.version, response)
+
+    if request.args.get("embedding", "1").lower() in ("0", "false", "no"):
+        response = {key: value for key, value in response.items() if key != "embedding"}
     return jsonify(response), 200
 
 
+@app.route("/api/cache_stats", methods=["GET"])
+def get_cache_stats():
+    return jsonify({"conversation_history": conversation_cache.stats()}), 200
+
+
+@app.route("/api/trend", methods=["GET"])
+def get_trend():
+    """
+    Returns how a user's metrics changed across uploads. Query parameters:
+      - metric: one or more comma-separated UserSnapshot metrics (e.g. humor_score).
+      - username: defaults to the current user.
+    """
+    name = request.args.get("username") or username
+    if not name:
+        return jsonify({"error": "Username not set"}), 400
+    metrics = [m.strip() for m in request.args.get("metric", "").split(",") if m.strip()]
+    if not metrics or any(m not in SNAPSHOT_METRICS for m in metrics):
+        return jsonify({"error": "Unknown metric", "metrics": SNAPSHOT_METRICS}), 400
+
+    with db.connection_context():
+        series = metric_series(name, metrics)
+    return jsonify({"username": name, "metrics": metrics, "series": series}), 200
+
+
+@app.route("/api/range_stats", methods=["GET"])
+def get_range_stats():
+    """
+    Stats for any date window, composed from the daily rollup table. Query parameters:
+      - username: defaults to the current user.
+      - start, end: inclusive YYYY-MM-DD bounds (either may be left out), or
+      - days: the last N days up to today.
+    """
+    name = request.args.get("username") or username
+    if not name:
+        return jsonify({"error": "Username not set"}), 400
+    try:
+        if request.args.get("days"):
+            end = date.today()
+            start = end - timedelta(days=int(request.args["days"]) - 1)
+        else:
+            start = date.fromisoformat(request.args["start"]) if request.args.get("start") else None
+            end = date.fromisoformat(request.args["end"]) if request.args.get("end") else None
+    except ValueError:
+        return jsonify({"error": "Invalid date range"}), 400
+
+    with db.connection_context():
+        stats = range_stats(name, start, end)
+    return jsonify(stats), 200
+
+
+@app.route("/api/topic_timeline", methods=["GET"])
+def get_topic_timeline():
+    """
+    How a user's topics changed month by month (tracked with TOPIC_DRIFT). Query parameters:
+      - username: defaults to the current user.
+      - start, end: inclusive YYYY-MM bounds (either may be left out).
+    """
+    name = request.args.get("username") or username
+    if not name:
+        return jsonify({"error": "Username not set"}), 400
+    bounds = {}
+    for key in ("start", "end"):
+        value = request.args.get(key)
+        if value:
+            try:
+                bounds[key] = datetime.strptime(value, "%Y-%m").strftime("%Y-%m")
+            except ValueError:
+                return jsonify({"error": f"Invalid {key} month, expected YYYY-MM"}), 400
+
+    with db.connection_context():
+        timeline = topic_timeline(name, bounds.get("start"), bounds.get("end"))
+    return jsonify(timeline), 200
+
+
+@app.route("/api/interactions", methods=["GET"])
+def get_interactions():
+    """
+    Who a user talks to in the latest upload. Query parameters:
+      - username: defaults to the current user.
+      - k: number of neighbours to return (default 10).
+      - type: replies, mentions or reactions (default: all of them combined).
+    """
+    name = request.args.get("username") or username
+    if not name:
+        return jsonify({"error": "Username not set"}), 400
+    kind = request.args.get("type") or None
+    if kind is not None and kind not in INTERACTION_TYPES:
+        return jsonify({"error": "Unknown interaction type", "types": list(INTERACTION_TYPES)}), 400
+    try:
+        k = max(1, int(request.args.get("k", 10)))
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+
+    graph = latest_graph()
+    if graph is None or name not in graph.index:
+        return jsonify({"error": "No interactions found for user"}), 404
+    return jsonify({
+        "username": name,
+        "centrality": graph.user_centrality(name),
+        "neighbours": graph.neighbours(name, k, kind),
+    }), 200
+
+
+@app.route("/api/search", methods=["GET"])
+def search():
+    """
+    Full-text search over the indexed messages (MESSAGE_INDEX). Query parameters:
+      - q: the words to look for; a trailing * matches prefixes.
+      - author, channel: optional filters.
+      - order: rank (default), oldest or newest.
+      - limit, offset: page size (at most SEARCH_MAX_PAGE_SIZE) and position.
+      - by=author: who mentions q the most instead of individual messages.
+    """
+    text = request.args.get("q", "").strip()
+    if not text:
+        return jsonify({"error": "q is required"}), 400
+    order = request.args.get("order", "rank")
+    if order not in ("rank", "oldest", "newest"):
+        return jsonify({"error": "order must be rank, oldest or newest"}), 400
+    try:
+        limit = min(SEARCH_MAX_PAGE_SIZE, max(1, int(request.args.get("limit", 20))))
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    channel = request.args.get("channel") or None
+
+    with db.connection_context():
+        if request.args.get("by") == "author":
+            return jsonify({"q": text, "authors": top_authors(text, channel, limit)}), 200
+        hits, next_offset = search_messages(text, request.args.get("author") or None, channel, order, limit, offset)
+    return jsonify({"q": text, "hits": hits, "next_offset": next_offset}), 200
+
+
+@app.route("/api/search/semantic", methods=["GET"])
+def semantic_search():
+    """
+    Messages closest in meaning to q, from the stored message vectors (MESSAGE_VECTORS).
+    Query parameters:
+      - q: the text to look for.
+      - k: number of results (default 10, at most SEARCH_MAX_PAGE_SIZE).
+      - author: optional author filter.
+      - start, end: optional inclusive YYYY-MM-DD bounds on the message date (UTC).
+      - exact=1: score every matching vector even when an approximate index exists.
+    """
+    text = request.args.get("q", "").strip()
+    if not text:
+        return jsonify({"error": "q is required"}), 400
+    try:
+        k = min(SEARCH_MAX_PAGE_SIZE, max(1, int(request.args.get("k", 10))))
+        start = end = None
+        if request.args.get("start"):
+            start = int(datetime.combine(date.fromisoformat(request.args["start"]), time(), timezone.utc).timestamp())
+        if request.args.get("end"):
+            end_day = date.fromisoformat(request.args["end"]) + timedelta(days=1)
+            end = int(datetime.combine(end_day, time(), timezone.utc).timestamp())
+    except ValueError:
+        return jsonify({"error": "Invalid k or date range"}), 400
+
+    store = latest_store()
+    if store is None:
+        return jsonify({"q": text, "hits": [], "method": None}), 200
+    exact = request.args.get("exact", "0").lower() in ("1", "true", "yes")
+    hits, method = store.search(encode_query(text), k, request.args.get("author") or None, start, end, exact)
+
+    # Attach the text when the messages are in the full-text index as well.
+    if hits:
+        with db.connection_context():
+            contents = dict(
+                Message.select(Message.message_id, Message.content)
+                .where(Message.message_id.in_([hit["message_id"] for hit in hits]))
+                .tuples()
+            )
+        for hit in hits:
+            hit["content"] = contents.get(hit["message_id"])
+    return jsonify({"q": text, "hits": hits, "method": method}), 200
+
+
 @app.route("/api/getmainuser", methods=["GET"])
 def get_main_user():
     print("Main user:", username)
@@ -242,12 +399,14 @@ def get_local_graph():
         ConversationHistory.keywords,
         ConversationHistory.stats,
         ConversationHistory.three_d_embedding,
+        ConversationHistory.fidelity,
     ):
         data[record.username] = {
             "favorite_topic": record.favorite_topic,
             "keywords": record.keywords,
             "stats": record.stats,
             "three_d_embedding": record.three_d_embedding,
+            "fidelity": record.fidelity,
         }
 
         data = safe_eval_dict(data)
@@ -261,87 +420,212 @@ def get_local_graph():
     return jsonify(data)
 
 
-@app.route("/api/global_graph", methods=["GET"])
-def get_global_graph():
-    colors = [
-        "#10b981",
-        "#a855f7",
-        "#ec4899",
-        "#0ea5e9",
-        "#6366f1",
-        "#f43f5e",
-        "#ef4444",
-        "#84cc16",
-        "#14b8a6",
-        "#3b82f6",
-        "#8b5cf6",
-        "#d946ef",
-        "#22c55e",
-        "#06b6d4",
-    ]
-    data = {}
-    color_map = {}
-    color_index = 0
-
-    for record in GlobalConversationHistory.select(
-        GlobalConversationHistory.username,
-        GlobalConversationHistory.favorite_topic,
-        GlobalConversationHistory.keywords,
-        GlobalConversationHistory.stats,
-        GlobalConversationHistory.three_d_embedding,
-        GlobalConversationHistory.last_conversation,
-    ):
-        data[record.username] = {
-            "favorite_topic": record.favorite_topic,
-            "keywords": record.keywords,
-            "stats": record.stats,
-            "three_d_embedding": record.three_d_embedding,
-            "color": record.last_conversation,
-        }
+GRAPH_COLORS = [
+    "#10b981",
+    "#a855f7",
+    "#ec4899",
+    "#0ea5e9",
+    "#6366f1",
+    "#f43f5e",
+    "#ef4444",
+    "#84cc16",
+    "#14b8a6",
+    "#3b82f6",
+    "#8b5cf6",
+    "#d946ef",
+    "#22c55e",
+    "#06b6d4",
+]
+
+GLOBAL_GRAPH_FIELDS = ["favorite_topic", "keywords", "stats", "three_d_embedding", "color"]
+GLOBAL_GRAPH_MAX_PAGE_SIZE = 5000
+
+
+def conversation_color_map():
+    # Colors are assigned in order of each conversation's first appearance in the
+    # table, so every page of the global graph agrees on the same colors.
+    first_row = fn.MIN(SQL("rowid"))
+    query = (
+        GlobalConversationHistory.select(GlobalConversationHistory.last_conversation)
+        .group_by(GlobalConversationHistory.last_conversation)
+        .order_by(first_row)
+    )
+    return {
+        record.last_conversation: GRAPH_COLORS[i % len(GRAPH_COLORS)]
+        for i, record in enumerate(query)
+    }
 
-    data = safe_eval_dict(data)
 
-    for user in data:
-        keyword = sorted(
-            data[user]["keywords"], key=lambda x: x["score"], reverse=True
+def global_graph_entry(record, fields, color_map):
+    entry = {}
+    for field in fields:
+        if field == "color":
+            entry["color"] = color_map.get(record.last_conversation)
+        else:
+            entry[field] = safe_eval_dict(getattr(record, field))
+    if "keywords" in entry:
+        entry["keywords"] = sorted(
+            entry["keywords"], key=lambda x: x["score"], reverse=True
         )[:5]
-        data[user]["keywords"] = keyword
+    return entry
 
-        lc = data[user]["color"]
-        if lc not in color_map:
-            color_map[lc] = colors[color_index % len(colors)]
-            color_index += 1
-        data[user]["color"] = color_map[lc]
 
-    return jsonify(data)
+@app.route("/api/global_graph", methods=["GET"])
+def get_global_graph():
+    """
+    Streams the global graph as JSON. Optional query parameters:
+      - fields: comma-separated subset of favorite_topic, keywords, stats,
+        three_d_embedding and color (defaults to all of them).
+      - limit / cursor: page through users ordered by username. The paginated
+        response is {"users": {...}, "next_cursor": <username or null>}.
+    """
+    fields = request.args.get("fields")
+    fields = [f.strip() for f in fields.split(",") if f.strip()] if fields else GLOBAL_GRAPH_FIELDS
+    unknown = [f for f in fields if f not in GLOBAL_GRAPH_FIELDS]
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    cursor = request.args.get("cursor")
+    limit = request.args.get("limit")
+    paginated = cursor is not None or limit is not None
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        if not 1 <= limit <= GLOBAL_GRAPH_MAX_PAGE_SIZE:
+            return jsonify({"error": f"limit must be between 1 and {GLOBAL_GRAPH_MAX_PAGE_SIZE}"}), 400
+    elif paginated:
+        limit = GLOBAL_GRAPH_MAX_PAGE_SIZE
+
+    columns = [GlobalConversationHistory.username]
+    columns += [getattr(GlobalConversationHistory, f) for f in fields if f != "color"]
+    if "color" in fields:
+        columns.append(GlobalConversationHistory.last_conversation)
+    query = GlobalConversationHistory.select(*columns).order_by(GlobalConversationHistory.username)
+    if cursor:
+        query = query.where(GlobalConversationHistory.username > cursor)
+    if paginated:
+        # Fetch one extra row to know whether there is a next page.
+        query = query.limit(limit + 1)
+
+    color_map = conversation_color_map() if "color" in fields else {}
+    page = {"next_cursor": None}
+
+    def entries():
+        last_username = None
+        for i, record in enumerate(query.iterator()):
+            if paginated and i == limit:
+                page["next_cursor"] = last_username
+                break
+            last_username = record.username
+            yield record.username, global_graph_entry(record, fields, color_map)
+
+    def chunks():
+        if not paginated:
+            yield from json_object_chunks(entries())
+            return
+        yield '{"users":'
+        yield from json_object_chunks(entries())
+        yield ',"next_cursor":' + json.dumps(page["next_cursor"]) + "}"
+
+    return stream_json_response(chunks())
+
+
+def parse_box_corner(value):
+    parts = value.split(",")
+    if len(parts) != 3:
+        raise ValueError("expected three comma-separated numbers")
+    return np.array([float(part) for part in parts])
+
+
+@app.route("/api/global_graph/lod", methods=["GET"])
+def get_global_graph_lod():
+    """
+    Level-of-detail view of the global graph. Query parameters:
+      - level: octree depth; coarse levels return one aggregated point per cell.
+      - min / max: optional "x,y,z" corners of the visible box.
+    At level LOD_MAX_LEVEL and deeper, raw users inside the box are returned
+    instead of aggregates (the box is required there).
+    """
+    try:
+        level = int(request.args.get("level", 0))
+        box_low = request.args.get("min")
+        box_high = request.args.get("max")
+        if (box_low is None) != (box_high is None):
+            raise ValueError("min and max must be given together")
+        if box_low is not None:
+            box_low, box_high = parse_box_corner(box_low), parse_box_corner(box_high)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid level of detail query: {e}"}), 400
+    if level < 0:
+        return jsonify({"error": "level must be non-negative"}), 400
+
+    index = ensure_global_index()
+    color_map = conversation_color_map()
+
+    if level >= index.max_level:
+        if box_low is None:
+            return jsonify({"error": "min and max are required at the finest level"}), 400
+        users = {
+            username: {
+                "three_d_embedding": point,
+                "color": color_map.get(conversation),
+                "favorite_topic": topic,
+            }
+            for username, point, conversation, topic in index.users_in(box_low, box_high)
+        }
+        return jsonify({"level": level, "users": users})
+
+    clusters = index.clusters(level, box_low, box_high)
+    for cluster in clusters:
+        cluster["color"] = color_map.get(cluster.pop("conversation"))
+    return jsonify({"level": level, "max_level": index.max_level, "clusters": clusters})
+
+
+# Mapping from metric names to a brief description.
+COMMENTARY_DESCRIPTIONS = {
+    "Total Emojis Used": "The total number of emojis used across all messages.",
+    "Messages with at Least One Emoji": "Count of messages that include at least one emoji.",
+    "Total Emoji Used in Reactions": "Total count of emojis used in reaction responses.",
+    "Unique Emoji Used in Reactions": "Number of distinct emojis used in reactions.",
+    "Messages with at Least One Emoji Reacted": "Count of messages that received an emoji reaction.",
+    "Most Used Emoji": "The emoji that appears most frequently in conversations.",
+    "Dryness Score": "A score representing how dry or unengaging the conversation is.",
+    "Humor Score": "A score indicating the level of humor in the conversation.",
+    "Romance Score": "A score indicating how romantic the conversation is.",
+}
+
+
+def commentary_request(data):
+    """
+    Validates a /generateCommentary payload. Returns (metric, description) where
+    metric is the text sent to the LLM, or None when the input is invalid. Shared
+    by the Flask view and the async ASGI handler in asgi.py.
+    """
+    if not isinstance(data, dict):
+        return None, None
+    metric_value = data.get("metric")
+    metric_name = data.get("name")
+    if metric_value is None or not isinstance(metric_name, str) or not isinstance(data.get("description"), str):
+        return None, None
+
+    # Generate commentary using the metric value (converted to string)
+    metric = metric_name + str(metric_value) + data.get("description")
+    description = COMMENTARY_DESCRIPTIONS.get(metric_name, "No description available.")
+    return metric, description
 
 
 @app.route("/generateCommentary", methods=["POST"])
 def generate_commentary():
-    data = request.get_json()
-    metric_value = data.get("metric")
-    metric_name = data.get("name")
-    if metric_value is None or metric_name is None:
+    metric, description = commentary_request(request.get_json(silent=True))
+    if metric is None:
         return jsonify({"error": "Invalid input"}), 400
 
-    # Generate commentary using the metric value (converted to string)
-    commentary = create_wrapped_commentary(
-        metric_name + str(metric_value) + data.get("description")
-    )
-
-    # Mapping from metric names to a brief description.
-    description_mapping = {
-        "Total Emojis Used": "The total number of emojis used across all messages.",
-        "Messages with at Least One Emoji": "Count of messages that include at least one emoji.",
-        "Total Emoji Used in Reactions": "Total count of emojis used in reaction responses.",
-        "Unique Emoji Used in Reactions": "Number of distinct emojis used in reactions.",
-        "Messages with at Least One Emoji Reacted": "Count of messages that received an emoji reaction.",
-        "Most Used Emoji": "The emoji that appears most frequently in conversations.",
-        "Dryness Score": "A score representing how dry or unengaging the conversation is.",
-        "Humor Score": "A score indicating the level of humor in the conversation.",
-        "Romance Score": "A score indicating how romantic the conversation is.",
-    }
-    description = description_mapping.get(metric_name, "No description available.")
+    try:
+        commentary = create_wrapped_commentary(metric)
+    except OpenAIError as e:
+        return jsonify({"error": f"Commentary generation failed: {e}"}), 502
     return jsonify({"commentary": commentary, "description": description})
 
 
@@ -0,0 +1,87 @@
+"""
+Async serving mode.
+
+    uvicorn asgi:app --port 5000
+
+/generateCommentary is handled natively on the event loop with the shared async
+LLM client, so one worker can keep hundreds of commentary requests in flight
+(bounded by LLM_MAX_CONCURRENCY). Every other route is served by the regular
+Flask app on a thread pool of ASGI_WSGI_THREADS threads.
+"""
+import json
+import os
+
+from a2wsgi import WSGIMiddleware
+from openai import OpenAIError
+
+import llmClient
+from app import app as flask_app, commentary_request
+from generateCommentary import acreate_wrapped_commentary
+
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "16"))
+
+wsgi_app = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+
+
+async def _read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def generate_commentary(scope, receive, send):
+    try:
+        data = json.loads(await _read_body(receive) or b"null")
+    except ValueError:
+        await _send_json(send, 400, {"error": "Invalid input"})
+        return
+
+    metric, description = commentary_request(data)
+    if metric is None:
+        await _send_json(send, 400, {"error": "Invalid input"})
+        return
+
+    try:
+        commentary = await acreate_wrapped_commentary(metric)
+    except OpenAIError as e:
+        await _send_json(send, 502, {"error": f"Commentary generation failed: {e}"})
+        return
+    await _send_json(send, 200, {"commentary": commentary, "description": description})
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await llmClient.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+    elif scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/generateCommentary":
+        await generate_commentary(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
@@ -0,0 +1,436 @@
+import functools
+import io
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+from sklearn.preprocessing import StandardScaler
+
+from jsonParsing import parse_messages, get_unique_usernames
+from generateEmbedding import getEmbeddings, encode_topic
+from embeddingBackend import EMBEDDER_THREADS, set_inference_threads
+from topicModeling import find_favorite_topic
+from pca import pca_to_3
+from orm import db, ConversationHistory, GlobalConversationHistory, FIDELITY_EXACT
+from userSnapshots import record_snapshot
+from dailyRollups import store_rollups
+from interactionGraph import InteractionGraphBuilder
+from topicCache import topic_fingerprint, get_topic, put_topic
+from messageSearch import MESSAGE_INDEX, index_messages
+from messageVectors import MESSAGE_VECTORS, MessageVectorWriter
+from topicDrift import TOPIC_DRIFT, update_topic_drift
+from memoryBudget import MemoryBudget
+from messageSampling import TOPIC_MESSAGE_CAP, stratified_sample
+import requestProfiling
+
+load_dotenv()
+
+# Number of worker processes used to decode exports and compute per-user stats.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+
+# Uploads replace the local conversation history, so they are stored one at a time.
+ingest_lock = threading.Lock()
+
+
+def _pool_context():
+    # Fork keeps workers cheap: they inherit the already-imported parsing code
+    # instead of re-importing the Flask app (and the embedding models) like spawn does.
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+def _worker_pool(workers, initializer=None, initargs=()):
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context(), initializer=initializer, initargs=initargs)
+
+
+def _topic_worker_init(workers):
+    # Forked topic workers inherit the loaded embedder, KeyBERT model and topic
+    # labeler, but must open their own database connection instead of the parent's.
+    db._state.reset()
+    if not EMBEDDER_THREADS:
+        # Share the cores between the workers instead of one inference thread per core each.
+        set_inference_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+# --- Reading exports ---
+def read_exports(files):
+    """
+    Takes a list of (name, file object) pairs and returns a list of (name, raw bytes)
+    pairs, one per JSON export. Zip archives are expanded into their .json members.
+    """
+    exports = []
+    for name, fileobj in files:
+        raw = fileobj.read()
+        if zipfile.is_zipfile(io.BytesIO(raw)):
+            with zipfile.ZipFile(io.BytesIO(raw)) as archive:
+                for member in archive.namelist():
+                    if member.lower().endswith(".json") and not member.startswith("__MACOSX/"):
+                        exports.append((member, archive.read(member)))
+        else:
+            exports.append((name, raw))
+    return exports
+
+
+def export_messages(data):
+    """
+    Returns the message list of an export (or the list itself). Messages of a
+    DiscordChatExporter export are tagged with its channel name, so they keep it
+    once several exports are merged.
+    """
+    if not (isinstance(data, dict) and "messages" in data):
+        return data
+    channel = data.get("channel")
+    if isinstance(channel, dict) and channel.get("name"):
+        for msg in data["messages"]:
+            if isinstance(msg, dict):
+                msg.setdefault("channel", channel["name"])
+    return data["messages"]
+
+
+def _decode_export(raw):
+    data = export_messages(json.loads(raw))
+    if not isinstance(data, list):
+        raise ValueError("The JSON file does not contain a list of messages.")
+    return data
+
+
+def load_exports(exports, workers=INGEST_WORKERS, memory_budget=None):
+    """
+    Decodes every export (in parallel when there is more than one) and returns
+    a list of (name, messages) pairs in the same order as the input.
+    """
+    if memory_budget is None:
+        return _load_exports(exports, workers)
+    workers = memory_budget.decode_workers([len(raw) for _, raw in exports], workers)
+    with memory_budget.stage("decode"):
+        return _load_exports(exports, workers)
+
+
+def _load_exports(exports, workers):
+    pool = _worker_pool(min(workers, len(exports)))
+    if pool is None:
+        return [(name, _decode_export(raw)) for name, raw in exports]
+    with pool:
+        decoded = pool.map(_decode_export, [raw for _, raw in exports])
+        return [(name, messages) for (name, _), messages in zip(exports, decoded)]
+
+
+def merge_exports(loaded):
+    """
+    Merges the messages of several exports into one export, dropping messages
+    whose id was already seen in an earlier file. Returns (data, duplicates).
+    """
+    seen_ids = set()
+    merged = []
+    duplicates = 0
+    for _, messages in loaded:
+        for msg in messages:
+            message_id = msg.get("id") if isinstance(msg, dict) else None
+            if message_id is not None:
+                if message_id in seen_ids:
+                    duplicates += 1
+                    continue
+                seen_ids.add(message_id)
+            merged.append(msg)
+    return {"messages": merged}, duplicates
+
+
+# --- Per-user analysis ---
+def favorite_topic(username, messages, vector_sink=None, memory_budget=None):
+    """
+    Returns (topic, topic_embedding), reusing the memoized result when the user's
+    messages haven't changed since an earlier upload. On a cache hit no message
+    is embedded, so vector_sink is not called (the vectors were stored then).
+    """
+    fingerprint = topic_fingerprint(username, messages)
+    cached = get_topic(fingerprint)
+    if cached is not None:
+        return cached
+    message_cap = TOPIC_MESSAGE_CAP
+    if memory_budget is not None:
+        message_cap = memory_budget.message_cap(TOPIC_MESSAGE_CAP, len(messages))
+        if message_cap != TOPIC_MESSAGE_CAP:
+            # Tokens, sentiment and near-duplicate signatures of every message wouldn't fit either.
+            sampled, _ = stratified_sample([msg.get("timestamp") for msg in messages], message_cap)
+            messages = [messages[i] for i in sampled]
+    topic = find_favorite_topic(
+        username, messages, message_cap=message_cap, vector_sink=vector_sink, memory_budget=memory_budget
+    )
+    topic_embedding = encode_topic(topic)
+    # A topic from a smaller sample forced by the memory budget isn't memoized.
+    if message_cap == TOPIC_MESSAGE_CAP:
+        put_topic(fingerprint, username, topic, topic_embedding)
+    return topic, topic_embedding
+
+
+def favorite_topic_task(username, messages, collect_vectors=False):
+    """
+    favorite_topic() and the topic drift update for one user, run in a topic
+    worker. Returns (topic, topic_embedding, vector_batches); the message
+    vectors are handed back for the parent's MessageVectorWriter.
+    """
+    vector_batches = []
+    vector_sink = None
+    if collect_vectors:
+        vector_sink = lambda ids, timestamps, embeddings: vector_batches.append((ids, timestamps, np.asarray(embeddings)))
+    with db.connection_context():
+        topic, topic_embedding = favorite_topic(username, messages, vector_sink)
+        if TOPIC_DRIFT:
+            update_topic_drift(username, messages)
+    return topic, topic_embedding, vector_batches
+
+
+def group_messages_by_author(messages, graph_builder=None):
+    by_author = defaultdict(list)
+    for msg in messages:
+        if isinstance(msg, dict):
+            if graph_builder is not None:
+                graph_builder.add_message(msg)
+            name = msg.get("author", {}).get("name")
+            if name:
+                by_author[name].append(msg)
+    return by_author
+
+
+def parse_messages_with_rollups(messages, username):
+    """parse_messages() that also returns the user's daily rollups (runs in the worker pool)."""
+    rollups = {}
+    stats = parse_messages(messages, username, daily_rollups=rollups)
+    return stats, rollups
+
+
+def prepare_messages(data, usernames=None):
+    """
+    Groups the messages by author once, so each user is analyzed a single time no
+    matter how many exports their messages came from. The interaction graph is
+    collected during the same pass and saved (and the messages indexed for
+    search, with MESSAGE_INDEX) before the much slower per-user analysis starts.
+    Returns (usernames, by_author).
+    """
+    messages = export_messages(data)
+    if usernames is None:
+        usernames = get_unique_usernames(messages)
+    graph_builder = InteractionGraphBuilder()
+    by_author = group_messages_by_author(messages, graph_builder)
+    graph_builder.build().save()
+    if MESSAGE_INDEX:
+        index_messages(messages)
+    return usernames, by_author
+
+
+def compute_stats(by_author, usernames, workers=INGEST_WORKERS, memory_budget=None):
+    """Returns {username: (stats, rollups)}, computed in worker processes."""
+    if memory_budget is not None:
+        workers = memory_budget.stats_workers(workers)
+    pool = _worker_pool(workers)
+    if pool is None:
+        return {username: parse_messages_with_rollups(by_author[username], username) for username in usernames}
+    with pool:
+        pending = {
+            username: requestProfiling.submit(pool, parse_messages_with_rollups, by_author[username], username)
+            for username in usernames
+        }
+        return {username: future.result() for username, future in pending.items()}
+
+
+def _topics_here(usernames, by_author, vector_writer, memory_budget):
+    for username in usernames:
+        vector_sink = None
+        if vector_writer is not None:
+            vector_sink = functools.partial(vector_writer.add, username)
+        with memory_budget.stage("topics"):
+            topic, topic_embedding = favorite_topic(username, by_author[username], vector_sink, memory_budget)
+            if TOPIC_DRIFT:
+                update_topic_drift(username, by_author[username])
+        yield username, topic, topic_embedding
+
+
+def _topics_in_pool(pool, usernames, by_author, vector_writer, memory_budget):
+    # Users come back in the order they finish, so each is yielded (and checkpointed) right away.
+    pending = {
+        requestProfiling.submit(pool, favorite_topic_task, username, by_author[username], vector_writer is not None): username
+        for username in usernames
+    }
+    for future in as_completed(pending):
+        username = pending[future]
+        with memory_budget.stage("topics"):
+            topic, topic_embedding, vector_batches = future.result()
+            for ids, timestamps, embeddings in vector_batches:
+                vector_writer.add(username, ids, timestamps, embeddings)
+        yield username, topic, topic_embedding
+
+
+def analyze_users(data, usernames=None, workers=INGEST_WORKERS, memory_budget=None, topic_workers=1):
+    """
+    Yields (username, topic, stats, topic_embedding, daily_rollups) for every
+    user in the export; store_results() builds the user embeddings from them.
+    The stats (parse_messages) are computed in `workers` worker processes.
+    Topics (embedding, KMeans, KeyBERT, labeling) are computed here one user at
+    a time, in export order, where the models are loaded, or with topic_workers
+    > 1 in forked topic workers that inherit the models, in the order users
+    finish. Stages are measured (and degraded) by memory_budget.
+    """
+    if memory_budget is None:
+        memory_budget = MemoryBudget()
+    with memory_budget.stage("group"):
+        usernames, by_author = prepare_messages(data, usernames)
+
+    vector_writer = MessageVectorWriter() if MESSAGE_VECTORS else None
+
+    stats_workers = memory_budget.stats_workers(workers)
+    topic_workers = memory_budget.topic_workers(topic_workers)
+    if topic_workers > 1:
+        # Created before any inference runs here, so the workers fork a clean model.
+        pool = _worker_pool(max(stats_workers, topic_workers), _topic_worker_init, (topic_workers,))
+    else:
+        pool = _worker_pool(stats_workers)
+    try:
+        if stats_workers > 1:
+            pending_stats = {
+                username: requestProfiling.submit(pool, parse_messages_with_rollups, by_author[username], username)
+                for username in usernames
+            }
+        if topic_workers > 1:
+            topics = _topics_in_pool(pool, usernames, by_author, vector_writer, memory_budget)
+        else:
+            topics = _topics_here(usernames, by_author, vector_writer, memory_budget)
+        for username, topic, topic_embedding in topics:
+            with memory_budget.stage("stats"):
+                if stats_workers > 1:
+                    stats, rollups = pending_stats.pop(username).result()
+                else:
+                    stats, rollups = parse_messages_with_rollups(by_author[username], username)
+            yield username, topic, stats, topic_embedding, rollups
+        if vector_writer is not None:
+            vector_writer.finish()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+# --- Persisting results ---
+def save_user_result(username, topic, stats, embedding, conversation_id, fidelity=FIDELITY_EXACT):
+    """
+    Writes one user's result to both history tables (keeping the 3D embedding
+    until it is recomputed) and records the upload's snapshot.
+    """
+    favorite_topic_label = topic.get("label")
+    fields = {
+        "favorite_topic": favorite_topic_label,
+        "keywords": json.dumps(topic.get("keywords")),
+        "stats": json.dumps(stats),
+        "embedding": json.dumps(embedding.tolist()),
+        "fidelity": fidelity,
+    }
+    if not ConversationHistory.update(**fields).where(ConversationHistory.username == username).execute():
+        ConversationHistory.create(username=username, **fields)
+
+    # For GlobalConversationHistory, update if record exists; otherwise, create new record.
+    global_fields = {**fields, "last_conversation": conversation_id}
+    if not GlobalConversationHistory.update(**global_fields).where(GlobalConversationHistory.username == username).execute():
+        GlobalConversationHistory.create(username=username, **global_fields)
+    record_snapshot(username, conversation_id, favorite_topic_label, stats)
+
+
+def store_results(results, conversation_id, fidelity=FIDELITY_EXACT, memory_budget=None):
+    """
+    Replaces the local conversation history with the analyzed users (the
+    tuples analyze_users() yields), upserts them into the global history and
+    recomputes the 3D embeddings for this upload. The user embeddings of the
+    whole upload are built in one getEmbeddings() call.
+    """
+    with db.connection_context():
+        results = list(results)
+        embeddings = getEmbeddings(
+            np.vstack([topic_embedding for _, _, _, topic_embedding, _ in results]),
+            [stats for _, _, stats, _, _ in results],
+        ) if results else []
+
+        # Clear the conversationhistory table on each new upload
+        ConversationHistory.delete().execute()
+
+        for (username, topic, stats, _, rollups), embedding in zip(results, embeddings):
+            save_user_result(username, topic, stats, embedding[None, :], conversation_id, fidelity)
+            store_rollups(username, rollups)
+
+        if memory_budget is None:
+            update_three_d_embeddings(conversation_id)
+        else:
+            with memory_budget.stage("three_d"):
+                update_three_d_embeddings(conversation_id)
+
+
+def update_three_d_embeddings(conversation_id):
+    # Retrieve all records from ConversationHistory to compute 3D embeddings.
+    records = list(ConversationHistory.select())
+    embedding_matrix = np.array([json.loads(record.embedding) for record in records])
+    # Squeeze the matrix in case of extra dimensions.
+    embedding_matrix = (
+        np.squeeze(embedding_matrix, axis=1)
+        if embedding_matrix.ndim > 1 and embedding_matrix.shape[1] == 1
+        else embedding_matrix
+    )
+    embedding_matrix = StandardScaler().fit_transform(embedding_matrix)
+    resultantMatrix = pca_to_3(embedding_matrix)
+
+    # Update three_d_embedding for both tables based on the conversationhistory records.
+    for i, record in enumerate(records):
+        three_d_str = json.dumps(resultantMatrix[i].tolist())
+        record.three_d_embedding = three_d_str
+        record.save()
+        GlobalConversationHistory.update(three_d_embedding=three_d_str).where(
+            GlobalConversationHistory.username == record.username
+        ).execute()
+
+
+def ingest(data, conversation_id=None, workers=INGEST_WORKERS, memory_budget=None):
+    """
+    Analyzes every user in an export (or merged exports) and stores the results.
+    The memory report of the job is printed once it is done.
+    """
+    # Generate a unique conversation ID for this upload
+    if conversation_id is None:
+        conversation_id = datetime.now().isoformat()
+    if memory_budget is None:
+        memory_budget = MemoryBudget()
+    usernames = get_unique_usernames(data)
+    try:
+        with ingest_lock:
+            results = analyze_users(data, usernames, workers=workers, memory_budget=memory_budget)
+            store_results(results, conversation_id, memory_budget=memory_budget)
+        print("Memory:", json.dumps(memory_budget.report()))
+    finally:
+        memory_budget.close()
+    return conversation_id, usernames
+
+
+def ingest_exports(files, workers=INGEST_WORKERS):
+    """
+    Batch mode: reads several exports (or zips of exports), deduplicates their
+    messages by id and ingests the union as a single conversation.
+    """
+    memory_budget = MemoryBudget()
+    try:
+        loaded = load_exports(read_exports(files), workers=workers, memory_budget=memory_budget)
+        data, duplicates = merge_exports(loaded)
+        conversation_id, usernames = ingest(data, workers=workers, memory_budget=memory_budget)
+    finally:
+        memory_budget.close()
+    return {
+        "conversation_id": conversation_id,
+        "files": [name for name, _ in loaded],
+        "messages": len(data["messages"]),
+        "duplicates_removed": duplicates,
+        "users": len(usernames),
+        "memory": memory_budget.report(),
+    }
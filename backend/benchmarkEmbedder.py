@@ -0,0 +1,77 @@
+"""
+Measures the CPU throughput of an embedder backend against the stock fp32
+PyTorch embedder and reports the cosine drift between them. The drift bound
+itself is checked by tests/test_embeddingBackend.py.
+
+Usage:
+    python embeddingBackend.py export          # once, for the onnx backend
+    python benchmarkEmbedder.py --backend onnx --threads 4
+    python benchmarkEmbedder.py --backend torch-int8
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from embeddingBackend import load_embedder
+
+SAMPLE_EXPORTS = [
+    os.path.join(os.path.dirname(__file__), "..", "sampleJsonfiles", name)
+    for name in ("icpc_channel.json", "dmt1_general_channel.json")
+]
+
+
+def sample_sentences(paths, limit):
+    sentences = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        messages = data["messages"] if isinstance(data, dict) else data
+        sentences.extend(msg["content"] for msg in messages if isinstance(msg, dict) and msg.get("content", "").strip())
+    return sentences[:limit]
+
+
+def throughput(embedder, sentences, batch_size, repeats):
+    embedder.encode(sentences[:batch_size], batch_size=batch_size)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        embeddings = embedder.encode(sentences, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    return np.asarray(embeddings, dtype=np.float32), len(sentences) * repeats / elapsed
+
+
+def cosine_rows(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedder backend throughput benchmark.")
+    parser.add_argument("--backend", default="onnx", choices=["torch", "torch-int8", "onnx"])
+    parser.add_argument("--model-dir", help="ONNX model directory (defaults to EMBEDDER_MODEL_DIR)")
+    parser.add_argument("--threads", type=int, default=0, help="inference threads (0 = library default)")
+    parser.add_argument("--sentences", type=int, default=1000, help="number of sample messages to embed")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("exports", nargs="*", default=SAMPLE_EXPORTS)
+    args = parser.parse_args()
+
+    sentences = sample_sentences(args.exports, args.sentences)
+    print(f"Embedding {len(sentences)} messages, batch size {args.batch_size}, threads {args.threads or 'default'}")
+
+    reference, reference_rate = throughput(load_embedder("torch", threads=args.threads), sentences, args.batch_size, args.repeats)
+    print(f"  torch (fp32): {reference_rate:8.1f} sentences/s")
+    candidate, candidate_rate = throughput(
+        load_embedder(args.backend, model_dir=args.model_dir, threads=args.threads), sentences, args.batch_size, args.repeats
+    )
+    print(f"  {args.backend}: {candidate_rate:8.1f} sentences/s ({candidate_rate / reference_rate:.2f}x)")
+
+    cosines = cosine_rows(reference, candidate)
+    print(f"Cosine vs fp32: min {cosines.min():.4f}  mean {cosines.mean():.4f}  p1 {np.percentile(cosines, 1):.4f}")
+
+
+if __name__ == "__main__":
+    main()
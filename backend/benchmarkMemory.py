@@ -0,0 +1,127 @@
+"""
+Peak-memory regression check for ingestion, on the sample exports.
+
+    python benchmarkMemory.py
+    python benchmarkMemory.py path/to/export.json --max-mb 800
+    python benchmarkMemory.py --budget-mb 64     # exercise the degradation paths
+
+Every export is ingested in a fresh process (decode, grouping, per-user stats
+and topics, nothing stored: scratch database, topic cache off, LLM mocked)
+with a MemoryBudget that traces allocations. The job peak is the process
+high-water mark over the RSS before the export was read, so the loaded models
+don't count. Prints each run's memory report and exits with 1 when a job peak
+is above --max-mb. An export rejected by --budget-mb is reported, not failed.
+tests/test_ingestionMemory.py runs the same check under pytest.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from mockLLMServer import start_mock_server
+
+SAMPLE_EXPORTS = [
+    os.path.join(os.path.dirname(__file__), "..", "sampleJsonfiles", name)
+    for name in ("icpc_channel.json", "dmt1_general_channel.json")
+]
+# Job peak allowed by default. Lower it when a change makes ingestion leaner.
+DEFAULT_MAX_MB = 400
+
+
+def run_export(path, budget_mb, workers):
+    """Ingests one export in this process and returns its memory report."""
+    from batchIngestion import analyze_users, load_exports, merge_exports
+    from memoryBudget import MB, MemoryBudget, MemoryBudgetExceeded, peak_rss_bytes, reset_peak_rss
+
+    reset_peak_rss()
+    memory_budget = MemoryBudget(budget_mb, trace=True)
+    with open(path, "rb") as f:
+        try:
+            loaded = load_exports([(os.path.basename(path), f.read())], workers=workers, memory_budget=memory_budget)
+        except MemoryBudgetExceeded as e:
+            return {"rejected": str(e)}
+    data, _ = merge_exports(loaded)
+    users = sum(1 for _ in analyze_users(data, workers=workers, memory_budget=memory_budget))
+    report = memory_budget.report()
+    memory_budget.close()
+    report["users"] = users
+    report["messages"] = len(data["messages"])
+    report["job_peak_mb"] = round((peak_rss_bytes() - memory_budget.baseline) / MB, 1)
+    return report
+
+
+def benchmark_env(llm_port, scratch):
+    """Environment for the runs: the mock LLM on llm_port, storage in the scratch directory."""
+    return dict(
+        os.environ,
+        OPENAI_BASE_URL=f"http://127.0.0.1:{llm_port}/v1",
+        OPENAI_API_KEY="memory-benchmark",
+        DATABASE_PATH=os.path.join(scratch, "benchmark.db"),
+        INTERACTION_GRAPH_DIR=os.path.join(scratch, "interaction_graph"),
+        TOPIC_CACHE_SIZE="0",
+        MESSAGE_INDEX="0",
+        MESSAGE_VECTORS="0",
+        TOPIC_DRIFT="0",
+    )
+
+
+def measure_export(path, budget_mb, workers, env):
+    """Runs run_export in a fresh process; its report is the last line of stdout."""
+    command = [sys.executable, os.path.abspath(__file__), "--run", path, "--budget-mb", str(budget_mb), "--workers", str(workers)]
+    return subprocess.run(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of ingesting the sample exports.")
+    parser.add_argument("exports", nargs="*", default=SAMPLE_EXPORTS, help="Discord JSON exports (defaults to the sample exports)")
+    parser.add_argument("--max-mb", type=float, default=DEFAULT_MAX_MB, help="largest job peak that passes")
+    parser.add_argument("--budget-mb", type=int, default=0, help="INGEST_MEMORY_BUDGET_MB for the runs (0 = none)")
+    parser.add_argument("--workers", type=int, default=1, help="stats worker processes (their memory isn't counted)")
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--run", help=argparse.SUPPRESS)  # internal: ingest this export and print its report
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_export(args.run, args.budget_mb, args.workers)))
+        return
+
+    env = benchmark_env(start_mock_server().port, tempfile.mkdtemp(prefix="memory-benchmark-"))
+    reports = {}
+    failed = False
+    for path in args.exports:
+        completed = measure_export(path, args.budget_mb, args.workers, env)
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            sys.exit(completed.returncode)
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+        reports[path] = report
+        if "rejected" in report:
+            print(f"\n{os.path.basename(path)}: rejected by the budget: {report['rejected']}")
+            continue
+
+        ok = report["job_peak_mb"] <= args.max_mb
+        failed |= not ok
+        print(
+            f"\n{os.path.basename(path)}: {report['messages']} messages, {report['users']} users, "
+            f"job peak {report['job_peak_mb']:.1f} MB (limit {args.max_mb:.0f} MB) {'OK' if ok else 'FAIL'}"
+        )
+        for name, stage in report["stages"].items():
+            print(
+                f"  {name:<8} {stage['calls']:>5} calls {stage['seconds']:>8.2f}s  "
+                f"RSS +{stage['rss_growth_mb']:>7.1f} MB  max {stage['max_rss_mb']:>7.1f} MB  "
+                f"traced peak {stage['traced_peak_mb']:>7.1f} MB"
+            )
+        if report["degradations"]:
+            print(f"  degraded: {report['degradations']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
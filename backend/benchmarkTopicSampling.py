@@ -0,0 +1,96 @@
+"""
+Compares the favorite topic chosen from a capped, time-stratified sample of each
+user's messages against the one chosen from all of them.
+
+Usage:
+    python benchmarkTopicSampling.py --cap 200 --users 5
+    python benchmarkTopicSampling.py path/to/export.json --cap 1000
+"""
+import argparse
+import json
+import os
+import time
+
+from batchIngestion import group_messages_by_author
+from jsonParsing import get_unique_usernames
+from topicModeling import find_favorite_topic
+
+SAMPLE_EXPORTS = [
+    os.path.join(os.path.dirname(__file__), "..", "sampleJsonfiles", name)
+    for name in ("icpc_channel.json", "dmt1_general_channel.json")
+]
+
+
+def keyword_overlap(full, sampled):
+    full_keywords = {kw["keyword"] for kw in full["keywords"]}
+    sampled_keywords = {kw["keyword"] for kw in sampled["keywords"]}
+    if not full_keywords and not sampled_keywords:
+        return 1.0
+    return len(full_keywords & sampled_keywords) / len(full_keywords | sampled_keywords)
+
+
+def benchmark_export(path, cap, max_users):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    messages = data["messages"] if isinstance(data, dict) else data
+    by_author = group_messages_by_author(messages)
+    # The heaviest posters are the ones the cap is meant for.
+    usernames = sorted(get_unique_usernames(messages), key=lambda u: len(by_author[u]), reverse=True)
+
+    rows = []
+    for username in usernames[:max_users]:
+        start = time.perf_counter()
+        full = find_favorite_topic(username, by_author[username], message_cap=0)
+        full_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sampled = find_favorite_topic(username, by_author[username], message_cap=cap)
+        sampled_seconds = time.perf_counter() - start
+
+        rows.append({
+            "username": username,
+            "messages": len(by_author[username]),
+            "full_label": full["label"],
+            "sampled_label": sampled["label"],
+            "label_match": full["label"].lower() == sampled["label"].lower(),
+            "keyword_jaccard": keyword_overlap(full, sampled),
+            "full_seconds": full_seconds,
+            "sampled_seconds": sampled_seconds,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Favorite-topic quality of capped sampling vs. full data.")
+    parser.add_argument("exports", nargs="*", default=SAMPLE_EXPORTS, help="Discord JSON exports (defaults to the sample exports)")
+    parser.add_argument("--cap", type=int, default=200, help="per-user message cap to evaluate")
+    parser.add_argument("--users", type=int, default=5, help="number of heaviest users to compare per export")
+    parser.add_argument("--output", help="optional path to write the per-user results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for path in args.exports:
+        rows = benchmark_export(path, args.cap, args.users)
+        results.extend(rows)
+        print(f"\n{os.path.basename(path)} (cap={args.cap})")
+        for row in rows:
+            print(
+                f"  {row['username']:<24} {row['messages']:>6} msgs  "
+                f"label {row['full_label']!r} -> {row['sampled_label']!r}  "
+                f"keywords J={row['keyword_jaccard']:.2f}  "
+                f"{row['full_seconds']:.1f}s -> {row['sampled_seconds']:.1f}s"
+            )
+
+    if results:
+        label_agreement = sum(row["label_match"] for row in results) / len(results)
+        mean_jaccard = sum(row["keyword_jaccard"] for row in results) / len(results)
+        speedup = sum(row["full_seconds"] for row in results) / max(sum(row["sampled_seconds"] for row in results), 1e-9)
+        print(f"\nLabel agreement: {label_agreement:.0%}  Mean keyword Jaccard: {mean_jaccard:.2f}  Speedup: {speedup:.1f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import json
+from datetime import date
+
+from peewee import fn
+
+from jsonParsing import funny_dryness_label, funny_humor_label, funny_romance_label
+from orm import db, DailyRollup
+
+# Columns that are summed when rollups are composed over a date range.
+ROLLUP_SUMS = [
+    "total_messages",
+    "messages_with_text",
+    "messages_with_links",
+    "messages_with_images",
+    "messages_with_gifs",
+    "messages_with_videos",
+    "messages_with_stickers",
+    "messages_with_audio_files",
+    "messages_with_documents",
+    "messages_with_other_files",
+    "edited_messages",
+    "meaningful_words",
+    "emoji_used",
+    "messages_with_emoji",
+    "emoji_used_in_reactions",
+    "messages_with_reactions",
+    "scored_messages",
+    "dryness_sum",
+    "humor_sum",
+    "romance_sum",
+]
+MESSAGE_TYPE_COUNTS = ROLLUP_SUMS[:11]
+
+_INSERT_BATCH = 30  # rows per INSERT, well under SQLite's bound-variable limit
+
+
+def store_rollups(username, rollups):
+    """
+    Writes the daily rollups collected by parse_messages(), {channel: {day: counters}}.
+    Days already stored for this user and channel are replaced, so re-uploading
+    an export doesn't double count, while other channels' rows for the same
+    days are kept.
+    """
+    rows = [
+        {
+            "username": username,
+            "day": date.fromisoformat(day),
+            "channel": channel,
+            **{**counters, "hourly": json.dumps(counters["hourly"])},
+        }
+        for channel, days in rollups.items()
+        for day, counters in days.items()
+    ]
+    with db.atomic():
+        for start in range(0, len(rows), _INSERT_BATCH):
+            DailyRollup.insert_many(rows[start:start + _INSERT_BATCH]).on_conflict_replace().execute()
+
+
+def _final_scores(total):
+    # Same scaling as parse_messages(): the average per-message score mapped to 1-10.
+    if not total["scored_messages"]:
+        return None, None, None
+    dryness = round(total["dryness_sum"] / total["scored_messages"] * 9 + 1, 2)
+    humor = round(round(total["humor_sum"] / total["scored_messages"] * 9 + 1, 2) + 2, 3)
+    romance = round(total["romance_sum"] / total["scored_messages"] * 9 + 1, 2)
+    return dryness, humor, romance
+
+
+def range_stats(username, start=None, end=None):
+    """
+    Composes a user's stats for the days start..end (inclusive, either may be
+    None) from the rollup table, summing every channel's rows, using the unique
+    (username, day, channel) index.
+    """
+    where = DailyRollup.username == username
+    if start is not None:
+        where &= DailyRollup.day >= start
+    if end is not None:
+        where &= DailyRollup.day <= end
+
+    sums = [fn.COALESCE(fn.SUM(getattr(DailyRollup, column)), 0) for column in ROLLUP_SUMS]
+    row = DailyRollup.select(
+        fn.MIN(DailyRollup.day), fn.MAX(DailyRollup.day), fn.COUNT(DailyRollup.day.distinct()), *sums
+    ).where(where).tuples().get()
+    first_day, last_day, active_days = row[:3]
+    total = dict(zip(ROLLUP_SUMS, row[3:]))
+
+    hourly = [0] * 24
+    messages_by_day = {}
+    for day, messages, day_hourly in DailyRollup.select(DailyRollup.day, DailyRollup.total_messages, DailyRollup.hourly).where(where).tuples():
+        for hour, count in enumerate(json.loads(day_hourly)):
+            hourly[hour] += count
+        messages_by_day[str(day)] = messages_by_day.get(str(day), 0) + messages
+    most_active_day = ("N/A", 0)
+    for day, messages in sorted(messages_by_day.items()):
+        if messages > most_active_day[1]:
+            most_active_day = (day, messages)
+    most_active_hour = max(range(24), key=hourly.__getitem__) if active_days else None
+
+    if first_day is not None:
+        span = (date.fromisoformat(str(last_day)) - date.fromisoformat(str(first_day))).days + 1
+        average_messages_per_day = round(total["total_messages"] / span, 3)
+    else:
+        average_messages_per_day = 0
+    average_words_per_message = (
+        round(total["meaningful_words"] / total["messages_with_text"], 3) if total["messages_with_text"] else 0
+    )
+    dryness, humor, romance = _final_scores(total)
+
+    return {
+        "username": username,
+        "start": str(start) if start is not None else None,
+        "end": str(end) if end is not None else None,
+        "Message Counts and Types": {column: total[column] for column in MESSAGE_TYPE_COUNTS},
+        "Activity Metrics": {
+            "active_days": active_days,
+            "first_day": str(first_day) if first_day is not None else None,
+            "last_day": str(last_day) if last_day is not None else None,
+            "average_messages_per_day": average_messages_per_day,
+            "messages_by_hour_of_day": hourly,
+        },
+        "Time-Related Details": {
+            "most_active_day": most_active_day,
+            "most_active_hour_of_day": (most_active_hour, hourly[most_active_hour]) if most_active_hour is not None else ("N/A", 0),
+        },
+        "Word Usage Statistics": {
+            "total_meaningful_words": total["meaningful_words"],
+            "average_words_per_message": average_words_per_message,
+        },
+        "Emoji Usage (in text and reactions)": {
+            "total_emoji_used": total["emoji_used"],
+            "messages_with_at_least_one_emoji": total["messages_with_emoji"],
+            "total_emoji_used_in_reactions": total["emoji_used_in_reactions"],
+            "messages_with_at_least_one_emoji_reacted": total["messages_with_reactions"],
+        },
+        "Dryness Score": dryness,
+        "Funny Dryness Label": funny_dryness_label(dryness) if dryness is not None else "No Data",
+        "Humor Score": round(humor, 2) if humor is not None else None,
+        "Funny Humor Label": funny_humor_label(humor) if humor is not None else "No Data",
+        "Romance Score": romance,
+        "Funny Romance Label": funny_romance_label(romance) if romance is not None else "No Data",
+    }
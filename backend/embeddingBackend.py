@@ -0,0 +1,174 @@
+import argparse
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MAX_SEQ_LENGTH = 256  # same truncation as the SentenceTransformer config of MiniLM
+
+# "torch" (stock fp32 SentenceTransformer), "torch-int8" (dynamically quantized
+# Linear layers) or "onnx" (ONNX Runtime model exported to EMBEDDER_MODEL_DIR).
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "torch")
+EMBEDDER_MODEL_DIR = os.getenv(
+    "EMBEDDER_MODEL_DIR", os.path.join(os.path.dirname(__file__), "models", "all-MiniLM-L6-v2-onnx")
+)
+# CPU threads used for inference (0 keeps the library default).
+EMBEDDER_THREADS = int(os.getenv("EMBEDDER_THREADS", "0"))
+
+
+def _as_text(sentence):
+    # Mirrors how SentenceTransformer turns non-string inputs into text.
+    if isinstance(sentence, dict):
+        sentence = next(iter(sentence.values()))
+    return str(sentence).strip()
+
+
+class OnnxEmbedder:
+    """
+    Runs an ONNX export of MiniLM with ONNX Runtime and reproduces the
+    SentenceTransformer head (mean pooling + L2 normalization). Prefers the
+    int8-quantized model_quantized.onnx when the directory has one.
+    """
+
+    def __init__(self, model_dir, threads=0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, "model_quantized.onnx")
+        if not os.path.exists(model_path):
+            model_path = os.path.join(model_dir, "model.onnx")
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"No ONNX model in {model_dir}; run `python embeddingBackend.py export {model_dir}` first"
+            )
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size=batch_size)[0]
+        texts = [_as_text(s) for s in sentences]
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            inputs = {name: value for name, value in inputs.items() if name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            batches.append(pooled.astype(np.float32))
+        if not batches:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.vstack(batches)
+
+    def get_sentence_embedding_dimension(self):
+        return self.session.get_outputs()[0].shape[-1] or 384
+
+
+def load_embedder(backend=None, model_dir=None, threads=None):
+    backend = backend or EMBEDDER_BACKEND
+    model_dir = model_dir or EMBEDDER_MODEL_DIR
+    threads = EMBEDDER_THREADS if threads is None else threads
+
+    if backend == "onnx":
+        return OnnxEmbedder(model_dir, threads)
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if threads:
+        torch.set_num_threads(threads)
+    model = SentenceTransformer(MODEL_NAME, device="cpu" if backend == "torch-int8" else None)
+    if backend == "torch-int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend != "torch":
+        raise ValueError(f"Unknown EMBEDDER_BACKEND {backend!r} (expected torch, torch-int8 or onnx)")
+    return model
+
+
+def set_inference_threads(threads):
+    """Caps torch's intra-op threads in this process (ONNX sessions keep the threads they were created with)."""
+    if EMBEDDER_BACKEND != "onnx":
+        import torch
+
+        torch.set_num_threads(threads)
+
+
+def keybert_model(embedder):
+    """Lets KeyBERT share the embedder instead of loading a second copy of MiniLM."""
+    from keybert.backend import BaseEmbedder
+    from sentence_transformers import SentenceTransformer
+
+    if isinstance(embedder, SentenceTransformer):
+        return embedder
+
+    class _SharedEmbedder(BaseEmbedder):
+        def embed(self, documents, verbose=False):
+            return embedder.encode(documents, show_progress_bar=verbose)
+
+    return _SharedEmbedder()
+
+
+# --- Exporting the ONNX model directory ---
+def export_onnx(model_dir, quantize=True):
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(model_dir, exist_ok=True)
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    model.tokenizer.save_pretrained(model_dir)
+    transformer = model[0].auto_model.eval()
+
+    dummy = model.tokenizer(["an example sentence"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(model_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(dummy[name] for name in names),
+            model_path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    print(f"Exported {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = os.path.join(model_dir, "model_quantized.onnx")
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"Quantized {quantized_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export all-MiniLM-L6-v2 for the onnx embedder backend.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="write model.onnx (and model_quantized.onnx) to a directory")
+    export_parser.add_argument("model_dir", nargs="?", default=EMBEDDER_MODEL_DIR)
+    export_parser.add_argument("--no-quantize", action="store_true", help="skip the int8 model")
+    args = parser.parse_args()
+    export_onnx(args.model_dir, quantize=not args.no_quantize)
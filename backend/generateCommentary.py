@@ -1,14 +1,8 @@
-from openai import OpenAI 
-import os
-from dotenv import load_dotenv
+from llmClient import chat, achat
 
-load_dotenv()
 
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key) 
+def commentary_messages(metric):
 
-def create_wrapped_commentary(metric):
-    
     prompt = (
         f"Here is a chatting metric: {metric}. "
         "Pretend you're narrating a Spotify Wrapped–style recap. "
@@ -17,15 +11,16 @@ def create_wrapped_commentary(metric):
         "Make it one sentence long."
         "Make sure to use emojis."
     )
-    
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "developer", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens= 100
-    )
-    
-    commentary = completion.choices[0].message.content.strip()
-    return commentary 
\ No newline at end of file
+
+    return [
+        {"role": "developer", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def create_wrapped_commentary(metric):
+    return chat(commentary_messages(metric), max_tokens=100)
+
+
+async def acreate_wrapped_commentary(metric):
+    return await achat(commentary_messages(metric), max_tokens=100)
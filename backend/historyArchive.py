@@ -0,0 +1,445 @@
+"""
+Export and import of the processed global history, so a server's results can
+be moved to another host or restored without re-running the NLP pipeline.
+
+    python historyArchive.py export history.npz
+    python historyArchive.py import history.npz [--replace]
+
+The archive is a single .npz (no pickled objects) with one array per column:
+
+  embedding          (n, d) float32, contiguous
+  three_d_embedding  (n, 3) float64, NaN rows for users without coordinates
+  stats.<i>          one typed column per stats leaf (int64, float64, or packed
+                     UTF-8 strings / JSON), plus a state array when some users
+                     lack the key or have null
+  keywords.*         the keyword lists flattened: per-user offsets, keyword
+                     strings and float64 scores
+  manifest           JSON: format version, row count, embedding shape, the
+                     stats column paths and kinds, and a SHA-256 over all arrays
+
+Import checks the manifest, the digest, the column lengths, that usernames are
+unique and that the embeddings are finite and match the dimension of the rows
+already in the database, then bulk-loads everything in one transaction.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from orm import db, create_tables, GlobalConversationHistory, FIDELITY_EXACT
+
+FORMAT_VERSION = 1
+
+_COUNT_BATCH = 900  # usernames per IN (...) when checking that every row was stored
+
+# Stats column states, stored only for columns where not every user has a value.
+MISSING, VALUE, NULL = 0, 1, 2
+
+
+class ArchiveError(ValueError):
+    """The archive is malformed, corrupted or doesn't fit the database."""
+
+
+# --- Packed strings ---
+def _pack_strings(strings):
+    """UTF-8 bytes of all strings plus (n + 1) offsets, instead of a pickled object array."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(data, offsets):
+    raw = data.tobytes()
+    return [raw[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def _put_strings(arrays, name, strings):
+    arrays[name + ".data"], arrays[name + ".offsets"] = _pack_strings(strings)
+
+
+def _get_strings(arrays, name):
+    return _unpack_strings(arrays[name + ".data"], arrays[name + ".offsets"])
+
+
+# --- Stats columns ---
+def _flatten(value, prefix, out):
+    for key, item in value.items():
+        path = prefix + (key,)
+        if isinstance(item, dict) and item:
+            _flatten(item, path, out)
+        else:
+            out[path] = item
+
+
+def _column_kind(values):
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, int) and not isinstance(v, bool) and -2**63 <= v < 2**63 for v in present):
+        return "int"
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return "float"
+    if all(isinstance(v, str) for v in present):
+        return "str"
+    return "json"
+
+
+def _encode_stats(all_stats, arrays):
+    """Stores the stats as typed columns and returns their manifest entries."""
+    flat = []
+    paths = {}  # path -> None, in first-seen order
+    for stats in all_stats:
+        leaves = {}
+        _flatten(stats, (), leaves)
+        flat.append(leaves)
+        for path in leaves:
+            paths.setdefault(path, None)
+    # A key that is a section for some users and a value for others can't be a
+    # column; such archives keep the stats as one JSON document per user.
+    if any(path[:i] in paths for path in paths for i in range(1, len(path))):
+        _put_strings(arrays, "stats.json", [json.dumps(stats) for stats in all_stats])
+        return None
+
+    columns = []
+    for i, path in enumerate(paths):
+        values = [leaves.get(path) for leaves in flat]
+        state = np.array(
+            [VALUE if leaves.get(path) is not None else (NULL if path in leaves else MISSING) for leaves in flat],
+            dtype=np.int8,
+        )
+        kind = _column_kind(values)
+        name = f"stats.{i}"
+        if kind == "int":
+            arrays[name] = np.array([v if v is not None else 0 for v in values], dtype=np.int64)
+        elif kind == "float":
+            arrays[name] = np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+            is_int = np.array([isinstance(v, int) for v in values])
+            if is_int.any():
+                arrays[name + ".int"] = is_int  # ints among floats (e.g. 0) come back as ints
+        elif kind == "str":
+            _put_strings(arrays, name, [v if v is not None else "" for v in values])
+        else:
+            _put_strings(arrays, name, [json.dumps(v) for v in values])
+        if (state != VALUE).any():
+            arrays[name + ".state"] = state
+        columns.append({"path": list(path), "kind": kind})
+    return columns
+
+
+def _column_values(arrays, name, kind):
+    if kind == "int":
+        return arrays[name].tolist()
+    if kind == "float":
+        values = arrays[name].tolist()
+        if name + ".int" in arrays:
+            values = [int(v) if is_int else v for v, is_int in zip(values, arrays[name + ".int"].tolist())]
+        return values
+    if kind == "str":
+        return _get_strings(arrays, name)
+    return [json.loads(v) for v in _get_strings(arrays, name)]
+
+
+def _decode_stats(arrays, columns, count):
+    if columns is None:
+        return [json.loads(s) for s in _get_strings(arrays, "stats.json")]
+    all_stats = [{} for _ in range(count)]
+    for i, column in enumerate(columns):
+        name = f"stats.{i}"
+        values = _column_values(arrays, name, column["kind"])
+        states = arrays[name + ".state"].tolist() if name + ".state" in arrays else [VALUE] * count
+        *sections, key = column["path"]
+        for stats, value, state in zip(all_stats, values, states):
+            if state == MISSING:
+                continue
+            node = stats
+            for section in sections:
+                node = node.setdefault(section, {})
+            node[key] = value if state == VALUE else None
+    return all_stats
+
+
+# --- Keywords ---
+def _is_keyword_list(keywords):
+    return isinstance(keywords, list) and all(
+        isinstance(k, dict) and set(k) == {"keyword", "score"} and isinstance(k["keyword"], str)
+        and isinstance(k["score"], (int, float)) and not isinstance(k["score"], bool)
+        for k in keywords
+    )
+
+
+def _encode_keywords(all_keywords, arrays):
+    if not all(_is_keyword_list(keywords) for keywords in all_keywords):
+        _put_strings(arrays, "keywords.json", [json.dumps(keywords) for keywords in all_keywords])
+        return "json"
+    offsets = np.zeros(len(all_keywords) + 1, dtype=np.int64)
+    np.cumsum([len(keywords) for keywords in all_keywords], out=offsets[1:])
+    arrays["keywords.offsets"] = offsets
+    _put_strings(arrays, "keywords.keyword", [k["keyword"] for keywords in all_keywords for k in keywords])
+    arrays["keywords.score"] = np.array([k["score"] for keywords in all_keywords for k in keywords], dtype=np.float64)
+    return "columns"
+
+
+def _decode_keywords(arrays, layout):
+    if layout == "json":
+        return [json.loads(s) for s in _get_strings(arrays, "keywords.json")]
+    offsets = arrays["keywords.offsets"].tolist()
+    words = _get_strings(arrays, "keywords.keyword")
+    scores = arrays["keywords.score"].tolist()
+    return [
+        [{"keyword": words[i], "score": scores[i]} for i in range(start, end)]
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+# --- Archive ---
+def _digest(arrays):
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        digest.update(f"{name}:{array.dtype.str}:{array.shape}".encode("utf-8"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def _parse_embeddings(texts):
+    """
+    Parses the JSON embedding column into a float32 matrix with one C-level
+    parse over all rows (json.loads per row is several times slower). Returns
+    (matrix, shape of one row).
+    """
+    shape = list(np.shape(json.loads(texts[0])))
+    depth = texts[0].count("[")
+    if any(text.count("[") != depth for text in texts):
+        raise ArchiveError("Embeddings have different shapes")
+    values = np.fromstring(",".join(texts).replace("[", "").replace("]", ""), dtype=np.float32, sep=",")
+    size = int(np.prod(shape))
+    if values.size != len(texts) * size:
+        raise ArchiveError("Embeddings have different lengths or are not numeric")
+    return values.reshape(len(texts), size), shape
+
+
+def _embedding_texts(matrix, shape):
+    """
+    JSON text of each embedding row. %.9g is the shortest format that round-trips
+    every float32, and is much faster than json.dumps over float64 reprs.
+    """
+    if int(np.prod(shape[:-1])) != 1:
+        return [json.dumps(row.reshape(shape).tolist()) for row in matrix]
+    template = "[" * len(shape) + ", ".join(["%.9g"] * shape[-1]) + "]" * len(shape)
+    return [template % tuple(row) for row in matrix.tolist()]
+
+
+def _map_chunks(fn, items, workers, *args, chunk_size=5000):
+    """fn(chunk, *args) over chunks of items, in worker processes when there are several."""
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        return [result for chunk in chunks for result in fn(chunk, *args)]
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        return [result for results in pool.map(fn, chunks, *[[arg] * len(chunks) for arg in args]) for result in results]
+
+
+def export_history(path):
+    """Writes every GlobalConversationHistory row to an archive; returns the manifest."""
+    with db.connection_context():
+        rows = list(GlobalConversationHistory.select().order_by(GlobalConversationHistory.username).tuples())
+    columns = [field.name for field in GlobalConversationHistory._meta.sorted_fields]
+    records = [dict(zip(columns, row)) for row in rows]
+    if not records:
+        raise ArchiveError("GlobalConversationHistory is empty; nothing to export")
+
+    arrays = {}
+    _put_strings(arrays, "username", [r["username"] for r in records])
+    _put_strings(arrays, "favorite_topic", [r["favorite_topic"] or "" for r in records])
+    _put_strings(arrays, "last_conversation", [r["last_conversation"] or "" for r in records])
+    _put_strings(arrays, "fidelity", [r["fidelity"] or FIDELITY_EXACT for r in records])
+    arrays["embedding"], embedding_shape = _parse_embeddings([r["embedding"] for r in records])
+    arrays["three_d_embedding"] = np.array(
+        [json.loads(r["three_d_embedding"]) if r["three_d_embedding"] else [np.nan] * 3 for r in records],
+        dtype=np.float64,
+    ).reshape(len(records), 3)
+    keywords = [json.loads(r["keywords"]) for r in records]
+    keywords_layout = _encode_keywords(keywords, arrays)
+    stats = [json.loads(r["stats"]) for r in records]
+    stats_columns = _encode_stats(stats, arrays)
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "created": datetime.now().isoformat(),
+        "table": GlobalConversationHistory._meta.table_name,
+        "count": len(records),
+        "embedding_shape": embedding_shape,
+        "keywords": keywords_layout,
+        "stats_columns": stats_columns,
+        "digest": _digest(arrays),
+    }
+
+    # Check the round trip before anything is written.
+    archive = decode_archive({**arrays, "manifest": _manifest_array(manifest)})
+    for i, record in enumerate(records):
+        for column, original in (
+            ("favorite_topic", record["favorite_topic"] or ""),
+            ("last_conversation", record["last_conversation"] or ""),
+            ("keywords", keywords[i]),
+            ("stats", stats[i]),
+        ):
+            if archive[column][i] != original:
+                raise ArchiveError(f"{column} of {record['username']} does not round-trip")
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, manifest=_manifest_array(manifest), **arrays)
+    os.replace(tmp, path)
+    return manifest
+
+
+def _manifest_array(manifest):
+    return np.frombuffer(json.dumps(manifest).encode("utf-8"), dtype=np.uint8)
+
+
+def read_archive(path):
+    try:
+        with np.load(path, allow_pickle=False) as stored:
+            return {name: stored[name] for name in stored.files}
+    except (OSError, ValueError) as e:
+        raise ArchiveError(f"Cannot read {path}: {e}") from e
+
+
+def decode_archive(arrays):
+    """Validates an archive and returns its columns (decoded, one entry per user)."""
+    if "manifest" not in arrays:
+        raise ArchiveError("Missing manifest")
+    manifest = json.loads(arrays.pop("manifest").tobytes().decode("utf-8"))
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ArchiveError(f"Unsupported archive format {manifest.get('format')!r}")
+    if _digest(arrays) != manifest["digest"]:
+        raise ArchiveError("Digest mismatch: the archive is corrupted or was modified")
+
+    count = manifest["count"]
+    try:
+        archive = {
+            "username": _get_strings(arrays, "username"),
+            "favorite_topic": _get_strings(arrays, "favorite_topic"),
+            "last_conversation": _get_strings(arrays, "last_conversation"),
+            "fidelity": _get_strings(arrays, "fidelity"),
+            "keywords": _decode_keywords(arrays, manifest["keywords"]),
+            "stats": _decode_stats(arrays, manifest["stats_columns"], count),
+            "embedding": arrays["embedding"],
+            "three_d_embedding": arrays["three_d_embedding"],
+        }
+    except KeyError as e:
+        raise ArchiveError(f"Missing column {e}") from e
+
+    wrong = {name: len(values) for name, values in archive.items() if len(values) != count}
+    if wrong:
+        raise ArchiveError(f"Expected {count} rows, got {wrong}")
+    if len(set(archive["username"])) != count or not all(archive["username"]):
+        raise ArchiveError("Usernames are empty or not unique")
+    embedding = archive["embedding"]
+    if embedding.dtype != np.float32 or embedding.ndim != 2 or embedding.shape[1] != int(np.prod(manifest["embedding_shape"])):
+        raise ArchiveError(f"Embedding matrix {embedding.dtype} {embedding.shape} doesn't match the manifest")
+    if not np.isfinite(embedding).all():
+        raise ArchiveError("Embeddings contain NaN or infinite values")
+    archive["embedding_shape"] = manifest["embedding_shape"]
+    return archive
+
+
+def _json_rows(chunk):
+    return [(json.dumps(keywords), json.dumps(stats)) for keywords, stats in chunk]
+
+
+def _stored_embedding_size():
+    row = GlobalConversationHistory.select(GlobalConversationHistory.embedding).first()
+    return None if row is None else int(np.size(json.loads(row.embedding)))
+
+
+def import_history(path, replace=False, workers=os.cpu_count() or 1):
+    """
+    Bulk-loads an archive into GlobalConversationHistory. Users already in the
+    table are overwritten; with replace=True every other row is removed first.
+    Returns the number of imported users.
+    """
+    archive = decode_archive(read_archive(path))
+    count = len(archive["username"])
+    with db.connection_context():
+        existing = None if replace else _stored_embedding_size()
+        size = archive["embedding"].shape[1]
+        if existing is not None and existing != size:
+            raise ArchiveError(
+                f"Archive embeddings have {size} values, the database has {existing}; use --replace to swap them"
+            )
+
+    # The text columns are what the rest of the backend reads, so they are rebuilt here.
+    embeddings = _map_chunks(_embedding_texts, archive["embedding"], workers, archive["embedding_shape"])
+    documents = _map_chunks(_json_rows, list(zip(archive["keywords"], archive["stats"])), workers)
+    three_d = archive["three_d_embedding"]
+    has_three_d = ~np.isnan(three_d).any(axis=1)
+    values = {
+        "username": archive["username"],
+        "favorite_topic": archive["favorite_topic"],
+        "keywords": [keywords for keywords, _ in documents],
+        "stats": [stats for _, stats in documents],
+        "embedding": embeddings,
+        "three_d_embedding": [json.dumps(point) if present else "" for point, present in zip(three_d.tolist(), has_three_d)],
+        "last_conversation": archive["last_conversation"],
+        "fidelity": archive["fidelity"],
+        "version": [0] * count,  # replaced by the insert trigger, so cached copies are dropped
+    }
+    fields = GlobalConversationHistory._meta.sorted_fields
+    rows = list(zip(*(values[field.name] for field in fields)))
+    # executemany on the raw cursor: building 100k peewee insert queries costs more than the inserts.
+    insert = 'INSERT OR REPLACE INTO "{}" ({}) VALUES ({})'.format(
+        GlobalConversationHistory._meta.table_name,
+        ", ".join(f'"{field.column_name}"' for field in fields),
+        ", ".join("?" * len(fields)),
+    )
+
+    with db.connection_context():
+        with db.atomic():
+            if replace:
+                GlobalConversationHistory.delete().execute()
+            db.cursor().executemany(insert, rows)
+            stored = sum(
+                GlobalConversationHistory.select()
+                .where(GlobalConversationHistory.username.in_(archive["username"][start:start + _COUNT_BATCH]))
+                .count()
+                for start in range(0, count, _COUNT_BATCH)
+            )
+            if stored != count:
+                raise ArchiveError(f"Only {stored} of {count} rows were stored")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the processed global conversation history.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write GlobalConversationHistory to an .npz archive")
+    export_parser.add_argument("path")
+    import_parser = commands.add_parser("import", help="load an archive written by export")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--replace", action="store_true", help="remove users that are not in the archive")
+    import_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes used to rebuild the JSON columns")
+    args = parser.parse_args()
+
+    create_tables()
+    started = time.perf_counter()
+    try:
+        if args.command == "export":
+            manifest = export_history(args.path)
+            print(f"Exported {manifest['count']} users to {args.path} in {time.perf_counter() - started:.2f}s")
+        else:
+            count = import_history(args.path, args.replace, args.workers)
+            print(f"Imported {count} users from {args.path} in {time.perf_counter() - started:.2f}s")
+    except ArchiveError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+from array import array
+
+import numpy as np
+import scipy.sparse as sp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Where the latest upload's interaction graph is stored.
+INTERACTION_GRAPH_DIR = os.getenv(
+    "INTERACTION_GRAPH_DIR", os.path.join(os.path.dirname(__file__), "interaction_graph")
+)
+INTERACTION_TYPES = ("replies", "mentions", "reactions")
+GRAPH_FILE = "graph.npz"  # users, the sparse matrix of every interaction type and the centrality
+
+
+class InteractionGraphBuilder:
+    """
+    Collects user-to-user edges one message at a time, so it can ride along the
+    ingestion pass. Edges go from the acting user to the user they interacted
+    with: replier -> replied-to author, mentioner -> mentioned, reactor -> author.
+    Everything is stored in flat integer arrays, so memory and time stay linear
+    in the number of messages.
+    """
+
+    def __init__(self):
+        self.user_index = {}
+        self.usernames = []
+        self.edges = {kind: (array("i"), array("i")) for kind in INTERACTION_TYPES}
+        self.message_authors = {}  # message id -> author index, to resolve replies
+        self.pending_replies = (array("i"), [])  # (replier, referenced message id)
+
+    def _user(self, name):
+        index = self.user_index.get(name)
+        if index is None:
+            index = self.user_index[name] = len(self.usernames)
+            self.usernames.append(name)
+        return index
+
+    def _edge(self, kind, source, target):
+        if source != target:
+            rows, cols = self.edges[kind]
+            rows.append(source)
+            cols.append(target)
+
+    def add_message(self, msg):
+        author_name = msg.get("author", {}).get("name")
+        if not author_name:
+            return
+        author = self._user(author_name)
+
+        message_id = msg.get("id")
+        if message_id is not None:
+            self.message_authors[message_id] = author
+
+        referenced = (msg.get("reference") or {}).get("messageId")
+        if referenced:
+            self.pending_replies[0].append(author)
+            self.pending_replies[1].append(referenced)
+
+        for mention in msg.get("mentions") or []:
+            name = mention.get("name")
+            if name:
+                self._edge("mentions", author, self._user(name))
+
+        for reaction in msg.get("reactions") or []:
+            for user in reaction.get("users") or []:
+                name = user.get("name")
+                if name:
+                    self._edge("reactions", self._user(name), author)
+
+    def build(self):
+        # Replies can point at messages that appear later in the export, so they
+        # are resolved once every message id has been seen.
+        for replier, referenced in zip(*self.pending_replies):
+            target = self.message_authors.get(referenced)
+            if target is not None:
+                self._edge("replies", replier, target)
+
+        n = len(self.usernames)
+        matrices = {}
+        for kind, (rows, cols) in self.edges.items():
+            data = np.ones(len(rows), dtype=np.float32)
+            matrix = sp.coo_matrix(
+                (data, (np.frombuffer(rows, dtype=np.int32), np.frombuffer(cols, dtype=np.int32))),
+                shape=(n, n),
+            )
+            matrices[kind] = matrix.tocsr()  # sums duplicate edges
+        return InteractionGraph(list(self.usernames), matrices)
+
+
+def pagerank(matrix, damping=0.85, iterations=100, tolerance=1e-8):
+    """Weighted PageRank by power iteration on a sparse adjacency matrix."""
+    n = matrix.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    out_weight = np.asarray(matrix.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, out_weight, out=np.zeros(n), where=out_weight > 0)
+    transition = sp.diags(inverse) @ matrix  # row-stochastic for users with out-edges
+    dangling = out_weight == 0
+    rank = np.full(n, 1.0 / n)
+    for _ in range(iterations):
+        updated = damping * (transition.T @ rank + rank[dangling].sum() / n) + (1 - damping) / n
+        if np.abs(updated - rank).sum() < tolerance:
+            rank = updated
+            break
+        rank = updated
+    return rank
+
+
+class InteractionGraph:
+    def __init__(self, usernames, matrices, centrality=None):
+        self.usernames = usernames
+        self.index = {name: i for i, name in enumerate(usernames)}
+        self.matrices = matrices
+        self.combined = sum(matrices.values(), sp.csr_matrix((len(usernames), len(usernames)), dtype=np.float32))
+        self.centrality = centrality if centrality is not None else self._centrality()
+
+    def _centrality(self):
+        return {
+            "pagerank": pagerank(self.combined),
+            "in_degree": np.asarray(self.combined.sum(axis=0)).ravel(),
+            "out_degree": np.asarray(self.combined.sum(axis=1)).ravel(),
+        }
+
+    # --- Persistence ---
+    # The whole graph is one archive, swapped in with os.replace, so a reader
+    # never sees the user index of one upload with the matrices of another.
+    def save(self, directory=INTERACTION_GRAPH_DIR):
+        os.makedirs(directory, exist_ok=True)
+        arrays = {"users": np.frombuffer(json.dumps(self.usernames).encode("utf-8"), dtype=np.uint8)}
+        for kind, matrix in self.matrices.items():
+            matrix = matrix.tocsr()
+            arrays[f"{kind}.data"] = matrix.data
+            arrays[f"{kind}.indices"] = matrix.indices
+            arrays[f"{kind}.indptr"] = matrix.indptr
+        for name, values in self.centrality.items():
+            arrays[f"centrality.{name}"] = values.astype(np.float32)
+        tmp = os.path.join(directory, ".graph.tmp.npz")
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, os.path.join(directory, GRAPH_FILE))
+
+    @classmethod
+    def load(cls, directory=INTERACTION_GRAPH_DIR):
+        with open(os.path.join(directory, GRAPH_FILE), "rb") as f:
+            return cls._read(f)
+
+    @classmethod
+    def _read(cls, f):
+        with np.load(f) as stored:
+            usernames = json.loads(stored["users"].tobytes().decode("utf-8"))
+            n = len(usernames)
+            matrices = {
+                kind: sp.csr_matrix(
+                    (stored[f"{kind}.data"], stored[f"{kind}.indices"], stored[f"{kind}.indptr"]), shape=(n, n)
+                )
+                for kind in INTERACTION_TYPES
+            }
+            centrality = {
+                name.split(".", 1)[1]: stored[name] for name in stored.files if name.startswith("centrality.")
+            }
+        return cls(usernames, matrices, centrality)
+
+    # --- Queries ---
+    def neighbours(self, username, k=10, kind=None):
+        """
+        Top-k users this user interacts with most, counting both directions
+        (what they did to others and what others did to them).
+        """
+        i = self.index[username]
+        matrix = self.combined if kind is None else self.matrices[kind]
+        weights = np.asarray(matrix.getrow(i).todense()).ravel() + np.asarray(matrix.getcol(i).todense()).ravel()
+        weights[i] = 0
+        candidates = np.flatnonzero(weights)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-weights[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-weights[candidates], kind="stable")]
+        result = []
+        for j in candidates:
+            entry = {"username": self.usernames[j], "weight": float(weights[j])}
+            for name, m in self.matrices.items():
+                entry[name] = {"given": float(m[i, j]), "received": float(m[j, i])}
+            result.append(entry)
+        return result
+
+    def user_centrality(self, username):
+        i = self.index[username]
+        pagerank_values = self.centrality["pagerank"]
+        return {
+            "pagerank": float(pagerank_values[i]),
+            "pagerank_rank": int((pagerank_values > pagerank_values[i]).sum()) + 1,
+            "in_degree": float(self.centrality["in_degree"][i]),
+            "out_degree": float(self.centrality["out_degree"][i]),
+        }
+
+
+_loaded = {"graph": None, "version": None}
+_load_lock = threading.Lock()
+
+
+def latest_graph(directory=INTERACTION_GRAPH_DIR):
+    """Returns the stored graph, reloading it only when a newer upload replaced it."""
+    try:
+        f = open(os.path.join(directory, GRAPH_FILE), "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        # The open file stays the same archive even if a save replaces it meanwhile.
+        stat = os.fstat(f.fileno())
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with _load_lock:
+            if _loaded["version"] != version:
+                _loaded["graph"] = InteractionGraph._read(f)
+                _loaded["version"] = version
+            return _loaded["graph"]
@@ -6,6 +6,7 @@ import math
 import nltk
 from tqdm import tqdm
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
+from textScanner import url_pattern, scan_message, scan_messages
 
 # --- Helper functions for file type detection ---
 def is_image(filename):
@@ -24,57 +25,32 @@ def is_document(filename):
     return filename.lower().endswith(('.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'))
 
 def contains_link(text):
-    url_regex = re.compile(r'https?://\S+')
-    return bool(url_regex.search(text))
+    return bool(url_pattern.search(text))
 
 # format timedelta helper function
-def parse_timedelta(time_str):
+def format_timedelta(delta):
     """
-    Parses a time string in one of the following formats:
-      - "HH:MM"
-      - "HH:MM:SS"
-      - "X days, HH:MM"
-      - "X days, HH:MM:SS"
-    Returns a timedelta object.
+    Formats a timedelta as "{days} days, {hours} hours, and {minutes} minutes"
+    (seconds are dropped), the form shown in the stats.
     """
-    time_str = str(time_str)
-    print(time_str)
+    hours, remainder = divmod(delta.seconds, 3600)
+    return f"{delta.days} days, {hours} hours, and {remainder // 60} minutes"
 
-    days = 0
-    # Check if the time string contains a day component.
-    if "day" in time_str:
-        days_part, time_part = time_str.split(", ")
-        days = int(days_part.split()[0])
-    else:
-        time_part = time_str
-
-    # Split the time part by ":".
-    parts = time_part.split(":")
-    print(parts)
-
-    if len(parts) == 2:
-        # Format is HH:MM, assume 0 seconds.
-        hours, minutes = map(int, parts)
-        seconds = 0
-
-    elif len(parts) == 3:
-        # Format is HH:MM:SS.
-        hours, minutes, seconds = map(float, parts)
-        seconds = round(seconds)
-    else:
-        raise ValueError("Time string is not in a recognized format (expected HH:MM or HH:MM:SS)")
-    
-    return f"{int(days)} days, {int(hours)} hours, and {int(minutes)} minutes"
-    
-    # return timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
-
-# --- Regex for detecting Unicode emoji in text ---
-emoji_pattern = re.compile("[" 
-    u"\U0001F600-\U0001F64F"  # Emoticons
-    u"\U0001F300-\U0001F5FF"  # Symbols & pictographs
-    u"\U0001F680-\U0001F6FF"  # Transport & map symbols
-    u"\U0001F1E0-\U0001F1FF"  # Flags
-    "]+", flags=re.UNICODE)
+# --- Numeric features: the stats part of a user's embedding (see generateEmbedding.py), in order ---
+STAT_FEATURES = (
+    "total_messages",
+    "average_messages_per_day",
+    "longest_active_conversation_seconds",
+    "longest_period_without_messages_seconds",
+    "dryness_score",
+    "humor_score",
+    "messages_with_emoji",
+    "most_used_emoji_count",
+    "average_words_per_message",
+    "total_meaningful_words",
+    "unique_words_used",
+    "most_active_day_messages",
+)
 
 # --- Stopwords list (expand as needed) ---
 stopwords = {
@@ -123,24 +99,26 @@ def compute_message_dryness(message_text):
     return dryness
 
 # --- Heuristic humor scoring (no LLM) ---
-def compute_message_humor(message_text):
+def compute_message_humor(message_text, scan=None, word_count=None):
     """
     Computes a humor score (0 to 1) using simple heuristics:
       - Counts laughter-related keywords ("lol", "haha", etc.).
       - Counts exclamation marks.
       - Counts emojis.
     The score is computed relative to the total number of words.
+    scan (from textScanner) and word_count (words in the lowercased text) can be
+    passed in when the caller already has them.
     """
-    text_lower = message_text.lower()
-    words = re.findall(r'\b\w+\b', text_lower)
-    word_count = len(words)
+    if scan is None:
+        scan = scan_message(message_text)
+    if word_count is None:
+        word_count = len(re.findall(r'\b\w+\b', message_text.lower()))
     
-    # Laughter keywords.
-    laughter_keywords = ["lol", "haha", "lmao", "rofl", "xd"]
-    laughter_count = sum(text_lower.count(kw) for kw in laughter_keywords)
+    # Laughter keywords (see textScanner.LAUGHTER_KEYWORDS).
+    laughter_count = scan.laughter
     
     exclamation_count = message_text.count("!")
-    emoji_count = len(emoji_pattern.findall(message_text))
+    emoji_count = len(scan.emojis)
     
     # Compute a raw humor score.
     # The numerator gives extra weight to laughter keywords.
@@ -152,28 +130,23 @@ def compute_message_humor(message_text):
     return humor
 
 # --- Heuristic romance scoring ---
-def compute_message_romance(message_text):
+def compute_message_romance(message_text, scan=None, word_count=None):
     """
     Computes a romance score (0 to 1) using simple heuristics:
       - Counts romance-related keywords (e.g., "love", "darling", "romantic", etc.).
       - Counts heart-related emojis.
       - Adds a boost if the sentiment is highly positive.
     The score is computed relative to the total number of words and then scaled.
+    scan and word_count are optional, as for compute_message_humor.
     """
-    text_lower = message_text.lower()
-    words = re.findall(r'\b\w+\b', text_lower)
-    word_count = len(words)
-    
-    # Define romance keywords.
-    romance_keywords = [
-        "love", "loved", "loving", "adorable", "adore", "sweetheart",
-        "dear", "darling", "romance", "romantic", "passion", "infatuation", "amour"
-    ]
-    romance_count = sum(text_lower.count(kw) for kw in romance_keywords)
+    if scan is None:
+        scan = scan_message(message_text)
+    if word_count is None:
+        word_count = len(re.findall(r'\b\w+\b', message_text.lower()))
     
-    # Count heart-related emojis.
-    heart_emojis = ["❤️", "😍", "😘", "💕", "💖", "💗", "💘", "💝"]
-    heart_count = sum(message_text.count(emoji) for emoji in heart_emojis)
+    # Romance keywords and heart-related emojis (see textScanner).
+    romance_count = scan.romance
+    heart_count = scan.hearts
     
     # Use sentiment analysis for a positive boost.
     analyzer = SentimentIntensityAnalyzer()
@@ -229,8 +202,38 @@ def funny_humor_label(final_score):
     else:
         return "Not Funny (Better stick to memes)"
 
+# --- Daily rollups: per-day sums of the counters below, composable over any date range ---
+def new_daily_rollup():
+    return {
+        "total_messages": 0,
+        "messages_with_text": 0,
+        "messages_with_links": 0,
+        "messages_with_images": 0,
+        "messages_with_gifs": 0,
+        "messages_with_videos": 0,
+        "messages_with_stickers": 0,
+        "messages_with_audio_files": 0,
+        "messages_with_documents": 0,
+        "messages_with_other_files": 0,
+        "edited_messages": 0,
+        "meaningful_words": 0,
+        "emoji_used": 0,
+        "messages_with_emoji": 0,
+        "emoji_used_in_reactions": 0,
+        "messages_with_reactions": 0,
+        "scored_messages": 0,  # text messages, i.e. the number of dryness/humor/romance scores
+        "dryness_sum": 0.0,
+        "humor_sum": 0.0,
+        "romance_sum": 0.0,
+        "hourly": [0] * 24,  # messages per hour of the day
+    }
+
 # --- Main parsing function ---
-def parse_messages(data, target_username):
+def parse_messages(data, target_username, daily_rollups=None):
+    # When daily_rollups is a dict, it is filled with {channel: {day: rollup}}:
+    # one new_daily_rollup() per channel name ("" when unknown) and "YYYY-MM-DD"
+    # (in each message's own UTC offset) holding that day's share of the
+    # counters, so stats for any date range can be composed later.
     # Load the JSON data.
     # If the JSON is wrapped in a dictionary with a "messages" key, extract it.
     if isinstance(data, dict) and "messages" in data:
@@ -290,9 +293,14 @@ def parse_messages(data, target_username):
     humor_scores = []
     romance_scores = []
     
+    # Scan all text content for keywords, hearts, emoji and links in one batch.
+    contents = [msg.get('content', '').strip() for msg in user_messages]
+    scans = iter(scan_messages([content for content in contents if content]))
+    
     # Wrap the loop with tqdm to show a progress bar.
-    for msg in tqdm(user_messages, desc=f"Processing messages for {target_username}"):
+    for msg, content in tqdm(zip(user_messages, contents), total=len(user_messages), desc=f"Processing messages for {target_username}"):
         # Process timestamp.
+        day = None
         timestamp_str = msg.get('timestamp')
         if timestamp_str:
             try:
@@ -306,15 +314,25 @@ def parse_messages(data, target_username):
             month_counter[dt.strftime("%Y-%m")] += 1
             day_counter[dt.strftime("%Y-%m-%d")] += 1
             hour_counter[dt.strftime("%Y-%m-%d %I %p")] += 1
+            if daily_rollups is not None:
+                channel = msg.get("channel")
+                if isinstance(channel, dict):
+                    channel = channel.get("name")
+                channel_rollups = daily_rollups.setdefault(channel or "", {})
+                day_key = dt.strftime("%Y-%m-%d")
+                day = channel_rollups.get(day_key)
+                if day is None:
+                    day = channel_rollups[day_key] = new_daily_rollup()
+                before = (dict(stats), emoji_count_total, messages_with_emoji, total_emoji_reactions, messages_with_reactions)
         
         if msg.get('timestampEdited'):
             stats["edited_messages"] += 1
         
         # Process text content.
-        content = msg.get('content', '').strip()
         if content:
+            scan = next(scans)
             stats["messages_with_text"] += 1
-            if contains_link(content):
+            if scan.has_link:
                 stats["messages_with_links"] += 1
             
             # Tokenize and remove stopwords.
@@ -324,7 +342,7 @@ def parse_messages(data, target_username):
             all_words.extend(meaningful_words)
             
             # Count Unicode (text) emojis.
-            emojis_found = emoji_pattern.findall(content)
+            emojis_found = scan.emojis
             if emojis_found:
                 messages_with_emoji += 1
                 for em in emojis_found:
@@ -333,8 +351,8 @@ def parse_messages(data, target_username):
             
             # Compute dryness, humor, and romance scores using our heuristic functions.
             dryness_scores.append(compute_message_dryness(content))
-            humor_scores.append(compute_message_humor(content))
-            romance_scores.append(compute_message_romance(content))
+            humor_scores.append(compute_message_humor(content, scan, len(words)))
+            romance_scores.append(compute_message_romance(content, scan, len(words)))
         
         # Process inline (custom) emojis.
         inline_emojis = msg.get('inlineEmojis', [])
@@ -381,6 +399,24 @@ def parse_messages(data, target_username):
                 emoji_name = emoji_info.get('name')
                 if emoji_name:
                     emoji_counter_reactions[emoji_name] += count
+
+        # Add this message's share of every counter to its day.
+        if day is not None:
+            day["total_messages"] += 1
+            day["hourly"][dt.hour] += 1
+            for key, value in stats.items():
+                if key != "total_messages":
+                    day[key] += value - before[0][key]
+            day["emoji_used"] += emoji_count_total - before[1]
+            day["messages_with_emoji"] += messages_with_emoji - before[2]
+            day["emoji_used_in_reactions"] += total_emoji_reactions - before[3]
+            day["messages_with_reactions"] += messages_with_reactions - before[4]
+            if content:
+                day["meaningful_words"] += text_word_counts[-1]
+                day["scored_messages"] += 1
+                day["dryness_sum"] += dryness_scores[-1]
+                day["humor_sum"] += humor_scores[-1]
+                day["romance_sum"] += romance_scores[-1]
     
     # --- Time-based statistics ---
     sorted_timestamps.sort()
@@ -390,7 +426,7 @@ def parse_messages(data, target_username):
             gap = sorted_timestamps[i] - sorted_timestamps[i-1]
             if gap > longest_gap:
                 longest_gap = gap
-    longest_gap_string = parse_timedelta(longest_gap)
+    longest_gap_string = format_timedelta(longest_gap)
 
     if all_timestamps:
         total_days = (max(all_timestamps) - min(all_timestamps)).days + 1
@@ -417,7 +453,7 @@ def parse_messages(data, target_username):
     else:
         longest_conversation = timedelta(0)
 
-    longest_conversation_string = parse_timedelta(longest_conversation)
+    longest_conversation_string = format_timedelta(longest_conversation)
     
     total_meaningful_words = sum(text_word_counts)
     unique_words = set(all_words)
@@ -512,7 +548,22 @@ def parse_messages(data, target_username):
         "Humor Score": round(final_humor_score, 2) if final_humor_score is not None else None,
         "Funny Humor Label": funny_humor_label_text,
         "Romance Score": final_romance_score,
-        "Funny Romance Label": funny_romance_label_text
+        "Funny Romance Label": funny_romance_label_text,
+        # The same metrics as plain numbers (durations in seconds), keyed by STAT_FEATURES.
+        "Features": {
+            "total_messages": len(user_messages),
+            "average_messages_per_day": avg_messages_per_day,
+            "longest_active_conversation_seconds": int(longest_conversation.total_seconds()),
+            "longest_period_without_messages_seconds": int(longest_gap.total_seconds()),
+            "dryness_score": final_dryness_score or 0,
+            "humor_score": round(final_humor_score, 2) if final_humor_score is not None else 0,
+            "messages_with_emoji": messages_with_emoji,
+            "most_used_emoji_count": overall_count,
+            "average_words_per_message": avg_words_per_message,
+            "total_meaningful_words": total_meaningful_words,
+            "unique_words_used": len(unique_words),
+            "most_active_day_messages": most_active_day[1],
+        },
     }
     
     return result
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+load_dotenv()
+
+api_key = os.getenv("OPENAI_API_KEY")
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# Point this at a local mock server (see mockLLMServer.py) for load tests.
+LLM_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Maximum number of LLM requests in flight per process; also the connection pool size.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+# Seconds before a single LLM request is abandoned.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+# Retries on connection errors, timeouts, 429 and 5xx, with exponential backoff and jitter.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+
+def _limits():
+    return httpx.Limits(max_connections=LLM_MAX_CONCURRENCY, max_keepalive_connections=LLM_MAX_CONCURRENCY)
+
+
+# --- Shared synchronous client (Flask views, topic labeling) ---
+client = OpenAI(
+    api_key=api_key,
+    base_url=LLM_BASE_URL,
+    timeout=LLM_TIMEOUT,
+    max_retries=LLM_MAX_RETRIES,
+    http_client=httpx.Client(limits=_limits(), timeout=LLM_TIMEOUT),
+)
+_sync_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+
+def chat(messages, **kwargs):
+    """Sends a chat completion through the shared client and returns the reply text."""
+    with _sync_slots:
+        completion = client.chat.completions.create(model=LLM_MODEL, messages=messages, **kwargs)
+    return completion.choices[0].message.content.strip()
+
+
+# --- Shared asynchronous client (ASGI serving mode) ---
+# httpx async pools are bound to the event loop that created them, so the client is
+# created lazily inside the serving loop and closed when the server shuts down.
+_async_client = None
+_async_slots = None
+
+
+def get_async_client():
+    global _async_client, _async_slots
+    if _async_client is None:
+        _async_client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=LLM_BASE_URL,
+            timeout=LLM_TIMEOUT,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=httpx.AsyncClient(limits=_limits(), timeout=LLM_TIMEOUT),
+        )
+        _async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _async_client
+
+
+async def achat(messages, **kwargs):
+    """Async version of chat(); at most LLM_MAX_CONCURRENCY calls run at once."""
+    async_client = get_async_client()
+    async with _async_slots:
+        completion = await async_client.chat.completions.create(model=LLM_MODEL, messages=messages, **kwargs)
+    return completion.choices[0].message.content.strip()
+
+
+async def aclose():
+    global _async_client, _async_slots
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+        _async_slots = None
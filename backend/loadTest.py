@@ -0,0 +1,347 @@
+"""
+Load test for the serving endpoints, with the LLM mocked.
+
+    python loadTest.py --users 5000 --concurrency 32 --duration 30
+    python loadTest.py --server flask --mix history=1
+    python loadTest.py --url http://127.0.0.1:5000 --no-seed   # an already running server
+
+Seeds a scratch SQLite database with --users synthetic users (the last
+--local-users of them form the latest upload), starts mockLLMServer and the app
+(uvicorn asgi:app, or the threaded Flask server) against them, then runs
+--concurrency closed-loop clients for --duration seconds. Every client picks
+its next request from --mix (endpoint=weight pairs). Throughput and p50/p95/p99
+latency are reported per endpoint; --json writes the same report to a file so
+runs can be compared over time.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import httpx
+import numpy as np
+
+from jsonParsing import STAT_FEATURES, format_timedelta
+from mockLLMServer import start_mock_server
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBEDDING_SIZE = 384 + len(STAT_FEATURES)  # topic embedding + stats vector, as built by getEmbeddings()
+
+ENDPOINTS = {
+    "history": ("GET", "/getconversationhistory"),
+    "local_graph": ("GET", "/api/local_graph"),
+    "global_graph": ("GET", "/api/global_graph"),
+    "commentary": ("POST", "/generateCommentary"),
+}
+DEFAULT_MIX = "history=4,local_graph=2,global_graph=1,commentary=2"
+WORDS = ["game", "music", "anime", "school", "food", "movie", "code", "cat", "travel", "art", "gym", "meme"]
+
+
+# --- Seeding ---
+def _synthetic_stats(rng):
+    # The shape parse_messages() returns, including the numeric "Features" record.
+    total = rng.randint(10, 20000)
+    per_day = round(rng.uniform(0.5, 200), 2)
+    longest_gap = timedelta(days=rng.randint(0, 90), hours=rng.randint(0, 23), minutes=rng.randint(0, 59))
+    longest_conversation = timedelta(hours=rng.randint(0, 23), minutes=rng.randint(0, 59))
+    meaningful_words = total * 4
+    unique_words = rng.randint(50, 5000)
+    words_per_message = round(rng.uniform(1, 15), 2)
+    with_emoji = rng.randint(0, total // 2)
+    emoji_count = rng.randint(0, 500)
+    dryness = round(rng.uniform(1, 10), 2)
+    humor = round(rng.uniform(1, 10), 2)
+    busiest_day = total // 40
+    return {
+        "Message Counts and Types": {
+            "total_messages": total,
+            "messages_with_text": int(total * 0.9),
+            "messages_with_links": rng.randint(0, total // 10),
+            "messages_with_images": rng.randint(0, total // 10),
+            "messages_with_gifs": rng.randint(0, total // 20),
+            "messages_with_videos": rng.randint(0, total // 50),
+            "messages_with_stickers": rng.randint(0, total // 50),
+            "messages_with_audio_files": 0,
+            "messages_with_documents": 0,
+            "messages_with_other_files": 0,
+            "edited_messages": rng.randint(0, total // 20),
+        },
+        "Activity Metrics": {
+            "average_messages_per_day": per_day,
+            "longest_period_without_messages": format_timedelta(longest_gap),
+            "longest_active_conversation": format_timedelta(longest_conversation),
+        },
+        "Time-Related Details": {
+            "most_active_year": [2024, total // 2],
+            "most_active_month": ["2024-05", total // 8],
+            "most_active_day": ["2024-05-04", busiest_day],
+            "most_active_hour": ["2024-05-04 09 PM", total // 200],
+        },
+        "Word Usage Statistics": {
+            "total_meaningful_words": meaningful_words,
+            "unique_words_used": unique_words,
+            "average_words_per_message": words_per_message,
+        },
+        "Emoji Usage (in text and reactions)": {
+            "total_emoji_used": rng.randint(0, total),
+            "messages_with_at_least_one_emoji": with_emoji,
+            "total_emoji_used_in_reactions": rng.randint(0, total),
+            "unique_emoji_used_in_reactions": rng.randint(0, 50),
+            "messages_with_at_least_one_emoji_reacted": rng.randint(0, total // 2),
+        },
+        "Most Used Emoji": {"emoji": "😂", "count": emoji_count, "imageUrl": ""},
+        "Dryness Score": dryness,
+        "Funny Dryness Label": "Load test",
+        "Humor Score": humor,
+        "Funny Humor Label": "Load test",
+        "Romance Score": round(rng.uniform(1, 10), 2),
+        "Funny Romance Label": "Load test",
+        "Features": {
+            "total_messages": total,
+            "average_messages_per_day": per_day,
+            "longest_active_conversation_seconds": int(longest_conversation.total_seconds()),
+            "longest_period_without_messages_seconds": int(longest_gap.total_seconds()),
+            "dryness_score": dryness,
+            "humor_score": humor,
+            "messages_with_emoji": with_emoji,
+            "most_used_emoji_count": emoji_count,
+            "average_words_per_message": words_per_message,
+            "total_meaningful_words": meaningful_words,
+            "unique_words_used": unique_words,
+            "most_active_day_messages": busiest_day,
+        },
+    }
+
+
+def _synthetic_user(rng, name, conversation_id):
+    words = rng.sample(WORDS, 10)
+    return {
+        "username": name,
+        "favorite_topic": words[0],
+        "keywords": json.dumps([{"keyword": w, "score": 10.0} for w in words]),
+        "stats": json.dumps(_synthetic_stats(rng)),
+        "embedding": json.dumps([[round(rng.gauss(0, 1), 6) for _ in range(EMBEDDING_SIZE)]]),
+        "three_d_embedding": json.dumps([rng.uniform(-5, 5) for _ in range(3)]),
+        "last_conversation": conversation_id,
+    }
+
+
+def seed_database(path, users, local_users, conversations=10, seed=0):
+    """Fills a fresh database with synthetic users spread over several uploads."""
+    from orm import db, create_tables, ConversationHistory, GlobalConversationHistory
+
+    if os.path.exists(path):
+        os.remove(path)
+    db.init(path)
+    create_tables()
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    conversation_ids = [(start + timedelta(days=i)).isoformat() for i in range(conversations)]
+
+    rows = []
+    for i in range(users):
+        # The last local_users users belong to the latest upload.
+        latest = i >= users - local_users
+        conversation_id = conversation_ids[-1] if latest else conversation_ids[i % (conversations - 1 or 1)]
+        rows.append(_synthetic_user(rng, f"loadtest_user_{i}", conversation_id))
+
+    with db.connection_context(), db.atomic():
+        for chunk in range(0, len(rows), 100):
+            GlobalConversationHistory.insert_many(rows[chunk:chunk + 100]).execute()
+        local_rows = [
+            {key: value for key, value in row.items() if key != "last_conversation"}
+            for row in rows[users - local_users:]
+        ]
+        for chunk in range(0, len(local_rows), 100):
+            ConversationHistory.insert_many(local_rows[chunk:chunk + 100]).execute()
+    return [row["username"] for row in rows]
+
+
+# --- Running the app ---
+def start_server(kind, port, env):
+    if kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads"]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+
+
+def wait_until_ready(url, process, timeout):
+    # Startup loads the embedding models, which can take a while.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if httpx.get(url + "/api/getmainuser", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {url} was not ready after {timeout} seconds")
+
+
+# --- Load generation ---
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r} (expected one of {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _request_kwargs(name, rng):
+    if name == "commentary":
+        return {"json": {
+            "name": "Total Emojis Used",
+            "metric": rng.randint(0, 5000),
+            "description": "The total number of emojis used across all messages.",
+        }}
+    if name == "history":
+        return {"params": {"embedding": "0"}}
+    return {}
+
+
+async def run_load(url, mix, concurrency, duration, warmup, seed=0):
+    """Runs closed-loop clients and returns {endpoint: {"latencies": [...], "errors": n}}."""
+    results = defaultdict(lambda: {"latencies": [], "errors": 0})
+    names, weights = list(mix), list(mix.values())
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        async def worker(worker_id):
+            rng = random.Random(seed * 1000 + worker_id)
+            while time.monotonic() < stop_at:
+                name = rng.choices(names, weights)[0]
+                method, path = ENDPOINTS[name]
+                begin = time.monotonic()
+                try:
+                    response = await client.request(method, path, **_request_kwargs(name, rng))
+                    await response.aread()
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                end = time.monotonic()
+                if begin < measure_from:
+                    continue
+                if ok:
+                    results[name]["latencies"].append(end - begin)
+                else:
+                    results[name]["errors"] += 1
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return dict(results), time.monotonic() - measure_from
+
+
+def summarize(results, elapsed):
+    report = {}
+    for name, result in sorted(results.items()):
+        latencies = np.array(result["latencies"]) * 1000
+        entry = {
+            "requests": len(latencies),
+            "errors": result["errors"],
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+        }
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            entry.update({
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+                "max_ms": round(float(latencies.max()), 2),
+            })
+        report[name] = entry
+    return report
+
+
+def print_report(report, elapsed):
+    print(f"\n{'endpoint':<14}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, entry in report.items():
+        print(
+            f"{name:<14}{entry['requests']:>10}{entry['errors']:>8}{entry['throughput_rps']:>10}"
+            f"{entry.get('p50_ms', '-'):>10}{entry.get('p95_ms', '-'):>10}"
+            f"{entry.get('p99_ms', '-'):>10}{entry.get('max_ms', '-'):>10}"
+        )
+    total = sum(entry["requests"] for entry in report.values())
+    print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the backend endpoints with a mocked LLM.")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic users in the global history")
+    parser.add_argument("--local-users", type=int, default=50, help="users in the latest upload (local graph)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds before measuring starts")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight pairs, e.g. history=4,commentary=1")
+    parser.add_argument("--server", choices=["asgi", "flask"], default="asgi")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--llm-delay", type=float, default=0.5, help="seconds the mock LLM takes per request")
+    parser.add_argument("--url", help="test an already running server instead of starting one")
+    parser.add_argument("--no-seed", action="store_true", help="with --url: don't touch the database")
+    parser.add_argument("--database", help="scratch database path (default: a temporary file)")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    local_users = min(args.local_users, args.users)
+    process = None
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "loadtest.db")
+
+    if not (args.url and args.no_seed):
+        print(f"Seeding {args.users} users into {database}")
+        usernames = seed_database(database, args.users, local_users)
+    else:
+        usernames = []
+
+    url = args.url
+    if url is None:
+        mock = start_mock_server(delay=args.llm_delay)
+        env = dict(
+            os.environ,
+            DATABASE_PATH=database,
+            OPENAI_BASE_URL=f"http://127.0.0.1:{mock.port}/v1",
+            OPENAI_API_KEY="load-test",
+        )
+        process = start_server(args.server, args.port, env)
+        url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        print(f"Waiting for {url}")
+        wait_until_ready(url, process, args.startup_timeout)
+        if usernames:
+            httpx.post(url + "/processUsername", json={"username": usernames[-1]}, timeout=10)
+        print(f"Running {args.concurrency} clients for {args.duration}s with mix {mix}")
+        results, elapsed = asyncio.run(run_load(url, mix, args.concurrency, args.duration, args.warmup))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = summarize(results, elapsed)
+    print_report(report, elapsed)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "config": {key: value for key, value in vars(args).items() if key != "json"},
+                "elapsed_seconds": round(elapsed, 2),
+                "endpoints": report,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
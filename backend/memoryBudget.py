@@ -0,0 +1,271 @@
+"""
+Memory accounting and a per-job memory budget for ingestion.
+
+Every upload (and every processExports run) gets a MemoryBudget. The pipeline
+wraps its stages in budget.stage(name), which records the process RSS before
+and after the stage, the process high-water mark and, with
+MEMORY_TRACEMALLOC=1, the peak of the Python allocations traced during the
+stage. The job's memory is the RSS it added to the process since it started
+(the loaded models are not part of it).
+
+When INGEST_MEMORY_BUDGET_MB is set, the stages that grow with the input check
+the remaining headroom and degrade instead of running the process out of memory:
+
+  decode    exports are decoded one at a time instead of in parallel when the
+            parallel copies wouldn't fit; an export that doesn't fit at all
+            is rejected with MemoryBudgetExceeded before it is parsed.
+  stats     per-user stats run in this process instead of forked workers
+            (whose copy-on-write pages are duplicated as refcounts change).
+            With any budget, topics are modeled in this process too rather
+            than in topic workers (processExports --workers), which the
+            budget couldn't see.
+  topics    a user's messages are sampled (time-stratified, like
+            TOPIC_MESSAGE_CAP) down to what fits before the topic pipeline
+            tokenizes them; embeddings are written in
+            small batches into a buffer that is memory-mapped in a temp file
+            when it doesn't fit in RAM, KMeans works on it in place and the
+            silhouette scores are computed in chunks that fit.
+
+Degraded topic results are not memoized in the topic cache. The budget is
+best effort: per-user stats can't be sampled, so a job can still go over it.
+RSS is measured for the whole process, so concurrent requests show up in a
+job's numbers.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+load_dotenv()
+
+# Memory one upload may add to the process, in MB (0 = no limit, stages are still measured).
+INGEST_MEMORY_BUDGET_MB = int(os.getenv("INGEST_MEMORY_BUDGET_MB", "0"))
+# Also measure Python allocations per stage with tracemalloc ("1" to enable; slows ingestion down).
+MEMORY_TRACEMALLOC = os.getenv("MEMORY_TRACEMALLOC", "0").lower() in ("1", "true", "yes")
+# Where embeddings that don't fit the budget are memory-mapped (default: the system temp directory).
+MEMORY_SPILL_DIR = os.getenv("MEMORY_SPILL_DIR") or None
+
+MB = 1024 * 1024
+JSON_EXPANSION = 8  # RSS added by json.load per byte of export: 4-5x on the sample exports, ~10x for short messages
+TOPIC_BYTES_PER_MESSAGE = 8 * 1024  # text, tokens, embedding and clustering copies per message in the topic stage
+MIN_SAMPLED_MESSAGES = 100  # sampling never goes below this many messages per user
+LOW_MEMORY_FRACTION = 0.25  # under this share of the budget left, batches shrink and KMeans stops copying
+WORKING_MEMORY_FRACTION = 0.25  # share of the headroom sklearn may use for one chunk of pairwise distances
+MIN_WORKING_MEMORY_MB = 16
+EMBED_BATCH_SIZE = 32
+LOW_MEMORY_EMBED_BATCH_SIZE = 8
+EMBED_CHUNK_BATCHES = 32  # batches encoded per call before they are copied into the buffer
+
+
+class MemoryBudgetExceeded(MemoryError):
+    pass
+
+
+def peak_rss_bytes():
+    """High-water mark of the process RSS."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KB on Linux
+
+
+def reset_peak_rss():
+    """Resets the high-water mark to the current RSS (Linux only); returns whether it could."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def rss_bytes():
+    """Current RSS of the process."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()  # no /proc (macOS): the high-water mark is the closest estimate
+
+
+class MemoryBudget:
+    def __init__(self, budget_mb=INGEST_MEMORY_BUDGET_MB, trace=MEMORY_TRACEMALLOC, spill_dir=MEMORY_SPILL_DIR):
+        self.limit = budget_mb * MB if budget_mb > 0 else None
+        self.trace = trace
+        self.spill_dir = spill_dir
+        self.baseline = rss_bytes()
+        self.stages = {}
+        self.degradations = Counter()
+        self._spill = None  # temporary directory, created on the first spill
+        self._spilled = 0
+        self._started_tracing = False
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    # --- Accounting ---
+    def used(self):
+        """Bytes the job added to the process RSS."""
+        return max(0, rss_bytes() - self.baseline)
+
+    def headroom(self):
+        """Bytes left in the budget, or None without a budget."""
+        if self.limit is None:
+            return None
+        return self.limit - self.used()
+
+    @property
+    def low(self):
+        headroom = self.headroom()
+        return headroom is not None and headroom < self.limit * LOW_MEMORY_FRACTION
+
+    @contextmanager
+    def stage(self, name):
+        """Measures a pipeline stage; stages that run several times (e.g. per user) are aggregated."""
+        before = rss_bytes()
+        started = time.perf_counter()
+        if self.trace:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            after = rss_bytes()
+            entry = self.stages.setdefault(name, {
+                "calls": 0,
+                "seconds": 0.0,
+                "rss_growth_mb": 0.0,
+                "max_rss_mb": 0.0,
+                "peak_rss_mb": 0.0,
+                "traced_peak_mb": None,
+            })
+            entry["calls"] += 1
+            entry["seconds"] += time.perf_counter() - started
+            entry["rss_growth_mb"] += (after - before) / MB
+            entry["max_rss_mb"] = max(entry["max_rss_mb"], after / MB)
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"], peak_rss_bytes() / MB)
+            if self.trace:
+                traced_peak = (tracemalloc.get_traced_memory()[1] - traced_before) / MB
+                entry["traced_peak_mb"] = max(entry["traced_peak_mb"] or 0.0, traced_peak)
+
+    def degrade(self, action, detail=""):
+        self.degradations[action] += 1
+        print(f"Memory budget: {action}{' (' + detail + ')' if detail else ''}, {self.used() / MB:.0f} MB used")
+
+    def report(self):
+        rounded = lambda value: round(value, 2) if isinstance(value, float) else value
+        return {
+            "budget_mb": self.limit / MB if self.limit is not None else None,
+            "baseline_rss_mb": round(self.baseline / MB, 1),
+            "used_mb": round(self.used() / MB, 1),
+            "peak_rss_mb": round(peak_rss_bytes() / MB, 1),
+            "spilled_mb": round(self._spilled / MB, 1),
+            "stages": {name: {key: rounded(value) for key, value in entry.items()} for name, entry in self.stages.items()},
+            "degradations": dict(self.degradations),
+        }
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.cleanup()
+            self._spill = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    # --- Degradation ---
+    def decode_workers(self, sizes, workers):
+        """
+        Processes to decode exports of the given sizes (bytes) with. Raises
+        MemoryBudgetExceeded when the decoded exports can't fit at all.
+        """
+        headroom = self.headroom()
+        if headroom is None:
+            return workers
+        needed = sum(sizes) * JSON_EXPANSION
+        if needed > headroom:
+            raise MemoryBudgetExceeded(
+                f"Decoding {sum(sizes) / MB:.0f} MB of exports needs about {needed / MB:.0f} MB, "
+                f"but only {max(0, headroom) / MB:.0f} MB of the {self.limit / MB:.0f} MB upload budget is left"
+            )
+        if workers > 1 and len(sizes) > 1 and needed * 2 > headroom:
+            # Worker results are pickled back, so every decoded export is briefly held twice.
+            self.degrade("serial_decode")
+            return 1
+        return workers
+
+    def stats_workers(self, workers):
+        if workers > 1 and self.low:
+            self.degrade("serial_stats")
+            return 1
+        return workers
+
+    def topic_workers(self, workers):
+        # RSS is measured for this process only, so the budget applies only to topics modeled here.
+        if workers > 1 and self.limit is not None:
+            self.degrade("serial_topics")
+            return 1
+        return workers
+
+    def message_cap(self, cap, messages):
+        """
+        The topic message cap for a user with `messages` messages: cap (0 = no
+        cap) itself, or lower when their topic stage wouldn't fit the headroom.
+        """
+        headroom = self.headroom()
+        if headroom is None:
+            return cap
+        fits = max(MIN_SAMPLED_MESSAGES, int(headroom // TOPIC_BYTES_PER_MESSAGE))
+        if fits >= min(cap or messages, messages):
+            return cap
+        self.degrade("sampled_topics", f"{fits} of {messages} messages")
+        return fits
+
+    def working_memory_mb(self):
+        """
+        Chunk size for sklearn's pairwise computations (silhouette_score defaults
+        to 1 GB chunks), or None to keep sklearn's default without a budget.
+        """
+        headroom = self.headroom()
+        if headroom is None:
+            return None
+        return max(MIN_WORKING_MEMORY_MB, int(headroom * WORKING_MEMORY_FRACTION / MB))
+
+    def embedding_buffer(self, rows, dim):
+        """
+        A float32 (rows, dim) array for embeddings: in memory, or memory-mapped
+        in a temporary file when it wouldn't leave room for clustering.
+        """
+        nbytes = rows * dim * 4
+        headroom = self.headroom()
+        if headroom is None or nbytes * 2 < headroom:
+            return np.empty((rows, dim), dtype=np.float32)
+        if self._spill is None:
+            self._spill = tempfile.TemporaryDirectory(prefix="ingest-spill-", dir=self.spill_dir)
+        self.degrade("spilled_embeddings", f"{nbytes / MB:.0f} MB")
+        self._spilled += nbytes
+        path = os.path.join(self._spill.name, f"embeddings-{self.degradations['spilled_embeddings']}.npy")
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(rows, dim))
+
+    def embed(self, embedder, texts):
+        """
+        embedder.encode(texts), encoded a chunk at a time straight into an
+        embedding_buffer so the per-batch outputs are never held next to the
+        full matrix. Batches shrink when memory is low.
+        """
+        batch_size = LOW_MEMORY_EMBED_BATCH_SIZE if self.low else EMBED_BATCH_SIZE
+        embeddings = self.embedding_buffer(len(texts), embedder.get_sentence_embedding_dimension())
+        chunk = batch_size * EMBED_CHUNK_BATCHES
+        for start in range(0, len(texts), chunk):
+            embeddings[start:start + chunk] = embedder.encode(texts[start:start + chunk], batch_size=batch_size)
+        return embeddings
@@ -0,0 +1,86 @@
+import os
+import random
+from collections import Counter
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Maximum number of messages per user fed to the topic pipeline (0 = no cap).
+TOPIC_MESSAGE_CAP = int(os.getenv("TOPIC_MESSAGE_CAP", "0"))
+
+
+def _period(timestamp):
+    # ISO timestamps start with "YYYY-MM", which is all we need to bucket by month.
+    return timestamp[:7] if timestamp else None
+
+
+def _allocate(stratum_sizes, cap):
+    """
+    Splits the cap across strata: one slot for every stratum, and the rest in
+    proportion to their remaining size (largest remainder method). When the
+    cap is smaller than the number of strata, the largest strata get one slot
+    each and the others none. The quotas never add up to more than cap.
+    """
+    if cap < len(stratum_sizes):
+        largest = sorted(stratum_sizes, key=lambda stratum: -stratum_sizes[stratum])[:cap]
+        return {stratum: int(stratum in largest) for stratum in stratum_sizes}
+    quotas = {stratum: 1 for stratum in stratum_sizes}
+    left = cap - len(stratum_sizes)
+    spare = sum(stratum_sizes.values()) - len(stratum_sizes)
+    if left <= 0 or spare <= 0:
+        return quotas
+    remainders = []
+    for stratum, size in stratum_sizes.items():
+        exact = left * (size - 1) / spare
+        quotas[stratum] += int(exact)
+        remainders.append((exact - int(exact), stratum))
+    left -= sum(quotas.values()) - len(stratum_sizes)
+    for _, stratum in sorted(remainders, key=lambda item: item[0], reverse=True):
+        if left <= 0:
+            break
+        if quotas[stratum] < stratum_sizes[stratum]:
+            quotas[stratum] += 1
+            left -= 1
+    return quotas
+
+
+def stratified_sample(timestamps, cap, seed=42):
+    """
+    Time-stratified reservoir sampling. Messages are bucketed by month and each
+    month keeps a reservoir proportional to its share of the history, so quiet
+    and busy periods both stay represented. Returns (indices, inclusion_weights):
+    the sorted indices of the kept messages (at most cap) and, for each, how
+    many messages it stands for. Those add up to the number of messages; when
+    the cap is smaller than the number of months, the months left out are
+    counted toward the sampled ones.
+    """
+    n = len(timestamps)
+    if cap <= 0 or n <= cap:
+        return list(range(n)), [1.0] * n
+
+    stratum_sizes = Counter(_period(ts) for ts in timestamps)
+    quotas = _allocate(stratum_sizes, cap)
+
+    # Algorithm R, run independently inside every stratum in a single pass.
+    rng = random.Random(seed)
+    reservoirs = {stratum: [] for stratum in stratum_sizes}
+    seen = Counter()
+    for i, ts in enumerate(timestamps):
+        stratum = _period(ts)
+        seen[stratum] += 1
+        reservoir = reservoirs[stratum]
+        if len(reservoir) < quotas[stratum]:
+            reservoir.append(i)
+        else:
+            j = rng.randrange(seen[stratum])
+            if j < quotas[stratum]:
+                reservoir[j] = i
+
+    kept = sorted(i for reservoir in reservoirs.values() for i in reservoir)
+    # Months without a slot are spread over the sampled ones, so the weights still add up to n.
+    covered = sum(size for stratum, size in stratum_sizes.items() if quotas[stratum])
+    weights = [
+        stratum_sizes[_period(timestamps[i])] / quotas[_period(timestamps[i])] * n / covered for i in kept
+    ]
+    return kept, weights
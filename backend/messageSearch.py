@@ -0,0 +1,165 @@
+import os
+
+from dotenv import load_dotenv
+
+from orm import db, Message, MESSAGE_FTS_TRIGGERS
+
+load_dotenv()
+
+# Store message text in the full-text index during ingestion ("1" to enable).
+MESSAGE_INDEX = os.getenv("MESSAGE_INDEX", "0").lower() in ("1", "true", "yes")
+# Batches at least this large are loaded with the triggers off and indexed in one statement.
+MESSAGE_INDEX_BULK_THRESHOLD = int(os.getenv("MESSAGE_INDEX_BULK_THRESHOLD", "20000"))
+SEARCH_MAX_PAGE_SIZE = 100
+
+_INSERT_BATCH = 150  # rows per INSERT (5 columns each), under SQLite's bound-variable limit
+
+
+def _channel_name(msg):
+    channel = msg.get("channel")
+    return channel.get("name") if isinstance(channel, dict) else channel
+
+
+def _message_rows(messages):
+    for msg in messages:
+        if not isinstance(msg, dict):
+            continue
+        author = msg.get("author", {}).get("name")
+        content = (msg.get("content") or "").strip()
+        if msg.get("id") is None or not author or not content:
+            continue
+        yield {
+            "message_id": str(msg["id"]),
+            "author": author,
+            "channel": _channel_name(msg),
+            "timestamp": msg.get("timestamp"),
+            "content": content,
+        }
+
+
+def _insert(rows):
+    # Messages already indexed (same message id) are skipped.
+    for start in range(0, len(rows), _INSERT_BATCH):
+        Message.insert_many(rows[start:start + _INSERT_BATCH]).on_conflict_ignore().execute()
+
+
+def _max_id():
+    return db.execute_sql("SELECT COALESCE(MAX(id), 0) FROM message").fetchone()[0]
+
+
+def index_messages(messages, bulk=None):
+    """
+    Adds messages with text to the full-text index and returns how many rows were
+    new. Small batches go through the sync triggers one row at a time; in bulk
+    mode (default for MESSAGE_INDEX_BULK_THRESHOLD messages or more) the insert
+    trigger is dropped, the rows are loaded, and the new rowids are added to the
+    index with a single INSERT ... SELECT.
+    """
+    rows = list(_message_rows(messages))
+    if bulk is None:
+        bulk = len(rows) >= MESSAGE_INDEX_BULK_THRESHOLD
+
+    with db.connection_context(), db.atomic():
+        # Rowids are assigned as MAX(id) + 1, so the new rows are exactly those above last_id.
+        last_id = _max_id()
+        if not bulk:
+            _insert(rows)
+        else:
+            db.execute_sql("DROP TRIGGER IF EXISTS message_ai")
+            try:
+                _insert(rows)
+                db.execute_sql(
+                    "INSERT INTO messagefts(rowid, content, author, channel, timestamp) "
+                    "SELECT id, content, author, channel, timestamp FROM message WHERE id > ?",
+                    (last_id,),
+                )
+            finally:
+                db.execute_sql(MESSAGE_FTS_TRIGGERS["message_ai"])
+        return _max_id() - last_id
+
+
+def rebuild_index():
+    """Rebuilds the whole index from the message table (e.g. after a manual import)."""
+    with db.connection_context():
+        db.execute_sql("INSERT INTO messagefts(messagefts) VALUES ('rebuild')")
+        db.execute_sql("INSERT INTO messagefts(messagefts) VALUES ('optimize')")
+
+
+def fts_query(text):
+    """
+    Turns user input into an FTS5 query: every word must appear, words are
+    matched literally (quotes and operators have no special meaning) and a
+    trailing * keeps prefix matching, e.g. "pizz*".
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _filters(author, channel):
+    clauses, params = [], []
+    if author:
+        clauses.append("m.author = ?")
+        params.append(author)
+    if channel:
+        clauses.append("m.channel = ?")
+        params.append(channel)
+    return "".join(" AND " + clause for clause in clauses), params
+
+
+def search_messages(text, author=None, channel=None, order="rank", limit=20, offset=0):
+    """
+    Returns (hits, next_offset). Hits are ranked by BM25, or sorted by time
+    with order="oldest"/"newest" (e.g. "when did I first say X").
+    """
+    query = fts_query(text)
+    if not query:
+        return [], None
+    where, params = _filters(author, channel)
+    order_by = {
+        "rank": "messagefts.rank",
+        "oldest": "m.timestamp ASC",
+        "newest": "m.timestamp DESC",
+    }[order]
+    cursor = db.execute_sql(
+        "SELECT m.message_id, m.author, m.channel, m.timestamp, "
+        "snippet(messagefts, 0, '[', ']', '…', 16), messagefts.rank "
+        "FROM messagefts JOIN message m ON m.id = messagefts.rowid "
+        f"WHERE messagefts MATCH ?{where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+        [query, *params, limit + 1, offset],
+    )
+    rows = cursor.fetchall()
+    hits = [
+        {
+            "message_id": message_id,
+            "author": author_name,
+            "channel": channel_name,
+            "timestamp": timestamp,
+            "snippet": snippet,
+            "score": round(-rank, 4),  # bm25 is lower-is-better
+        }
+        for message_id, author_name, channel_name, timestamp, snippet, rank in rows[:limit]
+    ]
+    return hits, (offset + limit if len(rows) > limit else None)
+
+
+def top_authors(text, channel=None, limit=20):
+    """Who talks about something: authors ordered by their number of matching messages."""
+    query = fts_query(text)
+    if not query:
+        return []
+    where, params = _filters(None, channel)
+    cursor = db.execute_sql(
+        "SELECT m.author, COUNT(*) AS hits, MIN(m.timestamp) "
+        "FROM messagefts JOIN message m ON m.id = messagefts.rowid "
+        f"WHERE messagefts MATCH ?{where} GROUP BY m.author ORDER BY hits DESC LIMIT ?",
+        [query, *params, limit],
+    )
+    return [
+        {"author": author, "messages": hits, "first_timestamp": first}
+        for author, hits, first in cursor.fetchall()
+    ]
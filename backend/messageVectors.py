@@ -0,0 +1,342 @@
+"""
+Persisted message embeddings for semantic search.
+
+find_favorite_topic() embeds every message it clusters; with MESSAGE_VECTORS
+enabled those vectors are appended to a store instead of being thrown away:
+
+  vectors.f32   (n, dim) float32 rows, L2-normalized, memory-mapped for search
+  meta.bin      one (message_id, author, time) record per row, also memory-mapped
+  authors.json  author names, indexed by meta.bin's author column
+  ivf.npz       optional inverted-file index: k-means centroids plus the rows of
+                each partition, built once the store has MESSAGE_VECTOR_IVF_THRESHOLD rows
+
+Small stores (and selective author/date filters) are searched exactly with one
+matrix-vector product. Large stores only score the rows in the nprobe
+partitions closest to the query, plus the rows appended since the index was
+built.
+"""
+import json
+import math
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Keep message embeddings computed during topic modeling for /api/search/semantic ("1" to enable).
+MESSAGE_VECTORS = os.getenv("MESSAGE_VECTORS", "0").lower() in ("1", "true", "yes")
+MESSAGE_VECTOR_DIR = os.getenv(
+    "MESSAGE_VECTOR_DIR", os.path.join(os.path.dirname(__file__), "message_vectors")
+)
+# Stores with at least this many vectors get an approximate (IVF) index.
+MESSAGE_VECTOR_IVF_THRESHOLD = int(os.getenv("MESSAGE_VECTOR_IVF_THRESHOLD", "100000"))
+# Number of IVF partitions scanned per query; more is slower but closer to exact.
+MESSAGE_VECTOR_NPROBE = int(os.getenv("MESSAGE_VECTOR_NPROBE", "8"))
+
+META_DTYPE = np.dtype([("message_id", "<i8"), ("author", "<i4"), ("time", "<i8")])
+NO_TIME = np.iinfo(np.int64).min  # messages without a usable timestamp
+
+# Filtered searches with at most this many matching rows are always exact.
+_EXACT_LIMIT = 20000
+# Rows scored per matrix-vector product in a full scan.
+_SCAN_CHUNK = 65536
+# The index is rebuilt once this fraction of the rows was appended after it.
+_IVF_STALE_FRACTION = 0.2
+
+_write_lock = threading.Lock()
+
+
+def _epoch(timestamp):
+    try:
+        moment = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return NO_TIME
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def _isoformat(seconds):
+    if seconds == NO_TIME:
+        return None
+    return datetime.fromtimestamp(int(seconds), timezone.utc).isoformat()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _save_json(path, value):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
+
+
+class _Paths:
+    def __init__(self, directory):
+        self.directory = directory
+        self.vectors = os.path.join(directory, "vectors.f32")
+        self.meta = os.path.join(directory, "meta.bin")
+        self.authors = os.path.join(directory, "authors.json")
+        self.store = os.path.join(directory, "store.json")
+        self.ivf = os.path.join(directory, "ivf.npz")
+
+    def load_json(self, path, default):
+        if not os.path.exists(path):
+            return default
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def rows(self, dim):
+        """Rows present in both files; a crash between the two appends leaves a partial tail."""
+        if not dim or not os.path.exists(self.meta) or not os.path.exists(self.vectors):
+            return 0
+        return min(
+            os.path.getsize(self.meta) // META_DTYPE.itemsize,
+            os.path.getsize(self.vectors) // (4 * dim),
+        )
+
+
+class MessageVectorWriter:
+    """
+    Appends one user's vectors at a time during ingestion. Messages that are
+    already stored (same message id) are skipped, so re-uploading an export
+    doesn't duplicate them.
+    """
+
+    def __init__(self, directory=MESSAGE_VECTOR_DIR):
+        self.paths = _Paths(directory)
+        os.makedirs(directory, exist_ok=True)
+        with _write_lock:
+            self.dim = self.paths.load_json(self.paths.store, {}).get("dim")
+            self.authors = self.paths.load_json(self.paths.authors, [])
+            self.author_index = {name: i for i, name in enumerate(self.authors)}
+            rows = self.paths.rows(self.dim)
+            # Drop a partial tail so new rows line up in both files.
+            for path, row_size in ((self.paths.vectors, 4 * (self.dim or 0)), (self.paths.meta, META_DTYPE.itemsize)):
+                if os.path.exists(path) and os.path.getsize(path) != rows * row_size:
+                    with open(path, "r+b") as f:
+                        f.truncate(rows * row_size)
+            if rows:
+                stored = np.fromfile(self.paths.meta, dtype=META_DTYPE, count=rows)["message_id"]
+                self.known = np.sort(stored)
+            else:
+                self.known = np.empty(0, dtype=np.int64)
+        self.added = set()
+
+    def _is_known(self, message_ids):
+        positions = np.searchsorted(self.known, message_ids)
+        positions = np.minimum(positions, max(len(self.known) - 1, 0))
+        found = self.known[positions] == message_ids if len(self.known) else np.zeros(len(message_ids), dtype=bool)
+        return found | np.fromiter((m in self.added for m in message_ids.tolist()), dtype=bool, count=len(message_ids))
+
+    def add(self, author, message_ids, timestamps, embeddings):
+        """Stores an author's message vectors (the vector sink of find_favorite_topic). Returns the rows added."""
+        rows, ids = [], []
+        for i, message_id in enumerate(message_ids):
+            try:
+                ids.append(int(message_id))
+            except (TypeError, ValueError):
+                continue  # Discord ids are numeric; anything else can't go in the id column
+            rows.append(i)
+        if not rows:
+            return 0
+        ids = np.array(ids, dtype=np.int64)
+        _, first = np.unique(ids, return_index=True)
+        keep = np.zeros(len(ids), dtype=bool)
+        keep[first] = True
+        keep &= ~self._is_known(ids)
+        if not keep.any():
+            return 0
+
+        selected = np.array(rows)[keep]
+        vectors = _normalize(np.asarray(embeddings)[selected])
+        records = np.empty(len(selected), dtype=META_DTYPE)
+        records["message_id"] = ids[keep]
+        records["time"] = [_epoch(timestamps[i]) for i in selected]
+
+        with _write_lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                _save_json(self.paths.store, {"dim": self.dim})
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Message vectors have {vectors.shape[1]} dimensions, the store has {self.dim}")
+            if author not in self.author_index:
+                self.author_index[author] = len(self.authors)
+                self.authors.append(author)
+                _save_json(self.paths.authors, self.authors)
+            records["author"] = self.author_index[author]
+            # Vectors first: a row only counts once its meta record exists too.
+            with open(self.paths.vectors, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.paths.meta, "ab") as f:
+                f.write(records.tobytes())
+        self.added.update(records["message_id"].tolist())
+        return len(selected)
+
+    def finish(self):
+        """(Re)builds the IVF index when the store is large enough and the index is missing or stale."""
+        store = MessageVectorStore.open(self.paths.directory)
+        if store is None or len(store) < MESSAGE_VECTOR_IVF_THRESHOLD:
+            return
+        if store.ivf is None or len(store) - store.ivf["rows"] > _IVF_STALE_FRACTION * len(store):
+            store.build_ivf()
+
+
+class MessageVectorStore:
+    """Read-only, memory-mapped view of the stored vectors."""
+
+    def __init__(self, paths, dim, rows, authors, ivf):
+        self.paths = paths
+        self.vectors = np.memmap(paths.vectors, dtype=np.float32, mode="r", shape=(rows, dim))
+        self.meta = np.memmap(paths.meta, dtype=META_DTYPE, mode="r", shape=(rows,))
+        self.authors = authors
+        self.author_index = {name: i for i, name in enumerate(authors)}
+        self.ivf = ivf
+
+    def __len__(self):
+        return len(self.meta)
+
+    @classmethod
+    def open(cls, directory=MESSAGE_VECTOR_DIR):
+        paths = _Paths(directory)
+        dim = paths.load_json(paths.store, {}).get("dim")
+        rows = paths.rows(dim)
+        if not rows:
+            return None
+        ivf = None
+        if os.path.exists(paths.ivf):
+            with np.load(paths.ivf) as stored:
+                ivf = {name: stored[name] for name in stored.files}
+            ivf["rows"] = int(ivf["rows"])
+            if ivf["rows"] > rows:
+                ivf = None  # built for a store that was since replaced
+        return cls(paths, dim, rows, paths.load_json(paths.authors, []), ivf)
+
+    # --- Approximate index ---
+    def build_ivf(self, nlist=None, seed=42):
+        """
+        Partitions the vectors with k-means (trained on a sample) and stores, for
+        every partition, the rows assigned to their nearest centroid.
+        """
+        from sklearn.cluster import MiniBatchKMeans
+
+        rows = len(self)
+        nlist = nlist or max(1, int(math.sqrt(rows)))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(rows, size=min(rows, 32 * nlist), replace=False))
+        kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=seed, n_init=1, batch_size=4096)
+        kmeans.fit(self.vectors[sample])
+        centroids = _normalize(kmeans.cluster_centers_)
+
+        assignments = np.empty(rows, dtype=np.int32)
+        for start in range(0, rows, _SCAN_CHUNK):
+            chunk = self.vectors[start:start + _SCAN_CHUNK]
+            assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable").astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))]).astype(np.int64)
+
+        tmp = os.path.join(self.paths.directory, ".ivf.tmp.npz")
+        np.savez(tmp, centroids=centroids, order=order, offsets=offsets, rows=np.int64(rows))
+        os.replace(tmp, self.paths.ivf)
+        self.ivf = {"centroids": centroids, "order": order, "offsets": offsets, "rows": rows}
+
+    def _ivf_candidates(self, query, nprobe):
+        centroids, order, offsets = self.ivf["centroids"], self.ivf["order"], self.ivf["offsets"]
+        nprobe = min(nprobe, len(centroids))
+        closest = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        parts = [order[offsets[c]:offsets[c + 1]] for c in closest]
+        parts.append(np.arange(self.ivf["rows"], len(self), dtype=np.int64))  # not indexed yet
+        return np.concatenate(parts)
+
+    # --- Search ---
+    def _filter(self, author, start, end):
+        """Boolean row mask for the filters, None when there are none."""
+        if author is None and start is None and end is None:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        if author is not None:
+            mask &= self.meta["author"] == self.author_index.get(author, -1)
+        if start is not None or end is not None:
+            times = self.meta["time"]
+            mask &= times != NO_TIME
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times < end
+        return mask
+
+    def _scan(self, query):
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), _SCAN_CHUNK):
+            chunk = self.vectors[start:start + _SCAN_CHUNK]
+            scores[start:start + len(chunk)] = chunk @ query
+        return scores
+
+    def search(self, query, k=10, author=None, start=None, end=None, exact=False, nprobe=MESSAGE_VECTOR_NPROBE):
+        """
+        Top-k rows by cosine similarity to the query vector. start/end are epoch
+        seconds (end exclusive). Returns (hits, method) where method is "exact"
+        or "ivf".
+        """
+        query = _normalize(query).ravel()
+        mask = self._filter(author, start, end)
+        candidates = None if mask is None else np.flatnonzero(mask)
+
+        method = "exact"
+        if not exact and self.ivf is not None and (candidates is None or len(candidates) > _EXACT_LIMIT):
+            rows = self._ivf_candidates(query, nprobe)
+            if mask is not None:
+                rows = rows[mask[rows]]
+            if len(rows) >= k:
+                candidates, method = rows, "ivf"
+
+        if candidates is None:
+            rows, scores = None, self._scan(query)
+        else:
+            rows = np.sort(candidates)  # sequential reads from the memory map
+            scores = self.vectors[rows] @ query
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        hits = []
+        for i in top:
+            row = int(i) if rows is None else int(rows[i])
+            record = self.meta[row]
+            hits.append({
+                "message_id": str(int(record["message_id"])),
+                "author": self.authors[int(record["author"])],
+                "timestamp": _isoformat(record["time"]),
+                "score": round(float(scores[i]), 4),
+            })
+        return hits, method
+
+
+_opened = {"store": None, "key": None}
+_open_lock = threading.Lock()
+
+
+def latest_store(directory=MESSAGE_VECTOR_DIR):
+    """Returns the memory-mapped store, reopening it only after it grew or was re-indexed."""
+    paths = _Paths(directory)
+    if not os.path.exists(paths.meta):
+        return None
+    key = (
+        os.path.getsize(paths.meta),
+        os.stat(paths.ivf).st_mtime_ns if os.path.exists(paths.ivf) else None,
+        os.stat(paths.authors).st_mtime_ns if os.path.exists(paths.authors) else None,
+    )
+    with _open_lock:
+        if _opened["key"] != key:
+            _opened["store"] = MessageVectorStore.open(directory)
+            _opened["key"] = key
+        return _opened["store"]
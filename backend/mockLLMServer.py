@@ -0,0 +1,119 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load tests and offline runs.
+
+    python mockLLMServer.py --port 8001 --delay 1.5
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=test uvicorn asgi:app --port 5000
+
+Every POST to /v1/chat/completions waits --delay seconds (to mimic model latency)
+and answers with a canned one-sentence reply. --failure-rate makes a fraction of
+requests fail with 503 so the client's retries can be exercised. The server runs
+on asyncio, so hundreds of slow requests can be in flight at once.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+
+REPLY = "Topic 🎉 You're basically a legend at this stat!"
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+def _completion(model):
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": REPLY},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+class MockLLMServer:
+    def __init__(self, delay=0.0, failure_rate=0.0):
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.requests = 0
+
+    async def _respond(self, path, body):
+        if not path.rstrip("/").endswith("/chat/completions"):
+            return 404, {"error": {"message": "Not found"}}
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            return 400, {"error": {"message": "Invalid JSON"}}
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        if random.random() < self.failure_rate:
+            return 503, {"error": {"message": "Mock overload", "type": "server_error"}}
+        return 200, _completion(request.get("model", "gpt-4o"))
+
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive, like the real API.
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self._respond(path, body)
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port, started=None):
+        server = await asyncio.start_server(self.handle, "127.0.0.1", port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        if started is not None:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+
+def start_mock_server(port=0, delay=0.0, failure_rate=0.0):
+    """Starts the mock server on a background thread and returns it (server.port has the port)."""
+    server = MockLLMServer(delay, failure_rate)
+    started = threading.Event()
+    threading.Thread(target=lambda: asyncio.run(server.serve(port, started)), daemon=True).start()
+    started.wait()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=1.0, help="seconds to wait before answering")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    mock = MockLLMServer(args.delay, args.failure_rate)
+    print(f"Mock LLM listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        asyncio.run(mock.serve(args.port))
+    except KeyboardInterrupt:
+        pass
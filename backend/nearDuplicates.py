@@ -0,0 +1,111 @@
+import os
+import re
+import zlib
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Estimated Jaccard similarity (over character shingles) above which two messages
+# are treated as the same message. Set to 0 to turn the filter off.
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+NUM_PERMUTATIONS = 64
+SHINGLE_SIZE = 3
+
+# Hash family h(x) = (a * x + b) mod p with p just above 2^32, so a * x fits in 64 bits.
+_PRIME = np.uint64(4294967311)
+_rng = np.random.RandomState(42)
+_A = _rng.randint(1, 1 << 32, size=NUM_PERMUTATIONS).astype(np.uint64)
+_B = _rng.randint(0, 1 << 32, size=NUM_PERMUTATIONS).astype(np.uint64)
+
+
+def _shingle_hashes(text):
+    normalized = " ".join(re.findall(r"\w+", text.lower())) or text.strip().lower()
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signatures(texts):
+    """Returns an (n_texts x NUM_PERMUTATIONS) matrix of MinHash signatures."""
+    signatures = np.empty((len(texts), NUM_PERMUTATIONS), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        hashes = _shingle_hashes(text)
+        signatures[i] = ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0)
+    return signatures
+
+
+def lsh_bands(threshold, num_permutations=NUM_PERMUTATIONS):
+    """
+    Picks (bands, rows) so that the LSH S-curve, whose midpoint is roughly
+    (1 / bands) ** (1 / rows), sits just below the threshold. Candidates are
+    verified against the threshold afterwards, so erring low only costs time.
+    """
+    best = (1, num_permutations)
+    best_midpoint = -1.0
+    for bands in range(1, num_permutations + 1):
+        rows = num_permutations // bands
+        midpoint = (1 / bands) ** (1 / rows)
+        if best_midpoint < midpoint <= threshold:
+            best, best_midpoint = (bands, rows), midpoint
+    return best
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def suppress_near_duplicates(texts, threshold=None):
+    """
+    Collapses near-duplicate texts (copypasta, bot spam, repeated "lol") into one
+    representative each. Returns (kept_indices, weights, report) where weights[i]
+    is the number of input texts represented by texts[kept_indices[i]].
+    """
+    if threshold is None:
+        threshold = NEAR_DUPLICATE_THRESHOLD
+    n = len(texts)
+    if threshold <= 0 or n < 2:
+        kept = list(range(n))
+        weights = np.ones(n)
+    else:
+        signatures = minhash_signatures(texts)
+        bands, rows = lsh_bands(threshold)
+        parent = list(range(n))
+        for band in range(bands):
+            buckets = {}
+            band_signatures = signatures[:, band * rows:(band + 1) * rows]
+            for i in range(n):
+                key = band_signatures[i].tobytes()
+                first = buckets.setdefault(key, i)
+                if first == i:
+                    continue
+                root_i, root_first = _find(parent, i), _find(parent, first)
+                if root_i == root_first:
+                    continue
+                similarity = np.mean(signatures[i] == signatures[first])
+                if similarity >= threshold:
+                    # Keep the earliest message as the representative of the cluster.
+                    parent[max(root_i, root_first)] = min(root_i, root_first)
+
+        counts = {}
+        for i in range(n):
+            root = _find(parent, i)
+            counts[root] = counts.get(root, 0) + 1
+        kept = sorted(counts)
+        weights = np.array([counts[i] for i in kept], dtype=float)
+
+    report = {
+        "input_messages": n,
+        "kept_messages": len(kept),
+        "removed_messages": n - len(kept),
+        "removed_fraction": round((n - len(kept)) / n, 4) if n else 0.0,
+        "threshold": threshold,
+    }
+    return kept, weights, report
@@ -1,18 +1,275 @@
-from peewee import Model, TextField, SqliteDatabase
+import os
 
-db = SqliteDatabase("conversationhistory.db")
+from dotenv import load_dotenv
+from peewee import Model, AutoField, TextField, SqliteDatabase, DateTimeField, DateField, IntegerField, FloatField, BlobField
+from playhouse.migrate import SqliteMigrator, migrate
 
+load_dotenv()
 
-class ConversationHistory(Model):
+# connect to db (DATABASE_PATH lets load tests run against a scratch database)
+db = SqliteDatabase(os.getenv("DATABASE_PATH", "conversationhistory.db"))
+
+
+# How a user's record was computed: "preview" records from a progressive upload
+# have exact stats but a topic estimated from a sample, until they are refined.
+FIDELITY_PREVIEW = "preview"
+FIDELITY_EXACT = "exact"
+
+
+# base model for Peewee models
+class BaseModel(Model):
+    class Meta:
+        database = db
+
+
+# local conversation history: cleared on every file upload
+class ConversationHistory(BaseModel):
     username = TextField(primary_key=True)
     favorite_topic = TextField()  # e.g., the topic label
     keywords = TextField()  # stored as a JSON string
     stats = TextField()  # stored as a JSON string of all stats
     embedding = TextField()  # stored as a JSON string of the embedding
-    three_d_embedding = TextField(
-        null=True, default=""
-    )  # new column initialized to nothing
+    three_d_embedding = TextField(null=True, default="")  # new column for 3D embedding
+    fidelity = TextField(null=True, default=FIDELITY_EXACT)
 
     class Meta:
-        database = db
         table_name = "conversationhistory"
+
+
+# global conversation history to accumulates or updates records over time
+class GlobalConversationHistory(BaseModel):
+    username = TextField(primary_key=True)
+    favorite_topic = TextField()
+    keywords = TextField()
+    stats = TextField()
+    embedding = TextField()
+    three_d_embedding = TextField(null=True, default="")
+    last_conversation = TextField(
+        null=True, default=""
+    )
+    fidelity = TextField(null=True, default=FIDELITY_EXACT)
+    # changed by HISTORY_VERSION_TRIGGERS on every write, whichever process makes it
+    version = IntegerField(null=True, default=0)
+
+    class Meta:
+        table_name = "globalconversationhistory"
+
+
+# append-only history: one row per user per upload, with the numeric stats as real columns
+class UserSnapshot(BaseModel):
+    username = TextField()
+    conversation_id = TextField()
+    timestamp = DateTimeField()  # when the upload happened
+    favorite_topic = TextField(null=True)
+    total_messages = IntegerField()
+    average_messages_per_day = FloatField()
+    longest_active_conversation_seconds = IntegerField()
+    longest_period_without_messages_seconds = IntegerField()
+    total_meaningful_words = IntegerField()
+    unique_words_used = IntegerField()
+    average_words_per_message = FloatField()
+    total_emoji_used = IntegerField()
+    messages_with_emoji = IntegerField()
+    total_emoji_used_in_reactions = IntegerField()
+    dryness_score = FloatField(null=True)
+    humor_score = FloatField(null=True)
+    romance_score = FloatField(null=True)
+
+    class Meta:
+        table_name = "usersnapshot"
+        indexes = (
+            (("username", "conversation_id"), True),
+            (("username", "timestamp"), False),
+        )
+
+
+# memoized find_favorite_topic() results, keyed by a fingerprint of the user's messages
+class TopicResult(BaseModel):
+    fingerprint = TextField(primary_key=True)
+    username = TextField()
+    topic = TextField()  # stored as a JSON string of {"keywords", "label"}
+    topic_embedding = BlobField()  # float32 bytes of the topic part of the user embedding
+    last_used = DateTimeField(index=True)  # for least-recently-used eviction
+
+    class Meta:
+        table_name = "topicresult"
+
+
+# per-user, per-day, per-channel sums of the parse_messages() counters, for stats over any date range
+class DailyRollup(BaseModel):
+    username = TextField()
+    day = DateField()
+    channel = TextField(default="")  # "" when the export didn't name its channel
+    total_messages = IntegerField()
+    messages_with_text = IntegerField()
+    messages_with_links = IntegerField()
+    messages_with_images = IntegerField()
+    messages_with_gifs = IntegerField()
+    messages_with_videos = IntegerField()
+    messages_with_stickers = IntegerField()
+    messages_with_audio_files = IntegerField()
+    messages_with_documents = IntegerField()
+    messages_with_other_files = IntegerField()
+    edited_messages = IntegerField()
+    meaningful_words = IntegerField()
+    emoji_used = IntegerField()
+    messages_with_emoji = IntegerField()
+    emoji_used_in_reactions = IntegerField()
+    messages_with_reactions = IntegerField()
+    scored_messages = IntegerField()
+    dryness_sum = FloatField()
+    humor_sum = FloatField()
+    romance_sum = FloatField()
+    hourly = TextField()  # stored as a JSON list of 24 message counts
+
+    class Meta:
+        table_name = "dailyrollup"
+        indexes = (
+            (("username", "day", "channel"), True),
+        )
+
+
+# raw message text kept for full-text search (optional, see messageSearch.py)
+class Message(BaseModel):
+    id = AutoField()  # rowid of the messagefts index
+    message_id = TextField(unique=True)
+    author = TextField(index=True)
+    channel = TextField(null=True)
+    timestamp = TextField(null=True)  # ISO timestamp as exported
+    content = TextField()
+
+    class Meta:
+        table_name = "message"
+
+
+# a user's topics as online k-means centroids, updated with each upload's new messages (see topicDrift.py)
+class TopicCentroid(BaseModel):
+    username = TextField()
+    cluster = IntegerField()
+    centroid = BlobField()  # float32 bytes, unit length
+    messages = FloatField()  # messages assigned so far (sampled messages count for those they stand for)
+    terms = TextField()  # stored as a JSON object of the cluster's most frequent tokens and their counts
+    label = TextField(null=True)
+    keywords = TextField(null=True)  # stored as a JSON list of {"keyword", "score"}
+
+    class Meta:
+        table_name = "topiccentroid"
+        indexes = (
+            (("username", "cluster"), True),
+        )
+
+
+# messages per user, month and topic cluster
+class TopicWindow(BaseModel):
+    username = TextField()
+    window = TextField()  # "YYYY-MM"
+    cluster = IntegerField()
+    messages = FloatField()
+    label = TextField(null=True)  # the cluster's label when the month was first counted
+
+    class Meta:
+        table_name = "topicwindow"
+        indexes = (
+            (("username", "window", "cluster"), True),
+        )
+
+
+# messages already added to the topic centroids, so re-uploads only add new ones
+class TopicDriftMessage(BaseModel):
+    message_id = TextField(primary_key=True)
+    cluster = IntegerField(null=True)  # null when the message had no text or was left out by the sample
+
+    class Meta:
+        table_name = "topicdriftmessage"
+
+
+# FTS5 index over message.content, with the message table as external content.
+MESSAGE_FTS_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messagefts USING fts5("
+    "content, author UNINDEXED, channel UNINDEXED, timestamp UNINDEXED, "
+    "content='message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+)
+# Keep the index in sync with incremental inserts, deletes and updates.
+MESSAGE_FTS_TRIGGERS = {
+    "message_ai": (
+        "CREATE TRIGGER IF NOT EXISTS message_ai AFTER INSERT ON message BEGIN "
+        "INSERT INTO messagefts(rowid, content, author, channel, timestamp) "
+        "VALUES (new.id, new.content, new.author, new.channel, new.timestamp); END"
+    ),
+    "message_ad": (
+        "CREATE TRIGGER IF NOT EXISTS message_ad AFTER DELETE ON message BEGIN "
+        "INSERT INTO messagefts(messagefts, rowid, content, author, channel, timestamp) "
+        "VALUES ('delete', old.id, old.content, old.author, old.channel, old.timestamp); END"
+    ),
+    "message_au": (
+        "CREATE TRIGGER IF NOT EXISTS message_au AFTER UPDATE ON message BEGIN "
+        "INSERT INTO messagefts(messagefts, rowid, content, author, channel, timestamp) "
+        "VALUES ('delete', old.id, old.content, old.author, old.channel, old.timestamp); "
+        "INSERT INTO messagefts(rowid, content, author, channel, timestamp) "
+        "VALUES (new.id, new.content, new.author, new.channel, new.timestamp); END"
+    ),
+}
+
+
+# A fresh random version for every inserted or updated global history row, so
+# cached copies (see responseCache.py) can be validated with a primary-key read.
+HISTORY_VERSION_TRIGGERS = {
+    "globalconversationhistory_version_ai": (
+        "CREATE TRIGGER IF NOT EXISTS globalconversationhistory_version_ai "
+        "AFTER INSERT ON globalconversationhistory BEGIN "
+        "UPDATE globalconversationhistory SET version = random() WHERE username = new.username; END"
+    ),
+    "globalconversationhistory_version_au": (
+        "CREATE TRIGGER IF NOT EXISTS globalconversationhistory_version_au "
+        "AFTER UPDATE ON globalconversationhistory WHEN new.version IS old.version BEGIN "
+        "UPDATE globalconversationhistory SET version = random() WHERE username = new.username; END"
+    ),
+}
+
+
+# Columns added to tables that existing databases already have; create_tables() adds them.
+ADDED_COLUMNS = [
+    (ConversationHistory, "fidelity"),
+    (GlobalConversationHistory, "fidelity"),
+    (GlobalConversationHistory, "version"),
+    (TopicWindow, "label"),
+    (DailyRollup, "channel"),
+]
+
+# Indexes replaced by wider ones; create_tables() drops them.
+DROPPED_INDEXES = [
+    "dailyrollup_username_day",
+]
+
+
+def add_missing_columns():
+    """Adds ADDED_COLUMNS that an older database lacks; existing rows get the column default."""
+    migrator = SqliteMigrator(db)
+    added = []
+    for model, name in ADDED_COLUMNS:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue  # created with every column by create_tables()
+        if name not in {column.name for column in db.get_columns(table)}:
+            added.append((migrator.add_column(table, name, model._meta.fields[name]), model._meta.fields[name]))
+    if added:
+        with db.atomic():
+            migrate(*(operation for operation, _ in added))
+            for _, field in added:
+                field.model.update({field: field.default}).where(field.is_null()).execute()
+
+
+def create_tables():
+    # just making sure table exist
+    db.connect()
+    # Columns first: the indexes create_tables() adds to existing tables may use them.
+    add_missing_columns()
+    for index in DROPPED_INDEXES:
+        db.execute_sql(f"DROP INDEX IF EXISTS {index}")
+    db.create_tables([ConversationHistory, GlobalConversationHistory, UserSnapshot, TopicResult, DailyRollup, Message, TopicCentroid, TopicWindow, TopicDriftMessage], safe=True)
+    db.execute_sql(MESSAGE_FTS_SQL)
+    for trigger in MESSAGE_FTS_TRIGGERS.values():
+        db.execute_sql(trigger)
+    for trigger in HISTORY_VERSION_TRIGGERS.values():
+        db.execute_sql(trigger)
+    db.close()
@@ -0,0 +1,192 @@
+"""
+Offline batch processing of Discord exports, without going through /upload.
+
+    python processExports.py exports/general.json exports/memes.json --workers 8
+    python processExports.py server-export.zip
+
+The exports are merged like /upload_batch does (messages deduplicated by id)
+and every user's result is appended to a checkpoint as soon as it is computed.
+If the run crashes or is interrupted, running the same command again skips the
+users that are already done. Once every user is analyzed, the results are
+written to the database as one conversation and the checkpoint is removed.
+
+--workers parallelizes decoding the exports, the per-user stats
+(parse_messages) and topic modeling (embedding, KMeans, KeyBERT, labeling),
+the expensive part per user. Topic workers are forked once from this process
+after the models are loaded, so every worker shares them instead of loading
+its own copy; each finished user is checkpointed as soon as any worker
+returns it. With INGEST_MEMORY_BUDGET_MB set, topics are modeled in this
+process, where the budget is measured.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from batchIngestion import (
+    INGEST_WORKERS,
+    analyze_users,
+    load_exports,
+    merge_exports,
+    read_exports,
+    store_results,
+)
+from jsonParsing import get_unique_usernames
+from memoryBudget import MemoryBudget
+from orm import create_tables
+
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints")
+
+
+def job_id(exports):
+    """Identifies a run by the content of its input files, in order."""
+    digest = hashlib.sha256()
+    for name, raw in exports:
+        digest.update(name.encode("utf-8") + b"\0")
+        digest.update(hashlib.sha256(raw).digest())
+    return digest.hexdigest()[:16]
+
+
+class Checkpoint:
+    """
+    A directory with job.json (conversation id and input files) and
+    results.jsonl, one finished user per line. Lines are flushed and synced as
+    they are written, so at most the user in progress is lost on a crash.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.job_path = os.path.join(directory, "job.json")
+        self.results_path = os.path.join(directory, "results.jsonl")
+
+    def load_job(self):
+        if not os.path.exists(self.job_path):
+            return None
+        with open(self.job_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_job(self, job):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.job_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, indent=2)
+
+    def load_results(self):
+        results = {}
+        if not os.path.exists(self.results_path):
+            return results
+        with open(self.results_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # partially written last line of an interrupted run
+                if "topic_embedding" not in entry:
+                    continue  # written by an older version with the full embedding; analyzed again
+                results[entry["username"]] = entry
+        return results
+
+    def append(self, username, topic, stats, topic_embedding, rollups):
+        with open(self.results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "username": username,
+                "topic": topic,
+                "stats": stats,
+                "topic_embedding": np.asarray(topic_embedding).tolist(),
+                "rollups": rollups,
+            }) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def process_exports(paths, workers=INGEST_WORKERS, checkpoint_dir=CHECKPOINT_DIR, restart=False, keep_checkpoint=False):
+    files = []
+    try:
+        for path in paths:
+            files.append((os.path.basename(path), open(path, "rb")))
+        exports = read_exports(files)
+    finally:
+        for _, fileobj in files:
+            fileobj.close()
+
+    checkpoint = Checkpoint(os.path.join(checkpoint_dir, job_id(exports)))
+    if restart:
+        checkpoint.remove()
+
+    memory_budget = MemoryBudget()
+    try:
+        loaded = load_exports(exports, workers=workers, memory_budget=memory_budget)
+        data, duplicates = merge_exports(loaded)
+        usernames = get_unique_usernames(data)
+
+        job = checkpoint.load_job()
+        if job is None:
+            job = {
+                "conversation_id": datetime.now().isoformat(),
+                "files": [name for name, _ in loaded],
+                "messages": len(data["messages"]),
+                "duplicates_removed": duplicates,
+                "users": len(usernames),
+            }
+            checkpoint.save_job(job)
+
+        done = checkpoint.load_results()
+        pending = [username for username in usernames if username not in done]
+        print(
+            f"{len(data['messages'])} messages from {len(loaded)} file(s), {duplicates} duplicates removed; "
+            f"{len(usernames)} users, {len(done)} already done (checkpoint {checkpoint.directory})"
+        )
+
+        if pending:
+            analyzed = analyze_users(data, pending, workers=workers, memory_budget=memory_budget, topic_workers=workers)
+            for username, topic, stats, topic_embedding, rollups in analyzed:
+                checkpoint.append(username, topic, stats, topic_embedding, rollups)
+                done[username] = {"topic": topic, "stats": stats, "topic_embedding": topic_embedding, "rollups": rollups}
+                print(f"[{len(done)}/{len(usernames)}] {username}")
+
+        results = (
+            (
+                username,
+                done[username]["topic"],
+                done[username]["stats"],
+                np.asarray(done[username]["topic_embedding"], dtype=np.float32).reshape(1, -1),
+                done[username].get("rollups", {}),
+            )
+            for username in usernames
+        )
+        store_results(results, job["conversation_id"], memory_budget=memory_budget)
+        print("Memory:", json.dumps(memory_budget.report()))
+    finally:
+        memory_budget.close()
+    if not keep_checkpoint:
+        checkpoint.remove()
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze Discord exports directly into the database.")
+    parser.add_argument("paths", nargs="+", help="JSON exports or zip archives of exports")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="worker processes for decoding, per-user stats and topic modeling")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint for these files")
+    parser.add_argument("--keep-checkpoint", action="store_true", help="don't delete the checkpoint after storing")
+    args = parser.parse_args()
+
+    create_tables()
+    try:
+        job = process_exports(args.paths, args.workers, args.checkpoint_dir, args.restart, args.keep_checkpoint)
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume.")
+        sys.exit(130)
+    print(f"Stored {job['users']} users as conversation {job['conversation_id']}")
+
+
+if __name__ == "__main__":
+    main()
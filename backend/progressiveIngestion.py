@@ -0,0 +1,273 @@
+"""
+Progressive uploads: a fast preview first, exact results in the background.
+
+A normal upload only returns once every user's topic has been modeled, which
+takes minutes for a big export. A progressive upload returns a job id right
+away and then works in two stages:
+
+  preview   exact counting stats (parse_messages) for every user, topics
+            estimated from TF-IDF over a time-stratified sample of each user's
+            messages (or taken from the topic cache when available), user
+            embeddings and 3D coordinates. Stored within seconds with
+            fidelity="preview".
+  refining  the full topic pipeline per user; each user's record is replaced
+            (fidelity="exact") as soon as it is done. Once everyone is refined
+            the topic drift is updated (with TOPIC_DRIFT) and the 3D
+            coordinates are recomputed.
+
+Clients follow a job by polling /api/upload/<job id> or by reading the
+server-sent events of /api/upload/<job id>/events. Its status is "analyzing"
+until the preview is stored, "preview" while users are refined, then "done".
+"""
+import functools
+import json
+import os
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from batchIngestion import (
+    INGEST_WORKERS,
+    compute_stats,
+    favorite_topic,
+    ingest_lock,
+    prepare_messages,
+    save_user_result,
+    update_three_d_embeddings,
+)
+from dailyRollups import store_rollups
+from generateEmbedding import getEmbedding, getEmbeddings, encode_topics
+from messageSampling import stratified_sample
+from memoryBudget import MemoryBudget
+from messageVectors import MESSAGE_VECTORS, MessageVectorWriter
+from orm import db, ConversationHistory, FIDELITY_EXACT, FIDELITY_PREVIEW
+import requestProfiling
+from topicCache import topic_fingerprint, get_topic
+from topicDrift import TOPIC_DRIFT, update_topic_drift
+from topicLabeler import TOPIC_LABEL_MIN_SIMILARITY
+from topicModeling import clean_text, topic_labeler
+
+load_dotenv()
+
+# Messages per user used for the preview topic estimate.
+PROGRESSIVE_PREVIEW_CAP = int(os.getenv("PROGRESSIVE_PREVIEW_CAP", "200"))
+# Finished jobs kept for status requests.
+UPLOAD_JOBS_KEPT = 50
+
+PREVIEW_KEYWORDS = 10
+
+
+# --- Jobs ---
+class UploadJob:
+    """
+    State of one progressive upload plus its numbered event log, which backs
+    both the status endpoint and the event stream (Last-Event-ID resumes it).
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"  # queued -> analyzing -> preview (stored, refining) -> done | error
+        self.conversation_id = None
+        self.users = 0
+        self.refined = 0
+        self.error = None
+        self.memory = None  # memory report (see memoryBudget.py), once the job is done
+        self.events = []  # (event id, event name, data)
+        self.changed = threading.Condition()
+
+    def state(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "conversation_id": self.conversation_id,
+            "users": self.users,
+            "refined": self.refined,
+            "fidelity": FIDELITY_EXACT if self.status == "done" else FIDELITY_PREVIEW,
+            "error": self.error,
+            "memory": self.memory,
+        }
+
+    def publish(self, event, data=None, **changes):
+        with self.changed:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.events.append((len(self.events) + 1, event, data if data is not None else self.state()))
+            self.changed.notify_all()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def events_after(self, last_id, timeout=None):
+        """Events newer than last_id, waiting up to timeout seconds for one to arrive."""
+        with self.changed:
+            self.changed.wait_for(lambda: len(self.events) > last_id or self.finished, timeout)
+            return self.events[last_id:]
+
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+# One job at a time; later uploads wait in the queue.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="progressive-upload")
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def start_progressive_ingest(data, workers=INGEST_WORKERS, memory_budget=None):
+    """Queues a progressive upload of an export (or merged exports) and returns its job."""
+    job = UploadJob(uuid.uuid4().hex[:12])
+    with _jobs_lock:
+        _jobs[job.id] = job
+        finished = [job_id for job_id, other in _jobs.items() if other.finished]
+        for job_id in finished[:max(0, len(_jobs) - UPLOAD_JOBS_KEPT)]:
+            del _jobs[job_id]
+    job.publish("status")
+    # The request returns before the job runs; a profiled request profiles the job too.
+    _executor.submit(
+        requestProfiling.profiled_background, requestProfiling.current_job(),
+        _run_job, job, data, workers, memory_budget or MemoryBudget(),
+    )
+    return job
+
+
+def _run_job(job, data, workers, memory_budget):
+    try:
+        with ingest_lock:
+            progressive_ingest(data, job, workers=workers, memory_budget=memory_budget)
+    except Exception as e:
+        traceback.print_exc()
+        job.publish("status", status="error", error=str(e), memory=memory_budget.report())
+    finally:
+        memory_budget.close()
+
+
+# --- Preview ---
+def preview_topics(by_author, usernames, cap=PROGRESSIVE_PREVIEW_CAP):
+    """
+    Estimates every user's topic at once: each user's sampled messages become
+    one TF-IDF document and the highest-weighted terms are its keywords (scores
+    normalized to percentages like the exact pipeline), the top one its label
+    (or the nearest vocabulary word, with TOPIC_LABELER=local).
+    """
+    documents = []
+    for username in usernames:
+        messages = [
+            msg for msg in by_author[username]
+            if (msg.get("content") or "").strip()
+        ]
+        sampled, _ = stratified_sample([msg.get("timestamp") for msg in messages], cap)
+        documents.append([token for i in sampled for token in clean_text(messages[i]["content"])])
+
+    topics = {username: {"keywords": [], "label": ""} for username in usernames}
+    if not any(documents):
+        return topics
+    vectorizer = TfidfVectorizer(analyzer=lambda tokens: tokens)
+    matrix = vectorizer.fit_transform(documents).tocsr()
+    vocabulary = vectorizer.get_feature_names_out()
+    for row, username in enumerate(usernames):
+        weights = matrix.getrow(row)
+        top = sorted(zip(weights.data, weights.indices), reverse=True)[:PREVIEW_KEYWORDS]
+        total = sum(weight for weight, _ in top)
+        keywords = [{"keyword": str(vocabulary[term]), "score": weight / total * 100} for weight, term in top]
+        topics[username] = {"keywords": keywords, "label": keywords[0]["keyword"] if keywords else ""}
+    if topic_labeler is not None:
+        # With local labels, every preview is labeled in one batch (never by the LLM).
+        labels, similarities = topic_labeler.label([topics[username]["keywords"] for username in usernames])
+        for username, label, similarity in zip(usernames, labels, similarities):
+            if similarity >= TOPIC_LABEL_MIN_SIMILARITY:
+                topics[username]["label"] = label
+    return topics
+
+
+# --- Pipeline ---
+def progressive_ingest(data, job, conversation_id=None, workers=INGEST_WORKERS, memory_budget=None):
+    if conversation_id is None:
+        conversation_id = datetime.now().isoformat()
+    if memory_budget is None:
+        memory_budget = MemoryBudget()
+    with memory_budget.stage("group"):
+        usernames, by_author = prepare_messages(data)
+    job.publish("status", status="analyzing", conversation_id=conversation_id, users=len(usernames))
+
+    with memory_budget.stage("stats"):
+        stats = compute_stats(by_author, usernames, workers, memory_budget)
+    with memory_budget.stage("preview"):
+        estimates = preview_topics(by_author, usernames)
+    pending = []
+    with memory_budget.stage("store_preview"), db.connection_context():
+        ConversationHistory.delete().execute()
+        topics, topic_embeddings, fidelities = {}, {}, {}
+        for username in usernames:
+            cached = get_topic(topic_fingerprint(username, by_author[username]))
+            if cached is not None:
+                (topics[username], topic_embeddings[username]), fidelities[username] = cached, FIDELITY_EXACT
+            else:
+                topics[username], fidelities[username] = estimates[username], FIDELITY_PREVIEW
+                pending.append(username)
+        if pending:
+            encoded = encode_topics(topics[username] for username in pending)
+            for username, topic_embedding in zip(pending, encoded):
+                topic_embeddings[username] = topic_embedding[None, :]
+        # Every user's embedding in one step, from the topic embeddings and the stats features.
+        embeddings = getEmbeddings(
+            np.vstack([topic_embeddings[username] for username in usernames]),
+            [stats[username][0] for username in usernames],
+        ) if usernames else []
+        for username, embedding in zip(usernames, embeddings):
+            user_stats, rollups = stats[username]
+            save_user_result(username, topics[username], user_stats, embedding[None, :], conversation_id, fidelities[username])
+            store_rollups(username, rollups)
+        update_three_d_embeddings(conversation_id)
+    refined = len(usernames) - len(pending)
+    job.publish("status", status="preview", refined=refined)
+
+    vector_writer = MessageVectorWriter() if MESSAGE_VECTORS else None
+    for username in pending:
+        vector_sink = None
+        if vector_writer is not None:
+            vector_sink = functools.partial(vector_writer.add, username)
+        with memory_budget.stage("topics"):
+            topic, topic_embedding = favorite_topic(username, by_author[username], vector_sink, memory_budget)
+        user_stats, _ = stats[username]
+        embedding = getEmbedding(topic, user_stats, topic_embedding)
+        with db.connection_context():
+            save_user_result(username, topic, user_stats, embedding, conversation_id, FIDELITY_EXACT)
+        refined += 1
+        job.publish("user", {"username": username, "favorite_topic": topic.get("label"), "fidelity": FIDELITY_EXACT}, refined=refined)
+    if vector_writer is not None:
+        vector_writer.finish()
+    if TOPIC_DRIFT:
+        for username in usernames:
+            with db.connection_context():
+                update_topic_drift(username, by_author[username])
+
+    if pending:
+        with db.connection_context():
+            update_three_d_embeddings(conversation_id)
+    job.publish("status", status="done", memory=memory_budget.report())
+    return conversation_id, usernames
+
+
+# --- Event stream ---
+def event_stream(job, last_id=0, keepalive=15):
+    """Server-sent events for a job, from after last_id until it finishes."""
+    while True:
+        events = job.events_after(last_id, timeout=keepalive)
+        if not events:
+            if job.finished:
+                return
+            yield ": keep-alive\n\n"
+            continue
+        for event_id, event, data in events:
+            yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            last_id = event_id
@@ -0,0 +1,225 @@
+"""
+Opt-in profiling of single requests and upload jobs.
+
+Profiling is only wired into the app when PROFILING_TOKEN is set; otherwise
+install_profiling() does nothing and requests run exactly as before. With a
+token, a request is profiled when
+
+  - it carries the header `X-Profile: <token>`, or
+  - it was armed beforehand with `POST /api/admin/profile` (same header), e.g.
+    {"count": 1, "path": "/upload"} profiles the next upload.
+
+Each profiled job writes two files to PROFILE_DIR, named after the job id that
+is returned in the `X-Profile-Id` response header:
+
+  <job id>.prof       cProfile stats (python -m pstats, snakeviz, ...)
+  <job id>.collapsed  sampled stacks in collapsed format (flamegraph.pl, speedscope)
+
+Work that runs in the ingestion process pool is profiled as well: every worker
+task writes `<job id>.worker-<pid>-<n>.prof/.collapsed` next to the main files.
+Work a profiled request leaves to a background thread (the refinement of a
+progressive upload) writes `<job id>.background.prof/.collapsed` when it ends.
+"""
+import cProfile
+import itertools
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+# Seconds between stack samples.
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+_current = threading.local()
+_worker_tasks = itertools.count()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of one thread at a fixed interval and counts identical stacks."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Profile:
+    """cProfile plus a stack sampler around the work of the calling thread."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident())
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this process; keep the samples only.
+            self.profiler = None
+        self.sampler.start()
+        _current.job_id = self.job_id
+        return self
+
+    def stop(self, directory=PROFILE_DIR):
+        _current.job_id = None
+        self.sampler.stop()
+        if self.profiler is not None:
+            self.profiler.disable()
+        elapsed = time.perf_counter() - self.started
+
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.job_id)
+        if self.profiler is not None:
+            self.profiler.dump_stats(base + ".prof")
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return elapsed
+
+
+def new_job_id(name):
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    return f"{stamp}-{name.strip('/').replace('/', '_') or 'root'}-{uuid.uuid4().hex[:8]}"
+
+
+def current_job():
+    """The job id being profiled on this thread, or None."""
+    return getattr(_current, "job_id", None)
+
+
+def profiled_call(job_id, fn, *args):
+    """Runs fn(*args) in a pool worker under a profile named after the parent job."""
+    profile = Profile(f"{job_id}.worker-{os.getpid()}-{next(_worker_tasks)}").start()
+    try:
+        return fn(*args)
+    finally:
+        profile.stop()
+
+
+def profiled_background(job_id, fn, *args):
+    """
+    Runs fn(*args) on a background thread, profiled as part of job_id when the
+    request that queued it was profiled (job_id from current_job(), or None).
+    """
+    if job_id is None:
+        return fn(*args)
+    profile = Profile(f"{job_id}.background").start()
+    try:
+        return fn(*args)
+    finally:
+        profile.stop()
+
+
+def submit(pool, fn, *args):
+    """pool.submit() that profiles the task too when the calling job is being profiled."""
+    job_id = current_job()
+    if job_id is None:
+        return pool.submit(fn, *args)
+    return pool.submit(profiled_call, job_id, fn, *args)
+
+
+class _Armed:
+    """Profiles the next `count` requests whose path starts with `path`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.path = "/"
+
+    def arm(self, count, path):
+        with self.lock:
+            self.count, self.path = count, path
+
+    def take(self, path):
+        with self.lock:
+            if self.count > 0 and path.startswith(self.path):
+                self.count -= 1
+                return True
+            return False
+
+    def state(self):
+        with self.lock:
+            return {"count": self.count, "path": self.path}
+
+
+def install_profiling(app):
+    """Adds the profiling hooks and admin endpoint to a Flask app when PROFILING_TOKEN is set."""
+    if not PROFILING_TOKEN:
+        return
+
+    from flask import g, jsonify, request
+
+    armed = _Armed()
+
+    def authorized(header):
+        return request.headers.get(header) == PROFILING_TOKEN
+
+    @app.before_request
+    def start_profile():
+        if request.path.startswith("/api/admin/profile"):
+            return
+        if authorized("X-Profile") or armed.take(request.path):
+            g.profile = Profile(new_job_id(request.path)).start()
+
+    @app.after_request
+    def stop_profile(response):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            elapsed = profile.stop()
+            response.headers["X-Profile-Id"] = profile.job_id
+            print(f"Profiled {request.path} as {profile.job_id} ({elapsed:.2f}s)")
+        return response
+
+    @app.teardown_request
+    def abandon_profile(exc):
+        # after_request is skipped when the view raises; still write what was collected.
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile.stop()
+
+    @app.route("/api/admin/profile", methods=["GET", "POST"])
+    def admin_profile():
+        if not authorized("X-Profile"):
+            return jsonify({"error": "Forbidden"}), 403
+        if request.method == "POST":
+            data = request.get_json(silent=True) or {}
+            try:
+                count = max(0, int(data.get("count", 1)))
+            except (TypeError, ValueError):
+                return jsonify({"error": "count must be an integer"}), 400
+            armed.arm(count, data.get("path") or "/")
+        profiles = sorted(os.listdir(PROFILE_DIR)) if os.path.isdir(PROFILE_DIR) else []
+        return jsonify({"armed": armed.state(), "directory": PROFILE_DIR, "profiles": profiles}), 200
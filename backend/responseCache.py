@@ -0,0 +1,70 @@
+import os
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of decoded /getconversationhistory responses kept in memory per process.
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "1024"))
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss accounting."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class ConversationHistoryCache(LRUCache):
+    """
+    Decoded conversation history records keyed by (username, version). The
+    version column changes on every write to the row (see
+    HISTORY_VERSION_TRIGGERS in orm.py), so callers read the current version
+    first and a hit is always current, whichever process wrote the row. A record
+    is stored under the version read together with it, so a write racing with
+    the read only leaves an entry that is never hit and ages out of the LRU.
+    """
+
+    def get_user(self, username, version):
+        return self.get((username, version))
+
+    def put_user(self, username, version, value):
+        self.put((username, version), value)
+
+
+conversation_cache = ConversationHistoryCache(CONVERSATION_CACHE_SIZE)
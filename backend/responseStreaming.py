@@ -0,0 +1,96 @@
+import json
+import zlib
+
+from flask import Response, request, stream_with_context
+
+try:
+    import brotli  # optional: enables "Content-Encoding: br"
+except ImportError:
+    brotli = None
+
+
+# --- Content negotiation ---
+def choose_encoding(accept_encoding):
+    """Returns "br", "gzip" or None depending on what the client accepts."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=5)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.flush
+            self._finish = self._compressor.finish
+        else:
+            # wbits=31 writes a gzip header and trailer.
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._compressor.flush
+
+    def compress(self, chunk):
+        # Flush after every chunk so the client can start parsing before the stream ends.
+        return self._compress(chunk) + self._flush()
+
+    def finish(self):
+        return self._finish()
+
+
+def _encode_chunks(chunks, encoding):
+    if encoding is None:
+        for chunk in chunks:
+            yield chunk.encode("utf-8")
+        return
+    compressor = _Compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def stream_json_response(chunks, status=200):
+    """
+    Streams an iterable of JSON text fragments as one response, compressed with
+    Brotli or gzip when the client accepts it.
+    """
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    response = Response(
+        stream_with_context(_encode_chunks(chunks, encoding)),
+        status=status,
+        mimetype="application/json",
+    )
+    response.headers["Vary"] = "Accept-Encoding"
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def json_object_chunks(items, batch_size=500):
+    """
+    Turns an iterable of (key, value) pairs into JSON object text, emitted in
+    batches so large objects never have to be built in memory at once.
+    """
+    yield "{"
+    batch = []
+    first = True
+    for key, value in items:
+        batch.append(("" if first else ",") + json.dumps(key) + ":" + json.dumps(value))
+        first = False
+        if len(batch) >= batch_size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+    yield "}"
@@ -0,0 +1,248 @@
+import json
+import math
+import os
+import threading
+from collections import Counter
+
+import numpy as np
+from dotenv import load_dotenv
+from peewee import fn
+
+from orm import GlobalConversationHistory
+
+load_dotenv()
+
+# Deepest octree level. Level L splits the bounding box into 2^L cells per axis;
+# requests at this level (or deeper) get raw users instead of aggregates.
+LOD_MAX_LEVEL = int(os.getenv("LOD_MAX_LEVEL", "6"))
+
+# Extra room added around the data when the bounds are computed, so points from
+# later uploads usually land inside the box and don't force a full rebuild.
+BOUNDS_PADDING = 0.1
+
+
+class _Cell:
+    __slots__ = ("total", "count", "conversations", "topics")
+
+    def __init__(self):
+        self.total = np.zeros(3)
+        self.count = 0
+        self.conversations = Counter()
+        self.topics = Counter()
+
+    def add(self, point, conversation, topic, sign):
+        self.total += sign * point
+        self.count += sign
+        self.conversations[conversation] += sign
+        self.topics[topic] += sign
+        if self.conversations[conversation] <= 0:
+            del self.conversations[conversation]
+        if self.topics[topic] <= 0:
+            del self.topics[topic]
+
+
+class SpatialIndex:
+    """
+    Octree over the users' 3D coordinates. Every level keeps one aggregate
+    (coordinate sum, count, conversation and topic counts) per non-empty cell,
+    so adding or moving a user touches exactly one cell per level.
+    """
+
+    def __init__(self, max_level=LOD_MAX_LEVEL):
+        self.max_level = max_level
+        self.lock = threading.Lock()
+        self.built = False
+        self._reset()
+
+    def _reset(self, low=None, high=None):
+        self.users = {}  # username -> (point, conversation, topic)
+        self.levels = [{} for _ in range(self.max_level + 1)]
+        self.low = low
+        self.high = high
+
+    # --- Cell arithmetic ---
+    def _cell_of(self, point, level):
+        cells_per_axis = 1 << level
+        extent = np.maximum(self.high - self.low, 1e-9)
+        coords = np.floor((point - self.low) / extent * cells_per_axis).astype(int)
+        return tuple(np.clip(coords, 0, cells_per_axis - 1).tolist())
+
+    def cell_bounds(self, cell, level):
+        size = (self.high - self.low) / (1 << level)
+        low = self.low + np.array(cell) * size
+        return low, low + size
+
+    def _inside(self, point):
+        return bool(np.all(point >= self.low) and np.all(point <= self.high))
+
+    # --- Updates ---
+    def _apply(self, username, point, conversation, topic, sign):
+        for level, cells in enumerate(self.levels):
+            key = self._cell_of(point, level)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = _Cell()
+            cell.add(point, conversation, topic, sign)
+            if cell.count <= 0:
+                del cells[key]
+
+    def _remove(self, username):
+        previous = self.users.pop(username, None)
+        if previous is not None:
+            self._apply(username, *previous, sign=-1)
+
+    def _add(self, username, point, conversation, topic):
+        self.users[username] = (point, conversation, topic)
+        self._apply(username, point, conversation, topic, sign=1)
+
+    def _rebuild(self, points):
+        if points:
+            coords = np.array([point for point, _, _ in points.values()])
+            low, high = coords.min(axis=0), coords.max(axis=0)
+            padding = np.maximum((high - low) * BOUNDS_PADDING, 1e-6)
+            self._reset(low - padding, high + padding)
+        else:
+            self._reset()
+        for username, (point, conversation, topic) in points.items():
+            self._add(username, point, conversation, topic)
+        self.built = True
+
+    def rebuild(self, rows):
+        """Rebuilds the index from (username, point, conversation, topic) rows; rows without a point are skipped."""
+        with self.lock:
+            self._rebuild({username: (np.asarray(point, dtype=float), conversation, topic)
+                           for username, point, conversation, topic in rows if point is not None})
+
+    def update(self, rows):
+        """
+        Incrementally moves the given users to their new coordinates (a None
+        point removes the user). Falls back to a full rebuild only when a point
+        lands outside the current bounds.
+        """
+        with self.lock:
+            if not self.built:
+                return
+            rows = [(username, None if point is None else np.asarray(point, dtype=float), conversation, topic)
+                    for username, point, conversation, topic in rows]
+            moved = [point for _, point, _, _ in rows if point is not None]
+            if moved and (self.low is None or not all(self._inside(point) for point in moved)):
+                points = dict(self.users)
+                for username, point, conversation, topic in rows:
+                    if point is None:
+                        points.pop(username, None)
+                    else:
+                        points[username] = (point, conversation, topic)
+                self._rebuild(points)
+                return
+            for username, point, conversation, topic in rows:
+                self._remove(username)
+                if point is not None:
+                    self._add(username, point, conversation, topic)
+
+    # --- Queries ---
+    def _box_overlaps(self, cell_low, cell_high, box_low, box_high):
+        return bool(np.all(cell_high >= box_low) and np.all(cell_low <= box_high))
+
+    def clusters(self, level, box_low=None, box_high=None):
+        """Returns the aggregated cells of a level, optionally limited to a box."""
+        level = min(level, self.max_level)
+        with self.lock:
+            result = []
+            for key, cell in self.levels[level].items():
+                if box_low is not None:
+                    cell_low, cell_high = self.cell_bounds(key, level)
+                    if not self._box_overlaps(cell_low, cell_high, box_low, box_high):
+                        continue
+                result.append({
+                    "cell": list(key),
+                    "centroid": (cell.total / cell.count).tolist(),
+                    "count": cell.count,
+                    "conversation": cell.conversations.most_common(1)[0][0],
+                    "topic": cell.topics.most_common(1)[0][0],
+                })
+            return result
+
+    def users_in(self, box_low, box_high):
+        """Returns the raw users whose coordinates fall inside the box."""
+        with self.lock:
+            return [
+                (username, point.tolist(), conversation, topic)
+                for username, (point, conversation, topic) in self.users.items()
+                if np.all(point >= box_low) and np.all(point <= box_high)
+            ]
+
+
+def _parse_point(value):
+    try:
+        point = json.loads(value) if value else None
+    except ValueError:
+        return None
+    if not isinstance(point, list) or len(point) != 3:
+        return None
+    if not all(isinstance(x, (int, float)) and math.isfinite(x) for x in point):
+        return None
+    return point
+
+
+_SELECT_BATCH = 500  # usernames per IN (...) clause, under SQLite's bound-variable limit
+
+
+def _point_rows(query):
+    for record in query.iterator():
+        yield record.username, _parse_point(record.three_d_embedding), record.last_conversation, record.favorite_topic
+
+
+def global_rows(usernames=None):
+    """
+    (username, point, conversation, topic) for every global history row, or
+    only the given users; point is None when the row has no valid coordinates.
+    """
+    query = GlobalConversationHistory.select(
+        GlobalConversationHistory.username,
+        GlobalConversationHistory.three_d_embedding,
+        GlobalConversationHistory.last_conversation,
+        GlobalConversationHistory.favorite_topic,
+    )
+    if usernames is None:
+        yield from _point_rows(query)
+        return
+    for start in range(0, len(usernames), _SELECT_BATCH):
+        yield from _point_rows(query.where(GlobalConversationHistory.username.in_(usernames[start:start + _SELECT_BATCH])))
+
+
+def history_watermark():
+    # Every insert or update of a global history row, by any process, gives the
+    # row a new random version (orm.HISTORY_VERSION_TRIGGERS); deletes change the count.
+    return GlobalConversationHistory.select(
+        fn.COUNT(GlobalConversationHistory.username), fn.TOTAL(GlobalConversationHistory.version)
+    ).tuples().get()
+
+
+# Index over GlobalConversationHistory, built lazily on the first LOD request.
+# Later requests catch up with whatever any process (an upload, processExports,
+# historyArchive import, another server worker) wrote since: only the users
+# whose row version changed are re-read and moved.
+global_index = SpatialIndex()
+_synced = {"watermark": None, "versions": {}}
+_sync_lock = threading.Lock()
+
+
+def ensure_global_index():
+    with _sync_lock:
+        watermark = history_watermark()
+        if global_index.built and watermark == _synced["watermark"]:
+            return global_index
+        # Read before the rows, so a write in between is caught by the next call.
+        versions = dict(
+            GlobalConversationHistory.select(GlobalConversationHistory.username, GlobalConversationHistory.version).tuples()
+        )
+        if not global_index.built:
+            global_index.rebuild(global_rows())
+        else:
+            previous = _synced["versions"]
+            changed = [username for username, version in versions.items() if previous.get(username) != version]
+            removed = [(username, None, None, None) for username in previous if username not in versions]
+            global_index.update(list(global_rows(changed)) + removed)
+        _synced["watermark"] = watermark
+        _synced["versions"] = versions
+    return global_index
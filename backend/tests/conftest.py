@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other by file name, as when run from backend/.
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A fresh SQLite database with every table, in place of conversationhistory.db."""
+    from orm import db, create_tables
+
+    db.init(str(tmp_path / "test.db"))
+    create_tables()
+    yield db
+    db.close()
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from benchmarkEmbedder import SAMPLE_EXPORTS, cosine_rows, sample_sentences
+from embeddingBackend import EMBEDDER_MODEL_DIR, load_embedder
+
+# Every message's embedding must stay this close to the stock fp32 one.
+MIN_COSINE = 0.99
+MIN_MEAN_COSINE = 0.995
+
+EDGE_CASES = ["", "   ", "lol", "😂😂😂", "https://example.com/some/long/path?with=query", "word " * 400, 12345]
+
+
+def _has_onnx_model(model_dir):
+    return any(os.path.exists(os.path.join(model_dir, name)) for name in ("model.onnx", "model_quantized.onnx"))
+
+
+@pytest.fixture(scope="module")
+def sentences():
+    return sample_sentences(SAMPLE_EXPORTS, 300) + EDGE_CASES
+
+
+@pytest.fixture(scope="module")
+def reference(sentences):
+    try:
+        embedder = load_embedder("torch")
+    except OSError as e:  # the MiniLM weights are neither cached nor downloadable
+        pytest.skip(f"all-MiniLM-L6-v2 is unavailable: {e}")
+    return np.asarray(embedder.encode(sentences, batch_size=32), dtype=np.float32)
+
+
+def _candidate(backend):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+        pytest.importorskip("tokenizers")
+        if not _has_onnx_model(EMBEDDER_MODEL_DIR):
+            pytest.skip(f"No ONNX model in {EMBEDDER_MODEL_DIR}; run `python embeddingBackend.py export` first")
+    return load_embedder(backend)
+
+
+@pytest.mark.parametrize("backend", ["torch-int8", "onnx"])
+def test_backend_stays_close_to_fp32(backend, sentences, reference):
+    embeddings = np.asarray(_candidate(backend).encode(sentences, batch_size=32), dtype=np.float32)
+
+    assert embeddings.shape == reference.shape
+    assert np.isfinite(embeddings).all()
+    cosines = cosine_rows(reference, embeddings)
+    assert cosines.min() >= MIN_COSINE, f"worst message: {sentences[int(cosines.argmin())]!r}"
+    assert cosines.mean() >= MIN_MEAN_COSINE
+
+
+@pytest.mark.parametrize("backend", ["torch-int8", "onnx"])
+def test_batching_does_not_change_embeddings(backend, sentences):
+    embedder = _candidate(backend)
+    batched = np.asarray(embedder.encode(sentences[:64], batch_size=32), dtype=np.float32)
+    single = np.asarray(embedder.encode(sentences[:64], batch_size=1), dtype=np.float32)
+    assert cosine_rows(batched, single).min() >= 0.9999
@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+import pytest
+
+from historyArchive import ArchiveError, export_history, import_history, read_archive
+from orm import GlobalConversationHistory
+
+COLUMNS = ("username", "favorite_topic", "keywords", "stats", "embedding", "three_d_embedding", "last_conversation", "fidelity")
+
+
+def _stats(i):
+    return {
+        "Message Counts and Types": {"total_messages": 10 + i, "messages_with_links": 0},
+        "Activity Metrics": {"average_messages_per_day": 1.5 * i, "longest_active_conversation": f"0 days, {i} hours, and 0 minutes"},
+        "Most Used Emoji": {"emoji": "😂" if i % 2 else None, "count": i},
+        "Dryness Score": None if i == 1 else 2.5,
+        "Humor Score": i,  # an int in some rows, a float in others
+        "Features": {"total_messages": 10 + i, "dryness_score": 0 if i == 1 else 2.5},
+        **({"Extra": [1, "two"]} if i == 2 else {}),
+    }
+
+
+def _seed(count):
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        GlobalConversationHistory.create(
+            username=f"user{i}" if i else "名前 ünïcode",
+            favorite_topic="pizza" if i % 2 else "",
+            keywords=json.dumps([{"keyword": f"word{j}", "score": 10.0 + j} for j in range(i % 4)]),
+            stats=json.dumps(_stats(i)),
+            embedding=json.dumps([rng.standard_normal(396).astype(np.float32).tolist()]),
+            three_d_embedding=json.dumps([float(i), 0.5, -1.0]) if i != 3 else None,
+            last_conversation="2024-05-01T10:00:00",
+            fidelity="preview" if i == 4 else "exact",
+        )
+
+
+def _rows():
+    return {
+        row[0]: dict(zip(COLUMNS, row))
+        for row in GlobalConversationHistory.select(*(getattr(GlobalConversationHistory, c) for c in COLUMNS)).tuples()
+    }
+
+
+def test_export_then_import_restores_every_row(database, tmp_path):
+    path = str(tmp_path / "history.npz")
+    with database.connection_context():
+        _seed(6)
+        before = _rows()
+    export_history(path)
+
+    with database.connection_context():
+        GlobalConversationHistory.delete().execute()
+    assert import_history(path, replace=True, workers=1) == 6
+
+    with database.connection_context():
+        after = _rows()
+    assert after.keys() == before.keys()
+    for username, row in before.items():
+        restored = after[username]
+        for column in ("favorite_topic", "last_conversation", "fidelity"):
+            assert restored[column] == row[column]
+        assert json.loads(restored["keywords"]) == json.loads(row["keywords"])
+        assert json.loads(restored["stats"]) == json.loads(row["stats"])
+        # Embeddings are archived as float32, which is what they were computed as.
+        assert np.array_equal(np.float32(json.loads(restored["embedding"])), np.float32(json.loads(row["embedding"])))
+        assert json.loads(restored["three_d_embedding"] or "null") == json.loads(row["three_d_embedding"] or "null")
+
+
+def test_import_rejects_a_modified_archive(database, tmp_path):
+    path = str(tmp_path / "history.npz")
+    with database.connection_context():
+        _seed(3)
+    export_history(path)
+
+    arrays = read_archive(path)
+    arrays["embedding"][0, 0] += 1
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+    with pytest.raises(ArchiveError, match="Digest mismatch"):
+        import_history(path, workers=1)
+
+
+def test_import_rejects_a_different_embedding_size(database, tmp_path):
+    path = str(tmp_path / "history.npz")
+    with database.connection_context():
+        _seed(2)
+    export_history(path)
+    with database.connection_context():
+        GlobalConversationHistory.update(embedding=json.dumps([[0.0] * 10])).execute()
+    with pytest.raises(ArchiveError, match="396"):
+        import_history(path, workers=1)
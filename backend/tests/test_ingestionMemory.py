@@ -0,0 +1,41 @@
+import glob
+import json
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("keybert")
+
+from benchmarkMemory import DEFAULT_MAX_MB, benchmark_env, measure_export
+from mockLLMServer import start_mock_server
+
+SAMPLE_EXPORTS = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "..", "sampleJsonfiles", "*.json")))
+
+
+@pytest.fixture(scope="module")
+def env(tmp_path_factory):
+    return benchmark_env(start_mock_server().port, str(tmp_path_factory.mktemp("memory-benchmark")))
+
+
+def _report(path, budget_mb, env):
+    completed = measure_export(path, budget_mb, 1, env)
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("path", SAMPLE_EXPORTS, ids=os.path.basename)
+def test_job_peak_stays_under_the_limit(path, env):
+    report = _report(path, 0, env)
+
+    assert report["users"] > 0
+    assert set(report["stages"]) >= {"decode", "topics", "stats"}
+    assert report["degradations"] == {}
+    assert report["job_peak_mb"] <= DEFAULT_MAX_MB
+
+
+@pytest.mark.parametrize("path", SAMPLE_EXPORTS, ids=os.path.basename)
+def test_exports_over_a_tiny_budget_are_rejected(path, env):
+    report = _report(path, 8, env)
+    assert "upload budget" in report["rejected"]
@@ -0,0 +1,195 @@
+import numpy as np
+import pytest
+
+import memoryBudget
+from memoryBudget import (
+    EMBED_BATCH_SIZE,
+    JSON_EXPANSION,
+    LOW_MEMORY_EMBED_BATCH_SIZE,
+    MB,
+    MIN_SAMPLED_MESSAGES,
+    MIN_WORKING_MEMORY_MB,
+    TOPIC_BYTES_PER_MESSAGE,
+    MemoryBudget,
+    MemoryBudgetExceeded,
+)
+
+BASELINE = 500 * MB
+
+
+class FakeRSS:
+    """Stands in for rss_bytes(); tests move `used` to simulate the job growing."""
+
+    def __init__(self):
+        self.used = 0
+
+    def __call__(self):
+        return BASELINE + self.used
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    fake = FakeRSS()
+    monkeypatch.setattr(memoryBudget, "rss_bytes", fake)
+    return fake
+
+
+@pytest.fixture
+def budget(rss, tmp_path):
+    budget = MemoryBudget(100, trace=False, spill_dir=str(tmp_path))
+    yield budget
+    budget.close()
+
+
+class FakeEmbedder:
+    def __init__(self, dim=4):
+        self.dim = dim
+        self.batch_sizes = set()
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32):
+        self.batch_sizes.add(batch_size)
+        return np.array([[len(text)] * self.dim for text in texts], dtype=np.float32)
+
+
+def test_usage_is_measured_from_the_baseline(budget, rss):
+    assert budget.used() == 0
+    assert budget.headroom() == 100 * MB
+    rss.used = 30 * MB
+    assert budget.used() == 30 * MB
+    assert budget.headroom() == 70 * MB
+    rss.used = -10 * MB  # memory the process had before the job was freed
+    assert budget.used() == 0
+
+
+def test_without_a_budget_nothing_degrades(rss, tmp_path):
+    budget = MemoryBudget(0, trace=False, spill_dir=str(tmp_path))
+    rss.used = 10_000 * MB
+
+    assert budget.headroom() is None
+    assert not budget.low
+    assert budget.decode_workers([1000 * MB, 1000 * MB], 4) == 4
+    assert budget.stats_workers(4) == 4
+    assert budget.topic_workers(4) == 4
+    assert budget.message_cap(0, 1_000_000) == 0
+    assert budget.working_memory_mb() is None
+    buffer = budget.embedding_buffer(1000, 384)
+    assert not isinstance(buffer, np.memmap)
+    assert budget.report()["degradations"] == {}
+
+
+def test_decode_workers_keep_parallelism_when_copies_fit(budget):
+    size = 100 * MB // JSON_EXPANSION // 4  # two exports, decoded and pickled back: half the budget
+    assert budget.decode_workers([size, size], 4) == 4
+    assert not budget.degradations
+
+
+def test_decode_workers_go_serial_when_copies_dont_fit(budget):
+    size = 100 * MB // JSON_EXPANSION // 3
+    assert budget.decode_workers([size, size], 4) == 1
+    assert budget.degradations["serial_decode"] == 1
+    # A single export is never decoded twice, so it keeps its workers.
+    assert budget.decode_workers([2 * size], 4) == 4
+
+
+def test_decode_rejects_exports_that_cant_fit(budget, rss):
+    rss.used = 60 * MB
+    with pytest.raises(MemoryBudgetExceeded, match="40 MB of the 100 MB"):
+        budget.decode_workers([6 * MB], 1)
+    assert isinstance(MemoryBudgetExceeded("x"), MemoryError)
+
+
+def test_stats_workers_degrade_only_when_memory_is_low(budget, rss):
+    rss.used = 70 * MB
+    assert budget.stats_workers(4) == 4
+    rss.used = 80 * MB
+    assert budget.low
+    assert budget.stats_workers(4) == 1
+    assert budget.stats_workers(1) == 1
+    assert budget.degradations["serial_stats"] == 1
+
+
+def test_topic_workers_are_serial_under_any_budget(budget):
+    assert budget.topic_workers(4) == 1
+    assert budget.topic_workers(1) == 1
+    assert budget.degradations["serial_topics"] == 1
+
+
+def test_message_cap_is_kept_when_the_messages_fit(budget):
+    fits = 100 * MB // TOPIC_BYTES_PER_MESSAGE
+    assert budget.message_cap(0, fits) == 0
+    assert budget.message_cap(500, 1_000_000) == 500
+    assert not budget.degradations
+
+
+def test_message_cap_shrinks_to_the_headroom(budget, rss):
+    rss.used = 90 * MB
+    fits = 10 * MB // TOPIC_BYTES_PER_MESSAGE
+    assert budget.message_cap(0, 100_000) == fits
+    assert budget.message_cap(5000, 100_000) == fits
+    assert budget.message_cap(0, fits) == 0
+    assert budget.degradations["sampled_topics"] == 2
+
+
+def test_message_cap_never_goes_below_the_minimum(budget, rss):
+    rss.used = 200 * MB  # already over budget
+    assert budget.message_cap(0, 100_000) == MIN_SAMPLED_MESSAGES
+    assert budget.message_cap(0, MIN_SAMPLED_MESSAGES) == 0
+
+
+def test_working_memory_follows_the_headroom(budget, rss):
+    assert budget.working_memory_mb() == 25
+    rss.used = 99 * MB
+    assert budget.working_memory_mb() == MIN_WORKING_MEMORY_MB
+
+
+def test_embedding_buffer_stays_in_memory_when_it_fits(budget, tmp_path):
+    buffer = budget.embedding_buffer(1000, 384)  # 1.5 MB
+    assert not isinstance(buffer, np.memmap)
+    assert buffer.shape == (1000, 384) and buffer.dtype == np.float32
+    assert not list(tmp_path.iterdir())
+
+
+def test_embedding_buffer_spills_to_disk(budget, rss, tmp_path):
+    rss.used = 95 * MB
+    buffer = budget.embedding_buffer(4096, 384)  # 6 MB, twice that is over the 5 MB left
+    assert isinstance(buffer, np.memmap)
+    assert buffer.shape == (4096, 384) and buffer.dtype == np.float32
+    buffer[:] = 1.5
+    assert float(buffer.sum()) == 1.5 * 4096 * 384
+
+    spill_dirs = list(tmp_path.iterdir())
+    assert len(spill_dirs) == 1
+    assert budget.degradations["spilled_embeddings"] == 1
+    assert budget.report()["spilled_mb"] == 6.0
+    del buffer
+    budget.close()
+    assert not spill_dirs[0].exists()
+
+
+def test_embed_fills_the_buffer_in_chunks(budget, rss):
+    texts = ["x" * (i % 7) for i in range(EMBED_BATCH_SIZE * 40)]
+    embedder = FakeEmbedder()
+    embeddings = budget.embed(embedder, texts)
+    assert np.array_equal(embeddings[:, 0], [len(text) for text in texts])
+    assert embedder.batch_sizes == {EMBED_BATCH_SIZE}
+
+    rss.used = 90 * MB
+    embedder = FakeEmbedder()
+    assert np.array_equal(budget.embed(embedder, texts), embeddings)
+    assert embedder.batch_sizes == {LOW_MEMORY_EMBED_BATCH_SIZE}
+
+
+def test_stages_are_aggregated(budget, rss):
+    for growth in (2, 3):
+        with budget.stage("topics"):
+            rss.used += growth * MB
+    with budget.stage("stats"):
+        pass
+    stages = budget.report()["stages"]
+    assert stages["topics"]["calls"] == 2
+    assert stages["topics"]["rss_growth_mb"] == 5.0
+    assert stages["stats"]["calls"] == 1
+    assert budget.report()["used_mb"] == 5.0
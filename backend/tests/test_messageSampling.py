@@ -0,0 +1,66 @@
+import random
+from collections import Counter
+
+import pytest
+
+from messageSampling import stratified_sample
+
+
+def _timestamps(rng, months, n):
+    return [f"2024-{rng.choice(months):02d}-01T12:00:00+00:00" for _ in range(n)]
+
+
+def test_small_histories_are_kept_whole():
+    timestamps = ["2024-01-01T00:00:00", "2024-02-01T00:00:00"]
+    assert stratified_sample(timestamps, 5) == ([0, 1], [1.0, 1.0])
+    assert stratified_sample(timestamps * 10, 0) == (list(range(20)), [1.0] * 20)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_cap_and_weight_invariants(seed):
+    rng = random.Random(seed)
+    months = rng.sample(range(1, 13), rng.randint(1, 12))
+    timestamps = _timestamps(rng, months, rng.randint(1, 400))
+    if rng.random() < 0.1:
+        timestamps[0] = None  # messages without a timestamp form their own stratum
+    cap = rng.randint(1, 60)
+
+    kept, weights = stratified_sample(timestamps, cap)
+
+    assert len(kept) <= cap
+    assert kept == sorted(set(kept))
+    assert all(0 <= i < len(timestamps) for i in kept)
+    assert len(weights) == len(kept)
+    assert sum(weights) == pytest.approx(len(timestamps))
+
+
+def test_every_month_keeps_a_share_of_the_cap():
+    rng = random.Random(1)
+    timestamps = _timestamps(rng, [1], 900) + _timestamps(rng, [2], 90) + _timestamps(rng, [3], 10)
+    kept, weights = stratified_sample(timestamps, 100)
+
+    per_month = Counter(timestamps[i][:7] for i in kept)
+    assert len(kept) == 100
+    # One slot per month, the rest in proportion to the months' sizes.
+    assert per_month["2024-03"] >= 1
+    assert abs(per_month["2024-01"] - 1 - 97 * 899 / 997) <= 1
+    assert abs(per_month["2024-02"] - 1 - 97 * 89 / 997) <= 1
+    for i, weight in zip(kept, weights):
+        month = timestamps[i][:7]
+        assert weight == pytest.approx(Counter(ts[:7] for ts in timestamps)[month] / per_month[month])
+
+
+def test_cap_below_month_count_samples_the_largest_months():
+    timestamps = []
+    for month, size in zip(range(1, 7), [50, 40, 30, 3, 2, 1]):
+        timestamps += [f"2024-{month:02d}-01T00:00:00"] * size
+    kept, weights = stratified_sample(timestamps, 3)
+
+    assert sorted(timestamps[i][:7] for i in kept) == ["2024-01", "2024-02", "2024-03"]
+    assert sum(weights) == pytest.approx(len(timestamps))
+
+
+def test_sampling_is_deterministic():
+    rng = random.Random(7)
+    timestamps = _timestamps(rng, [1, 2, 3], 300)
+    assert stratified_sample(timestamps, 50) == stratified_sample(timestamps, 50)
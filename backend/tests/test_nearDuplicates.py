@@ -0,0 +1,63 @@
+import numpy as np
+
+from nearDuplicates import NUM_PERMUTATIONS, lsh_bands, minhash_signatures, suppress_near_duplicates
+
+SPAM = "check out my new server with free nitro giveaways every single day"
+
+
+def test_identical_messages_collapse_into_the_earliest():
+    texts = ["lol", "what are we doing tonight", "lol", "lol", "LOL!"]
+    kept, weights, report = suppress_near_duplicates(texts, 0.8)
+
+    assert kept == [0, 1]
+    assert weights.tolist() == [4, 1]
+    assert report["kept_messages"] == 2
+    assert report["removed_messages"] == 3
+
+
+def test_near_duplicates_group_and_distinct_messages_stay():
+    texts = [
+        SPAM,
+        "the exam is on friday, did anyone finish the practice problems",
+        SPAM + "!",
+        SPAM.replace("every", "evry"),
+        "i think pizza is better than pasta",
+    ]
+    kept, weights, _ = suppress_near_duplicates(texts, 0.7)
+
+    assert kept == [0, 1, 4]
+    assert weights.tolist() == [3, 1, 1]
+
+
+def test_interleaved_groups_are_counted_per_group():
+    a, b = SPAM, "completely unrelated message about the weekend trip"
+    kept, weights, _ = suppress_near_duplicates([b, a, b, a, a, b, a], 0.8)
+
+    assert kept == [0, 1]
+    assert weights.tolist() == [3, 4]
+    assert weights.sum() == 7
+
+
+def test_threshold_zero_and_tiny_inputs_keep_everything():
+    texts = ["lol"] * 3
+    kept, weights, report = suppress_near_duplicates(texts, 0)
+    assert kept == [0, 1, 2]
+    assert weights.tolist() == [1, 1, 1]
+    assert report["removed_fraction"] == 0
+
+    assert suppress_near_duplicates(["only one"], 0.8)[0] == [0]
+    assert suppress_near_duplicates([], 0.8)[0] == []
+
+
+def test_signatures_estimate_jaccard_similarity():
+    signatures = minhash_signatures([SPAM, SPAM, "nothing in common at all here"])
+    assert signatures.shape == (3, NUM_PERMUTATIONS)
+    assert np.array_equal(signatures[0], signatures[1])
+    assert np.mean(signatures[0] == signatures[2]) < 0.2
+
+
+def test_lsh_bands_put_the_s_curve_below_the_threshold():
+    for threshold in (0.5, 0.7, 0.8, 0.9):
+        bands, rows = lsh_bands(threshold)
+        assert bands * rows <= NUM_PERMUTATIONS
+        assert (1 / bands) ** (1 / rows) <= threshold
@@ -0,0 +1,60 @@
+import pytest
+
+from textScanner import (
+    HEART_EMOJIS,
+    LAUGHTER_KEYWORDS,
+    ROMANCE_KEYWORDS,
+    emoji_pattern,
+    scan_message,
+    scan_messages,
+    url_pattern,
+)
+
+MESSAGES = [
+    "",
+    "lol",
+    "lolol LOL haha hahaha",
+    "i love you darling, lovely loving adorable",
+    "❤️😍 xd 😘😘 💕💖💗💘💝",
+    "see https://example.com/a?b=c and http://x.y",
+    "https:// is not a link",
+    "İstanbul lol İİİ love",
+    "emoji run 😂😂🎉 then 🚀 flag 🇫🇷",
+    "loveloved romanceromantic passion amour",
+    "no matches here at all",
+    "rofl\x00lmao",
+]
+
+
+def _reference(text):
+    # The per-message counting the scanner replaces: str.count for every pattern.
+    lower = text.lower()
+    return (
+        sum(lower.count(k) for k in LAUGHTER_KEYWORDS),
+        sum(lower.count(k) for k in ROMANCE_KEYWORDS),
+        sum(lower.count(h) for h in HEART_EMOJIS),
+        emoji_pattern.findall(text),
+        bool(url_pattern.search(text)),
+    )
+
+
+@pytest.mark.parametrize("text", MESSAGES)
+def test_single_message_matches_str_count(text):
+    assert tuple(scan_message(text)) == _reference(text)
+
+
+def test_batch_matches_per_message_scans():
+    scans = scan_messages(MESSAGES)
+    assert len(scans) == len(MESSAGES)
+    for text, scan in zip(MESSAGES, scans):
+        assert tuple(scan) == _reference(text)
+
+
+def test_matches_do_not_span_messages():
+    scans = scan_messages(["lo", "l", "https:/", "/x"])
+    assert [scan.laughter for scan in scans] == [0, 0, 0, 0]
+    assert not any(scan.has_link for scan in scans)
+
+
+def test_empty_batch():
+    assert scan_messages([]) == []
@@ -0,0 +1,148 @@
+"""
+Batched scanning of message text for the humor/romance/emoji heuristics.
+
+The heuristics used to call str.count once per keyword and heart emoji, run the
+emoji regex separately and recompile the URL regex for every message. Here a
+whole batch of messages (all of a user's messages) is joined and scanned once:
+all keywords and hearts are located with one trie-shaped regex over the
+lowercased text, emoji runs with one regex over the original text (skipped when
+the batch has no astral-plane characters), and links with a literal-prefix
+search. Matches are mapped back to their message by position.
+
+Counts are exactly those of the old code: each pattern is counted like
+str.count (left to right, non-overlapping), independently of the others.
+"""
+import re
+from typing import List, NamedTuple
+
+LAUGHTER_KEYWORDS = ["lol", "haha", "lmao", "rofl", "xd"]
+ROMANCE_KEYWORDS = [
+    "love", "loved", "loving", "adorable", "adore", "sweetheart",
+    "dear", "darling", "romance", "romantic", "passion", "infatuation", "amour"
+]
+HEART_EMOJIS = ["❤️", "😍", "😘", "💕", "💖", "💗", "💘", "💝"]
+
+EMOJI_RANGES = (
+    u"\U0001F600-\U0001F64F"  # Emoticons
+    u"\U0001F300-\U0001F5FF"  # Symbols & pictographs
+    u"\U0001F680-\U0001F6FF"  # Transport & map symbols
+    u"\U0001F1E0-\U0001F1FF"  # Flags
+)
+emoji_pattern = re.compile("[" + EMOJI_RANGES + "]+", flags=re.UNICODE)
+url_pattern = re.compile(r'https?://\S+')
+
+SEPARATOR = "\x00"  # never part of a pattern, so no match can span two messages in a batch
+
+_PATTERNS = LAUGHTER_KEYWORDS + ROMANCE_KEYWORDS + HEART_EMOJIS
+_KIND = (
+    [0] * len(LAUGHTER_KEYWORDS) + [1] * len(ROMANCE_KEYWORDS) + [2] * len(HEART_EMOJIS)
+)
+# Patterns grouped by first character, so each trigger only checks its candidates.
+_BY_FIRST_CHAR = {}
+for _index, _pattern in enumerate(_PATTERNS):
+    _BY_FIRST_CHAR.setdefault(_pattern[0], []).append((_index, _pattern))
+
+
+
+def _trie_pattern(words):
+    """Regex for a set of literals, factored as a trie: "l(?:mao|o(?:l|v...))"."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        optional = "" in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if optional else "")
+
+    return build(trie)
+
+
+# Locates candidate start positions of any pattern in one pass over the text. The
+# search restarts one character after each hit, so overlapping occurrences of
+# different patterns are all visited.
+_trigger = re.compile(_trie_pattern(_PATTERNS))
+_link = re.compile(r'https?://[^\s' + SEPARATOR + ']')
+
+
+class MessageScan(NamedTuple):
+    laughter: int  # laughter keyword occurrences (lowercased text)
+    romance: int  # romance keyword occurrences (lowercased text)
+    hearts: int  # heart emoji occurrences
+    emojis: List[str]  # runs matched by emoji_pattern
+    has_link: bool
+
+
+def _ends(texts, sep_len=len(SEPARATOR)):
+    # Position (in the joined text) where each message ends.
+    ends = []
+    position = 0
+    for text in texts:
+        position += len(text)
+        ends.append(position)
+        position += sep_len
+    return ends
+
+
+def scan_messages(texts):
+    """Scans a batch of message texts and returns one MessageScan per text."""
+    if not texts:
+        return []
+    blob = SEPARATOR.join(texts)
+    lower = blob.lower()
+    ends = _ends(texts)
+    # lower() only ever lengthens a string (e.g. "İ"), so equal lengths mean equal offsets.
+    lower_ends = ends if len(lower) == len(blob) else _ends([text.lower() for text in texts])
+
+    counts = [[0, 0, 0] for _ in texts]
+    next_allowed = [0] * len(_PATTERNS)
+    by_first_char, kinds, startswith, search = _BY_FIRST_CHAR, _KIND, lower.startswith, _trigger.search
+    message, message_end = 0, lower_ends[0]
+    match = search(lower)
+    while match is not None:
+        position = match.start()
+        while position > message_end:  # matches come in order, so the message only moves forward
+            message += 1
+            message_end = lower_ends[message]
+        for index, pattern in by_first_char[lower[position]]:
+            if position >= next_allowed[index] and startswith(pattern, position):
+                next_allowed[index] = position + len(pattern)
+                counts[message][kinds[index]] += 1
+        match = search(lower, position + 1)
+
+    emojis = [[] for _ in texts]
+    # All the emoji ranges are outside the Basic Multilingual Plane, so a batch
+    # without such characters (cheap to check via UTF-16) needs no emoji pass.
+    if len(blob.encode("utf-16-le", "surrogatepass")) != 2 * len(blob):
+        message, message_end = 0, ends[0]
+        for match in emoji_pattern.finditer(blob):
+            position = match.start()
+            while position > message_end:
+                message += 1
+                message_end = ends[message]
+            emojis[message].append(match.group())
+
+    links = [False] * len(texts)
+    message, message_end = 0, ends[0]
+    for match in _link.finditer(blob):
+        position = match.start()
+        while position > message_end:
+            message += 1
+            message_end = ends[message]
+        links[message] = True
+
+    return [
+        MessageScan(laughter, romance, hearts, emojis[i], links[i])
+        for i, (laughter, romance, hearts) in enumerate(counts)
+    ]
+
+
+def scan_message(text):
+    return scan_messages([text])[0]
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+
+from orm import TopicResult
+from embeddingBackend import MODEL_NAME, EMBEDDER_BACKEND
+from llmClient import LLM_MODEL
+from nearDuplicates import NEAR_DUPLICATE_THRESHOLD
+from messageSampling import TOPIC_MESSAGE_CAP
+from topicLabeler import labeler_key
+
+load_dotenv()
+
+# Maximum number of memoized topic results kept in the database (0 disables the cache).
+TOPIC_CACHE_SIZE = int(os.getenv("TOPIC_CACHE_SIZE", "10000"))
+
+# Bump whenever find_favorite_topic() changes in a way that changes its output.
+TOPIC_PIPELINE_VERSION = "1"
+
+
+def _pipeline_key():
+    # Everything besides the messages that decides what find_favorite_topic() returns.
+    return json.dumps([
+        TOPIC_PIPELINE_VERSION,
+        MODEL_NAME,
+        EMBEDDER_BACKEND,
+        LLM_MODEL,
+        NEAR_DUPLICATE_THRESHOLD,
+        TOPIC_MESSAGE_CAP,
+        *labeler_key(),
+    ])
+
+
+def topic_fingerprint(username, messages):
+    """
+    Stable hash of the user's messages (id, timestamp and content, in export
+    order) plus the pipeline version. Equal fingerprints mean the topic
+    pipeline would see exactly the same input.
+    """
+    digest = hashlib.sha256()
+    digest.update(_pipeline_key().encode("utf-8"))
+    digest.update(b"\0" + username.encode("utf-8"))
+    for msg in messages:
+        if isinstance(msg, dict) and msg.get("author", {}).get("name") == username:
+            for field in ("id", "timestamp", "content"):
+                digest.update(b"\0" + str(msg.get(field, "")).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_topic(fingerprint):
+    """Returns (topic, topic_embedding) for a memoized result, or None."""
+    if TOPIC_CACHE_SIZE <= 0:
+        return None
+    row = TopicResult.get_or_none(TopicResult.fingerprint == fingerprint)
+    if row is None:
+        return None
+    TopicResult.update(last_used=datetime.now()).where(TopicResult.fingerprint == fingerprint).execute()
+    embedding = np.frombuffer(bytes(row.topic_embedding), dtype=np.float32).reshape(1, -1)
+    return json.loads(row.topic), embedding
+
+
+def put_topic(fingerprint, username, topic, topic_embedding):
+    """Stores a result and evicts the least recently used ones beyond TOPIC_CACHE_SIZE."""
+    if TOPIC_CACHE_SIZE <= 0:
+        return
+    TopicResult.insert(
+        fingerprint=fingerprint,
+        username=username,
+        topic=json.dumps(topic),
+        topic_embedding=np.asarray(topic_embedding, dtype=np.float32).tobytes(),
+        last_used=datetime.now(),
+    ).on_conflict_replace().execute()
+
+    stale = (
+        TopicResult.select(TopicResult.fingerprint)
+        .order_by(TopicResult.last_used.desc())
+        .offset(TOPIC_CACHE_SIZE)
+    )
+    TopicResult.delete().where(TopicResult.fingerprint.in_(stale)).execute()
@@ -0,0 +1,275 @@
+"""
+Topic drift: how a user's topics change from month to month.
+
+find_favorite_topic() clusters a user's whole history at once, so topics per
+month from it would mean re-clustering everything for every window. Instead,
+each user keeps a persistent set of topic centroids (online k-means over the
+MiniLM message embeddings) and an upload only embeds the messages that were
+not added before:
+
+  1. The user's new messages (by message id) are sampled down to
+     TOPIC_DRIFT_MESSAGE_CAP per month-stratified sample, embedded and
+     normalized.
+  2. A user without centroids gets them from k-means over this first batch,
+     with k picked by silhouette score like find_favorite_topic(). Later
+     batches are assigned to the nearest centroid; when enough messages are
+     farther than TOPIC_DRIFT_NEW_TOPIC_SIMILARITY from all of them, they are
+     clustered into new topics while the user has room for more.
+  3. Every centroid moves to the weighted mean of everything assigned to it
+     (mini-batch k-means update), the labels are recomputed from the clusters'
+     token counts, and the month counts in topicwindow grow by the messages
+     assigned in each month. A month keeps the label its topic had when the
+     month was first counted.
+
+Months already counted are never reassigned, so an upload costs time in
+proportion to its new messages and the timeline keeps what the topics were.
+"""
+import json
+import math
+import os
+from collections import Counter, defaultdict
+
+import numpy as np
+from dotenv import load_dotenv
+from peewee import EXCLUDED
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+
+from messageSampling import stratified_sample
+from orm import db, TopicCentroid, TopicWindow, TopicDriftMessage
+from topicModeling import clean_text, embedder
+
+load_dotenv()
+
+# Track every user's topics per month during ingestion ("1" to enable).
+TOPIC_DRIFT = os.getenv("TOPIC_DRIFT", "0").lower() in ("1", "true", "yes")
+# Maximum number of topic clusters per user.
+TOPIC_DRIFT_MAX_CLUSTERS = int(os.getenv("TOPIC_DRIFT_MAX_CLUSTERS", "8"))
+# Cosine similarity to the nearest centroid below which a message counts toward a new topic.
+TOPIC_DRIFT_NEW_TOPIC_SIMILARITY = float(os.getenv("TOPIC_DRIFT_NEW_TOPIC_SIMILARITY", "0.3"))
+# Maximum new messages per user embedded per upload (0 = no cap).
+TOPIC_DRIFT_MESSAGE_CAP = int(os.getenv("TOPIC_DRIFT_MESSAGE_CAP", "2000"))
+
+MIN_TOPIC_MESSAGES = 10  # sampled messages needed to start a topic
+MERGE_SIMILARITY = 0.9  # new topics at least this similar to another topic are merged into it
+TERMS_KEPT = 200  # token counts kept per cluster for labeling
+TOPIC_KEYWORDS = 5
+
+_ID_BATCH = 900  # ids per IN (...), under SQLite's bound-variable limit
+_INSERT_BATCH = 200  # rows per INSERT, under SQLite's bound-variable limit
+
+
+def _unit(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _new_messages(username, messages):
+    """The user's messages (by id, in order) that were not added to the centroids yet."""
+    new = {}
+    for msg in messages:
+        if isinstance(msg, dict) and msg.get("author", {}).get("name") == username and msg.get("id") is not None:
+            new[str(msg["id"])] = msg
+    ids = list(new)
+    for start in range(0, len(ids), _ID_BATCH):
+        query = TopicDriftMessage.select(TopicDriftMessage.message_id).where(
+            TopicDriftMessage.message_id.in_(ids[start:start + _ID_BATCH])
+        )
+        for (message_id,) in query.tuples():
+            del new[message_id]
+    return new
+
+
+def _cluster(vectors, weights, max_clusters):
+    """Unit-length centers of up to max_clusters topics in vectors."""
+    best_centers = _unit(np.average(vectors, axis=0, weights=weights)[None, :])
+    best_score = -1
+    for k in range(2, min(max_clusters, len(vectors) // MIN_TOPIC_MESSAGES) + 1):
+        kmeans = KMeans(n_clusters=k, random_state=42).fit(vectors, sample_weight=weights)
+        if len(set(kmeans.labels_)) < 2:
+            continue
+        score = silhouette_score(vectors, kmeans.labels_)
+        if score > best_score:
+            best_score = score
+            best_centers = _unit(kmeans.cluster_centers_)
+    return best_centers.astype(np.float32)
+
+
+def _assign(vectors, weights, centers, max_clusters=TOPIC_DRIFT_MAX_CLUSTERS):
+    """
+    Nearest-centroid cluster of every vector. Returns (labels, centers), where
+    centers has the new topics appended; new topics that end up with no
+    message, or nearly duplicate another topic, are dropped again.
+    """
+    known = len(centers)
+    if known == 0:
+        centers = _cluster(vectors, weights, max_clusters)
+    elif known < max_clusters:
+        outliers = (vectors @ centers.T).max(axis=1) < TOPIC_DRIFT_NEW_TOPIC_SIMILARITY
+        if outliers.sum() >= MIN_TOPIC_MESSAGES:
+            added = _cluster(vectors[outliers], weights[outliers], max_clusters - known)
+            centers = np.vstack([centers, added])
+    # k-means splits a single broad topic in two when that scores best, so near-parallel new centers are merged.
+    kept = list(range(known))
+    for i in range(known, len(centers)):
+        if not kept or (centers[kept] @ centers[i]).max() < MERGE_SIMILARITY:
+            kept.append(i)
+    centers = centers[kept]
+    labels = (vectors @ centers.T).argmax(axis=1)
+    used = np.bincount(labels, minlength=len(centers)) > 0
+    if not used[known:].all():
+        centers = centers[np.concatenate([np.ones(known, dtype=bool), used[known:]])]
+        labels = (vectors @ centers.T).argmax(axis=1)
+    return labels, centers
+
+
+def _keywords(term_counts):
+    """
+    Keywords per cluster: frequent tokens, boosted when few of the user's other
+    clusters use them, with scores normalized to percentages.
+    """
+    clusters_using = Counter(term for terms in term_counts for term in terms)
+    keywords = []
+    for terms in term_counts:
+        scored = sorted(
+            ((count * math.log(1 + len(term_counts) / clusters_using[term]), term) for term, count in terms.items()),
+            key=lambda item: (-item[0], item[1]),
+        )[:TOPIC_KEYWORDS]
+        total = sum(score for score, _ in scored)
+        keywords.append([{"keyword": term, "score": score / total * 100} for score, term in scored])
+    return keywords
+
+
+def update_topic_drift(username, messages, cap=TOPIC_DRIFT_MESSAGE_CAP):
+    """
+    Adds the user's new messages to their topic centroids and monthly topic
+    counts. Returns the number of new messages.
+    """
+    new = _new_messages(username, messages)
+    if not new:
+        return 0
+
+    ids, texts, tokens, timestamps = [], [], [], []
+    for message_id, msg in new.items():
+        message_tokens = clean_text(msg.get("content") or "")
+        if message_tokens:
+            ids.append(message_id)
+            texts.append(msg["content"])
+            tokens.append(message_tokens)
+            timestamps.append(msg.get("timestamp"))
+    sampled, sample_weights = stratified_sample(timestamps, cap)
+    clusters = {}
+    if sampled:
+        vectors = _unit(np.asarray(embedder.encode([texts[i] for i in sampled]), dtype=np.float32))
+        weights = np.asarray(sample_weights, dtype=np.float64)
+
+    # IMMEDIATE takes the write lock before the reads, so topic workers updating
+    # other users wait for each other instead of failing to upgrade a read lock.
+    with db.atomic(lock_type="IMMEDIATE"):
+        if sampled:
+            stored = list(TopicCentroid.select().where(TopicCentroid.username == username).order_by(TopicCentroid.cluster))
+            centers = np.array(
+                [np.frombuffer(bytes(row.centroid), dtype=np.float32) for row in stored], dtype=np.float32
+            ).reshape(len(stored), vectors.shape[1])
+            labels, centers = _assign(vectors, weights, centers)
+
+            counts = [row.messages for row in stored] + [0.0] * (len(centers) - len(stored))
+            terms = [Counter(json.loads(row.terms)) for row in stored] + [Counter() for _ in range(len(centers) - len(stored))]
+            windows = defaultdict(float)
+            for cluster in range(len(centers)):
+                members = labels == cluster
+                if not members.any():
+                    continue
+                added = weights[members].sum()
+                # Running weighted mean of every message assigned so far, projected back to unit length.
+                mean = (centers[cluster] * counts[cluster] + weights[members] @ vectors[members]) / (counts[cluster] + added)
+                centers[cluster] = _unit(mean[None, :])[0]
+                counts[cluster] += added
+            for position, (i, cluster) in enumerate(zip(sampled, labels.tolist())):
+                clusters[ids[i]] = cluster
+                terms[cluster].update(tokens[i])
+                if timestamps[i]:
+                    # ISO timestamps start with "YYYY-MM", the window key.
+                    windows[(timestamps[i][:7], cluster)] += weights[position]
+            terms = [Counter(dict(counter.most_common(TERMS_KEPT))) for counter in terms]
+
+            rows = [
+                {
+                    "username": username,
+                    "cluster": cluster,
+                    "centroid": centers[cluster].astype(np.float32).tobytes(),
+                    "messages": counts[cluster],
+                    "terms": json.dumps(terms[cluster]),
+                    "label": keywords[0]["keyword"] if keywords else None,
+                    "keywords": json.dumps(keywords),
+                }
+                for cluster, keywords in enumerate(_keywords(terms))
+            ]
+            TopicCentroid.insert_many(rows).on_conflict_replace().execute()
+
+            # A month keeps the label its topic had when the month was first counted,
+            # so relabeling a cluster later doesn't rewrite the past.
+            window_rows = [
+                {"username": username, "window": window, "cluster": cluster, "messages": count, "label": rows[cluster]["label"]}
+                for (window, cluster), count in windows.items()
+            ]
+            for start in range(0, len(window_rows), _INSERT_BATCH):
+                TopicWindow.insert_many(window_rows[start:start + _INSERT_BATCH]).on_conflict(
+                    conflict_target=[TopicWindow.username, TopicWindow.window, TopicWindow.cluster],
+                    update={TopicWindow.messages: TopicWindow.messages + EXCLUDED.messages},
+                ).execute()
+
+        seen = [{"message_id": message_id, "cluster": clusters.get(message_id)} for message_id in new]
+        for start in range(0, len(seen), _INSERT_BATCH):
+            TopicDriftMessage.insert_many(seen[start:start + _INSERT_BATCH]).on_conflict_ignore().execute()
+    return len(new)
+
+
+def topic_timeline(username, start=None, end=None):
+    """
+    The user's topics (with their current labels) and, for every month from
+    start to end ("YYYY-MM", inclusive, either may be None), each topic's
+    messages, share and label as of that month.
+    """
+    topics = {
+        row.cluster: {
+            "cluster": row.cluster,
+            "label": row.label,
+            "keywords": json.loads(row.keywords or "[]"),
+            "messages": round(row.messages, 1),
+        }
+        for row in TopicCentroid.select().where(TopicCentroid.username == username).order_by(TopicCentroid.cluster)
+    }
+
+    where = TopicWindow.username == username
+    if start is not None:
+        where &= TopicWindow.window >= start
+    if end is not None:
+        where &= TopicWindow.window <= end
+    by_window = defaultdict(dict)
+    for window, cluster, messages, label in TopicWindow.select(
+        TopicWindow.window, TopicWindow.cluster, TopicWindow.messages, TopicWindow.label
+    ).where(where).tuples():
+        if label is None and cluster in topics:
+            label = topics[cluster]["label"]  # counted before window labels were stored
+        by_window[window][cluster] = (messages, label)
+
+    timeline = []
+    for window in sorted(by_window):
+        total = sum(messages for messages, _ in by_window[window].values())
+        window_topics = [
+            {
+                "cluster": cluster,
+                "label": label,
+                "messages": round(messages, 1),
+                "share": round(messages / total, 4),
+            }
+            for cluster, (messages, label) in sorted(by_window[window].items(), key=lambda item: -item[1][0])
+        ]
+        timeline.append({
+            "window": window,
+            "messages": round(total, 1),
+            "dominant": window_topics[0]["label"],
+            "topics": window_topics,
+        })
+    return {"username": username, "topics": list(topics.values()), "timeline": timeline}
@@ -0,0 +1,181 @@
+"""
+Local topic labels: the nearest word of a fixed vocabulary instead of an LLM call.
+
+The candidate labels (topicLabels.txt, a few thousand one-word topics) are
+embedded once with MiniLM and stored as a unit-length float32 matrix:
+
+    python topicLabeler.py build
+    python topicLabeler.py label pizza pasta cheese   # try the labels out
+
+With TOPIC_LABELER=local a topic is labeled with the vocabulary word closest
+(cosine) to the score-weighted mean of its top KeyBERT keyword vectors.
+Keywords that are vocabulary words reuse their stored vectors, so only the
+others are embedded, and label() handles any number of topics with one
+matrix product. find_favorite_topic() still asks the LLM when the best word
+is less similar than TOPIC_LABEL_MIN_SIMILARITY.
+"""
+import argparse
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from dotenv import load_dotenv
+from scipy.sparse import csr_matrix
+
+from embeddingBackend import MODEL_NAME
+
+load_dotenv()
+
+# How favorite topics are labeled: "llm" (one chat call per user) or "local" (nearest vocabulary word).
+TOPIC_LABELER = os.getenv("TOPIC_LABELER", "llm")
+# The embedded vocabulary written by `python topicLabeler.py build`.
+TOPIC_LABEL_VOCABULARY = os.getenv(
+    "TOPIC_LABEL_VOCABULARY", os.path.join(os.path.dirname(__file__), "models", "topic_labels.npz")
+)
+# Below this cosine similarity between the keywords and the nearest word, the LLM labels the topic.
+TOPIC_LABEL_MIN_SIMILARITY = float(os.getenv("TOPIC_LABEL_MIN_SIMILARITY", "0.5"))
+
+TOPIC_LABEL_WORDS = os.path.join(os.path.dirname(__file__), "topicLabels.txt")
+LABEL_KEYWORDS = 5  # top keywords averaged per topic
+ENCODED_KEYWORDS_KEPT = 10000  # vectors of keywords outside the vocabulary kept between calls
+_LABEL_BATCH = 1024  # topics per similarity product, bounding the (topics x vocabulary) scores
+
+if TOPIC_LABELER not in ("llm", "local"):
+    raise ValueError(f"Unknown TOPIC_LABELER {TOPIC_LABELER!r} (expected llm or local)")
+
+
+def _unit(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def read_words(path=TOPIC_LABEL_WORDS):
+    """The candidate labels in a word list: one per line, "#" starts a comment line."""
+    words = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            word = line.strip().lower()
+            if word and not word.startswith("#"):
+                words.append(word)
+    return list(dict.fromkeys(words))
+
+
+def build_vocabulary(embedder, words_path=TOPIC_LABEL_WORDS, out_path=TOPIC_LABEL_VOCABULARY):
+    """Embeds the word list and writes the vocabulary archive; returns the number of words."""
+    words = read_words(words_path)
+    vectors = _unit(np.asarray(embedder.encode(words, batch_size=256), dtype=np.float32))
+    digest = hashlib.sha256(json.dumps([MODEL_NAME, words]).encode("utf-8")).hexdigest()
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, "wb") as f:
+        np.savez(f, words=np.array(words), vectors=vectors, model=np.array(MODEL_NAME), digest=np.array(digest))
+    return len(words)
+
+
+@lru_cache(maxsize=None)
+def vocabulary_digest(path=TOPIC_LABEL_VOCABULARY):
+    """Hash of the embedded words and model, or None when the vocabulary wasn't built."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as archive:
+        return str(archive["digest"])
+
+
+def labeler_key():
+    # What decides the labels besides the keywords; part of the topic cache key.
+    if TOPIC_LABELER == "llm":
+        return []
+    return [TOPIC_LABELER, TOPIC_LABEL_MIN_SIMILARITY, vocabulary_digest()]
+
+
+class TopicLabeler:
+    def __init__(self, embedder, path=TOPIC_LABEL_VOCABULARY):
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No topic label vocabulary at {path}; run `python topicLabeler.py build` first"
+            )
+        with np.load(path) as archive:
+            model = str(archive["model"])
+            self.words = archive["words"].tolist()
+            self.vectors = np.ascontiguousarray(archive["vectors"], dtype=np.float32)
+        if model != MODEL_NAME:
+            raise ValueError(f"{path} was embedded with {model}, not {MODEL_NAME}; rebuild it")
+        self.embedder = embedder
+        self.index = {word: i for i, word in enumerate(self.words)}
+        self._encoded = OrderedDict()  # keyword -> unit vector, for keywords outside the vocabulary
+
+    def _keyword_vectors(self, keywords):
+        vectors = np.empty((len(keywords), self.vectors.shape[1]), dtype=np.float32)
+        missing = []
+        for i, keyword in enumerate(keywords):
+            if keyword in self.index:
+                vectors[i] = self.vectors[self.index[keyword]]
+            elif keyword in self._encoded:
+                vectors[i] = self._encoded[keyword]
+                self._encoded.move_to_end(keyword)
+            else:
+                missing.append(i)
+        if missing:
+            encoded = _unit(np.asarray(self.embedder.encode([keywords[i] for i in missing]), dtype=np.float32))
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                self._encoded[keywords[i]] = vector
+            while len(self._encoded) > ENCODED_KEYWORDS_KEPT:
+                self._encoded.popitem(last=False)
+        return vectors
+
+    def label(self, keyword_lists):
+        """
+        Labels many topics at once. Each entry is a topic's keywords as
+        find_favorite_topic() returns them ({"keyword", "score"}, best first).
+        Returns (labels, similarities): the nearest vocabulary word to every
+        topic and its cosine similarity ("" and 0 for a topic without keywords).
+        """
+        keywords = {}
+        rows, columns, scores = [], [], []
+        for row, topic_keywords in enumerate(keyword_lists):
+            for keyword in topic_keywords[:LABEL_KEYWORDS]:
+                columns.append(keywords.setdefault(keyword["keyword"].lower(), len(keywords)))
+                rows.append(row)
+                scores.append(keyword["score"])
+        labels = [""] * len(keyword_lists)
+        similarities = np.zeros(len(keyword_lists), dtype=np.float32)
+        if not keywords:
+            return labels, similarities
+
+        weights = csr_matrix((scores, (rows, columns)), shape=(len(keyword_lists), len(keywords)), dtype=np.float32)
+        means = _unit(np.asarray(weights @ self._keyword_vectors(list(keywords))))
+        labeled = np.diff(weights.indptr) > 0
+        for start in range(0, len(means), _LABEL_BATCH):
+            similarity = means[start:start + _LABEL_BATCH] @ self.vectors.T
+            best = similarity.argmax(axis=1)
+            similarities[start:start + len(best)] = similarity[np.arange(len(best)), best]
+            for i, word in enumerate(best.tolist(), start):
+                if labeled[i]:
+                    labels[i] = self.words[word]
+        return labels, similarities
+
+
+if __name__ == "__main__":
+    from embeddingBackend import load_embedder
+
+    parser = argparse.ArgumentParser(description="Build or try the vocabulary of local topic labels.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="embed the word list into the vocabulary archive")
+    build_parser.add_argument("--words", default=TOPIC_LABEL_WORDS, help="word list, one candidate label per line")
+    build_parser.add_argument("--out", default=TOPIC_LABEL_VOCABULARY)
+    label_parser = subparsers.add_parser("label", help="print the label and similarity for some keywords")
+    label_parser.add_argument("keywords", nargs="+", help="keywords, best first (scored equally)")
+    label_parser.add_argument("--vocabulary", default=TOPIC_LABEL_VOCABULARY)
+    args = parser.parse_args()
+
+    embedder = load_embedder()
+    if args.command == "build":
+        count = build_vocabulary(embedder, args.words, args.out)
+        print(f"Embedded {count} labels into {args.out}")
+    else:
+        labeler = TopicLabeler(embedder, args.vocabulary)
+        labels, similarities = labeler.label([[{"keyword": keyword, "score": 1.0} for keyword in args.keywords]])
+        print(f"{labels[0]} (similarity {similarities[0]:.3f}, LLM below {TOPIC_LABEL_MIN_SIMILARITY})")
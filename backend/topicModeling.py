@@ -6,12 +6,17 @@ from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from collections import defaultdict
-from sentence_transformers import SentenceTransformer
+from embeddingBackend import load_embedder, keybert_model
+from sklearn import config_context
 from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score
 from sklearn.feature_extraction.text import TfidfVectorizer
 from keybert import KeyBERT
-from openai import OpenAI  # Using the new client format
+from nearDuplicates import suppress_near_duplicates
+from messageSampling import stratified_sample, TOPIC_MESSAGE_CAP
+from llmClient import chat  # shared, pooled OpenAI client
+from openai import OpenAIError
+from topicLabeler import TOPIC_LABELER, TOPIC_LABEL_MIN_SIMILARITY, TopicLabeler
 from dotenv import load_dotenv
 
 import os
@@ -20,22 +25,20 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 load_dotenv()
 
-api_key = os.getenv("OPENAI_API_KEY")
-
 # --- Setup: Download required NLTK data ---
 nltk.download('punkt')
 nltk.download('punkt_tab')
 nltk.download('stopwords')
 nltk.download('vader_lexicon')
 
-# --- Setup OpenAI GPT-4o Client ---
-client = OpenAI(api_key=api_key)  # Make sure your API key is set appropriately (e.g., via the OPENAI_API_KEY env variable)
-
-# --- Setup SentenceTransformer for embeddings ---
-embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+# --- Setup the MiniLM embedder (backend chosen with EMBEDDER_BACKEND) ---
+embedder = load_embedder()
 
 # --- Setup KeyBERT using the same embedding model ---
-kw_model = KeyBERT("all-MiniLM-L6-v2")
+kw_model = KeyBERT(keybert_model(embedder))
+
+# --- Setup the local topic labeler (TOPIC_LABELER=local; see topicLabeler.py) ---
+topic_labeler = TopicLabeler(embedder) if TOPIC_LABELER == "local" else None
 
 # --- Function to clean and tokenize text using NLTK's default stopwords ---
 def clean_text(text):
@@ -53,17 +56,27 @@ def auto_label_topic_with_hf(keywords, topn=10):
         "Based solely on these keywords, provide one single, descriptive word that summarizes the topic. "
         "Answer with one word only, no extra text or punctuation."
     )
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "developer", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ]
-    )
+    reply = chat([
+        {"role": "developer", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ])
     # Following the provided format; adjust extraction as needed.
-    label = completion.choices[0].message.content.strip().split()[0]
+    label = reply.split()[0]
     return label
 
+# --- Function to label a topic: the nearest vocabulary word, or GPT-4o when none is close ---
+def label_topic(keywords):
+    if topic_labeler is None:
+        return auto_label_topic_with_hf([kw["keyword"] for kw in keywords], topn=10)
+    labels, similarities = topic_labeler.label([keywords])
+    if similarities[0] >= TOPIC_LABEL_MIN_SIMILARITY:
+        return labels[0]
+    try:
+        return auto_label_topic_with_hf([kw["keyword"] for kw in keywords], topn=10)
+    except OpenAIError as e:
+        print(f"LLM topic labeling failed ({e}); using the nearest vocabulary word {labels[0]!r}")
+        return labels[0]
+
 # --- Function to compute top keywords from aggregated tokens using KeyBERT ---
 def compute_cluster_keywords(tokens, topn=10):
     aggregated_text = " ".join(tokens)
@@ -79,8 +92,11 @@ def compute_cluster_keywords(tokens, topn=10):
     return normalized_keywords
 
 # --- Main function to process the chat history and find the favorite topic ---
-def find_favorite_topic(username, data):
+def find_favorite_topic(username, data, near_duplicate_threshold=None, message_cap=None, vector_sink=None, memory_budget=None):
     # --- Load the JSON file ---
+    # vector_sink(message_ids, timestamps, embeddings), when given, receives the
+    # message embeddings computed below instead of letting them be discarded.
+    # memory_budget (see memoryBudget.py) bounds the embedding matrix and KMeans copies.
 
     if isinstance(data, dict) and "messages" in data:
         messages = data["messages"]
@@ -92,6 +108,8 @@ def find_favorite_topic(username, data):
     filtered_target_messages = []    # raw messages with non-empty cleaned tokens
     filtered_cleaned_docs = []       # list of token lists
     filtered_sentiment_scores = []   # sentiment scores
+    filtered_timestamps = []         # ISO timestamps, used for time-stratified sampling
+    filtered_ids = []                # message ids, handed to vector_sink
 
     for msg in messages:
         if isinstance(msg, dict) and msg.get("author", {}).get("name") == username:
@@ -102,32 +120,74 @@ def find_favorite_topic(username, data):
                     filtered_target_messages.append(content)
                     filtered_cleaned_docs.append(tokens)
                     filtered_sentiment_scores.append(sia.polarity_scores(content)['compound'])
+                    filtered_timestamps.append(msg.get("timestamp"))
+                    filtered_ids.append(msg.get("id"))
 
     if not filtered_target_messages:
         return {"keywords": [], "label": ""}
 
+    # --- Collapse near-duplicate messages (spam, copypasta, "lol") into weighted representatives ---
+    kept, weights, dedup_report = suppress_near_duplicates(filtered_target_messages, near_duplicate_threshold)
+    print(
+        f"Near-duplicate filter for {username}: kept {dedup_report['kept_messages']} of "
+        f"{dedup_report['input_messages']} messages ({dedup_report['removed_fraction']:.1%} removed)"
+    )
+    filtered_target_messages = [filtered_target_messages[i] for i in kept]
+    filtered_cleaned_docs = [filtered_cleaned_docs[i] for i in kept]
+    filtered_sentiment_scores = [filtered_sentiment_scores[i] for i in kept]
+    filtered_timestamps = [filtered_timestamps[i] for i in kept]
+    filtered_ids = [filtered_ids[i] for i in kept]
+
+    # --- Cap very heavy posters with a time-stratified sample of their history ---
+    if message_cap is None:
+        message_cap = TOPIC_MESSAGE_CAP
+    sampled, inclusion_weights = stratified_sample(filtered_timestamps, message_cap)
+    if len(sampled) < len(filtered_target_messages):
+        print(f"Sampled {len(sampled)} of {len(filtered_target_messages)} messages for {username}")
+        filtered_target_messages = [filtered_target_messages[i] for i in sampled]
+        filtered_cleaned_docs = [filtered_cleaned_docs[i] for i in sampled]
+        filtered_sentiment_scores = [filtered_sentiment_scores[i] for i in sampled]
+        filtered_timestamps = [filtered_timestamps[i] for i in sampled]
+        filtered_ids = [filtered_ids[i] for i in sampled]
+        weights = weights[sampled] * inclusion_weights
+
     # --- Compute sentence embeddings for each valid message ---
-    embeddings = embedder.encode(filtered_target_messages, show_progress_bar=True)
+    if memory_budget is None:
+        embeddings = embedder.encode(filtered_target_messages, show_progress_bar=True)
+    else:
+        embeddings = memory_budget.embed(embedder, filtered_target_messages)
+    if vector_sink is not None:
+        vector_sink(filtered_ids, filtered_timestamps, embeddings)
 
     # --- Cluster embeddings using KMeans and choose the optimal number using silhouette score ---
+    # Each representative counts as many times as the messages it stands for.
     best_k = None
     best_score = -1
-    best_labels = None
+    best_labels = [0] * len(filtered_target_messages)  # single cluster when there is too little to split
+    # Low on memory, KMeans centers the embeddings in place instead of on a copy
+    # and silhouette_score works in chunks that fit the budget.
+    copy_x = memory_budget is None or not memory_budget.low
+    working_memory = memory_budget.working_memory_mb() if memory_budget is not None else None
     for k in range(2, min(10, len(filtered_target_messages))):
-        kmeans = KMeans(n_clusters=k, random_state=42)
-        labels = kmeans.fit_predict(embeddings)
-        score = silhouette_score(embeddings, labels)
+        kmeans = KMeans(n_clusters=k, random_state=42, copy_x=copy_x)
+        labels = kmeans.fit_predict(embeddings, sample_weight=weights)
+        if len(set(labels)) < 2:
+            continue
+        with config_context(working_memory=working_memory):
+            score = silhouette_score(embeddings, labels)
         if score > best_score:
             best_score = score
             best_k = k
             best_labels = labels
 
     # --- Aggregate data by cluster ---
+    # Counts and sentiment are weighted; tokens are added once per representative so
+    # repeated messages don't inflate the TF-IDF scores.
     cluster_data = defaultdict(lambda: {"indices": [], "count": 0, "sentiment_sum": 0.0, "tokens": []})
     for i, label in enumerate(best_labels):
         cluster_data[label]["indices"].append(i)
-        cluster_data[label]["count"] += 1
-        cluster_data[label]["sentiment_sum"] += filtered_sentiment_scores[i]
+        cluster_data[label]["count"] += weights[i]
+        cluster_data[label]["sentiment_sum"] += weights[i] * filtered_sentiment_scores[i]
         cluster_data[label]["tokens"].extend(filtered_cleaned_docs[i])
 
     # --- Compute aggregated TF-IDF scores for each cluster ---
@@ -162,8 +222,8 @@ def find_favorite_topic(username, data):
     extracted_keywords = compute_cluster_keywords(cluster_data[favorite_cluster]["tokens"], topn=10)
     keywords = [{"keyword": keyword, "score": score} for keyword, score in extracted_keywords]
 
-    # --- Generate a one-word label for the favorite topic using GPT-4o ---
-    favorite_label = auto_label_topic_with_hf([kw["keyword"] for kw in keywords], topn=10)
+    # --- Generate a one-word label for the favorite topic (locally or using GPT-4o) ---
+    favorite_label = label_topic(keywords)
 
     return {"keywords": keywords, "label": favorite_label}
 
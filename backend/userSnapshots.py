@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from orm import UserSnapshot
+
+# Metrics that can be requested from the trend endpoint (all are UserSnapshot columns).
+SNAPSHOT_METRICS = [
+    "total_messages",
+    "average_messages_per_day",
+    "longest_active_conversation_seconds",
+    "longest_period_without_messages_seconds",
+    "total_meaningful_words",
+    "unique_words_used",
+    "average_words_per_message",
+    "total_emoji_used",
+    "messages_with_emoji",
+    "total_emoji_used_in_reactions",
+    "dryness_score",
+    "humor_score",
+    "romance_score",
+]
+
+
+def snapshot_metrics(stats):
+    """Pulls the numeric metrics out of a parse_messages() result."""
+    counts = stats.get("Message Counts and Types", {})
+    activity = stats.get("Activity Metrics", {})
+    words = stats.get("Word Usage Statistics", {})
+    emoji = stats.get("Emoji Usage (in text and reactions)", {})
+    features = stats["Features"]
+    return {
+        "total_messages": counts.get("total_messages", 0),
+        "average_messages_per_day": activity.get("average_messages_per_day", 0),
+        "longest_active_conversation_seconds": features["longest_active_conversation_seconds"],
+        "longest_period_without_messages_seconds": features["longest_period_without_messages_seconds"],
+        "total_meaningful_words": words.get("total_meaningful_words", 0),
+        "unique_words_used": words.get("unique_words_used", 0),
+        "average_words_per_message": words.get("average_words_per_message", 0),
+        "total_emoji_used": emoji.get("total_emoji_used", 0),
+        "messages_with_emoji": emoji.get("messages_with_at_least_one_emoji", 0),
+        "total_emoji_used_in_reactions": emoji.get("total_emoji_used_in_reactions", 0),
+        "dryness_score": stats.get("Dryness Score"),
+        "humor_score": stats.get("Humor Score"),
+        "romance_score": stats.get("Romance Score"),
+    }
+
+
+def record_snapshot(username, conversation_id, favorite_topic, stats):
+    """Appends (or replaces, on re-ingestion of the same upload) one snapshot row."""
+    UserSnapshot.insert(
+        username=username,
+        conversation_id=conversation_id,
+        timestamp=datetime.fromisoformat(conversation_id),
+        favorite_topic=favorite_topic,
+        **snapshot_metrics(stats),
+    ).on_conflict_replace().execute()
+
+
+def metric_series(username, metrics):
+    """
+    Returns the user's snapshots in time order with the requested metrics, using
+    the (username, timestamp) index so the cost depends only on this user's rows.
+    """
+    columns = [getattr(UserSnapshot, metric) for metric in metrics]
+    query = (
+        UserSnapshot.select(UserSnapshot.timestamp, UserSnapshot.conversation_id, *columns)
+        .where(UserSnapshot.username == username)
+        .order_by(UserSnapshot.timestamp)
+        .tuples()
+    )
+    return [
+        {"timestamp": row[0].isoformat(), "conversation_id": row[1], **dict(zip(metrics, row[2:]))}
+        for row in query
+    ]